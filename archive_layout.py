@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+from media_date import capture_date
+from exclude_matcher import get_matcher
+from sync_log import open_log
+from native_sync import NativeSync, SyncResult, SyncCancelled, copy_file
+
+"""
+Date sharded archive layout: YYYY/YYYY-MM-DD/<file name>
+
+Thousands of files in one flat directory make lookups slow on exFAT/FAT backup
+drives. With "archive_layout": "dated" in config.json, ingests file each photo
+or video under its capture date (read from the header by media_date.py, falling
+back to the file mtime) inside backup_subdir. Backups copy the local tree as is,
+so backup drives get the same layout.
+
+Run once to move an existing flat folder into the dated layout (locally and on
+each backup drive, files are renamed, not copied):
+
+    python archive_layout.py migrate <directory> [--dry-run]
+"""
+
+
+def dated_rel_path(name, date):
+    """ Returns the path of a file in the dated layout, relative to the archive root. """
+    return os.path.join(f"{date:%Y}", f"{date:%Y-%m-%d}", name)
+
+
+def _unique_rel_path(rel_path, taken):
+    """ Adds _1, _2... before the extension until the path is not taken. """
+    stem, ext = os.path.splitext(rel_path)
+    n = 1
+    while f"{stem}_{n}{ext}" in taken:
+        n += 1
+    return f"{stem}_{n}{ext}"
+
+
+class DatedIngest(NativeSync):
+    """
+    Ingest engine that copies new files from a source into the dated layout.
+    Same run_sync() interface as DirSync and NativeSync.
+    """
+
+    def run_sync(self, source_dir: str, dest_dir: str, exclude_file: Optional[str] = None,
+                 files: Optional[list] = None, cancel=None, mirrors=None, throttle=None):
+        """
+        Copies files from source_dir into dest_dir/YYYY/YYYY-MM-DD/.
+        A file whose name and size are already anywhere in the archive is skipped
+        without reading its header.
+
+        Args:
+            source_dir (str): The source directory for the ingest.
+            dest_dir (str): The archive root. Must exist.
+            exclude_file (Optional[str]): rsync style exclude file.
+            files (Optional[list]): Paths relative to source_dir to ingest. If given,
+                only these files are considered instead of walking the source.
+            cancel (threading.Event, optional): Stops the ingest before the next file when set.
+            mirrors (Optional[list]): Archive roots on backup drives, or (root, ExcludeMatcher)
+                pairs, that also get each file at the same dated path, read from the source only once.
+            throttle (callable, optional): Limits the bandwidth, see NativeSync.run_sync.
+
+        Returns:
+            SyncResult: copied holds paths relative to dest_dir.
+        """
+        if not os.path.isdir(source_dir):
+            print(f"Error: Source directory '{source_dir}' does not exist.")
+            raise FileNotFoundError(source_dir)
+        if not os.path.isdir(dest_dir):
+            print(f"Error: Destination directory '{dest_dir}' not found.")
+            raise FileNotFoundError(dest_dir)
+
+        matcher = get_matcher(exclude_file)
+        result = SyncResult(source_dir, dest_dir)
+
+        start_dt = datetime.now()
+        with open_log(self.log_file, source_dir, dest_dir) as log:
+            log.write(f"\n-------- {start_dt:%m-%d-%Y %H:%M} {'-'*40}\n")
+            log.write(f"from {source_dir}\n")
+            log.write(f"  to {dest_dir} (dated layout)\n\n")
+
+            manifest = self.load_manifest(dest_dir)
+            if files is None:
+                source_files, result.excluded = self.scan_source(source_dir, matcher)
+            else:
+                source_files, result.excluded = self.scan_files(source_dir, files, matcher)
+
+            dest_files = manifest["files"]
+            archived = {(os.path.basename(p), size) for p, size in dest_files.items()}
+
+            total = sum(1 for p, size in source_files.items() if (os.path.basename(p), size) not in archived)
+            touched = set()
+            sinks = self._start_mirrors(mirrors)
+            run_started = time.time()
+            self._event("run_start", source_dir, dest_dir, engine="dated")
+            try:
+                for rel_path in sorted(source_files):
+                    name = os.path.basename(rel_path)
+                    if (name, source_files[rel_path]) in archived:
+                        result.skipped += 1
+                        continue
+                    if cancel is not None and cancel.is_set():
+                        raise SyncCancelled(source_dir)
+
+                    src = os.path.join(source_dir, rel_path)
+                    dest_rel = dated_rel_path(name, capture_date(src))
+                    if dest_rel in dest_files:
+                        # same name and date but a different file
+                        dest_rel = _unique_rel_path(dest_rel, dest_files)
+
+                    rel_dir = os.path.dirname(dest_rel)
+                    if rel_dir not in manifest["dirs"]:
+                        os.makedirs(os.path.join(dest_dir, rel_dir), exist_ok=True)
+                        parent = rel_dir
+                        while parent and parent not in manifest["dirs"]:
+                            touched.add(parent)
+                            manifest["dirs"][parent] = 0
+                            parent = os.path.dirname(parent)
+                        # the existing directory a new one was made in changed too
+                        touched.add(parent)
+                    touched.add(rel_dir)
+
+                    file_started = time.time()
+                    self._event("file_start", source_dir, dest_dir, path=rel_path)
+                    n = copy_file(src, os.path.join(dest_dir, dest_rel), fsync=self.fsync, journal=self.journal,
+                                  mirrors=[sink for sink in sinks if sink.wants(dest_rel)], rel_path=dest_rel,
+                                  throttle=throttle)
+                    dest_files[dest_rel] = n
+                    archived.add((name, n))
+                    result.copied.append(dest_rel)
+                    result.sources[dest_rel] = rel_path
+                    result.bytes_copied += n
+                    log.write(f"{rel_path} -> {dest_rel}\n")
+                    self._file_done(result, dest_rel, n, file_started, run_started, total)
+            except Exception:
+                result.returncode = 1
+                raise
+            finally:
+                self._close_mirrors(sinks, result, log)
+                self.save_manifest(dest_dir, manifest, touched)
+                self._event("run_end", source_dir, dest_dir, returncode=result.returncode,
+                            files=len(result.copied), bytes=result.bytes_copied,
+                            seconds=round(time.time() - run_started, 3))
+
+                end_dt = datetime.now()
+                diff = end_dt - start_dt
+                min = int(diff.total_seconds() // 60)
+                sec = int(diff.total_seconds() % 60)
+                log.write(f"\ncopied {len(result.copied)} files, {result.bytes_copied:,} bytes, "
+                          f"{result.skipped} already archived, {result.excluded} excluded\n")
+                log.write(f"-------- elapsed: {min} min, {sec} sec {'-'*40}\n")
+
+        return result
+
+
+def migrate_flat(root, dry_run=False):
+    """
+    Moves files directly in root into the dated layout under root.
+    Files already in sub directories are left alone.
+
+    Args:
+        root (str): The flat archive directory.
+        dry_run (bool): Only print what would be moved.
+
+    Returns:
+        tuple: (files moved, duplicates left in place)
+    """
+    moved = duplicates = 0
+    with os.scandir(root) as it:
+        entries = [entry for entry in it if entry.is_file(follow_symlinks=False)
+                   and not entry.name.startswith(".")]
+
+    for entry in sorted(entries, key=lambda e: e.name):
+        rel_path = dated_rel_path(entry.name, capture_date(entry.path))
+        target = os.path.join(root, rel_path)
+        if os.path.exists(target):
+            if os.path.getsize(target) == entry.stat().st_size:
+                print(f"Duplicate, left in place: {entry.name}")
+                duplicates += 1
+                continue
+            stem, ext = os.path.splitext(rel_path)
+            n = 1
+            while os.path.exists(os.path.join(root, f"{stem}_{n}{ext}")):
+                n += 1
+            rel_path = f"{stem}_{n}{ext}"
+            target = os.path.join(root, rel_path)
+
+        if dry_run:
+            print(f"{entry.name} -> {rel_path}")
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(entry.path, target)
+        moved += 1
+    return moved, duplicates
+
+# Command line:
+#   python archive_layout.py migrate <directory> [--dry-run]
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "migrate":
+        print(f"Usage: {sys.argv[0]} migrate <directory> [--dry-run]")
+        sys.exit(1)
+
+    dry_run = "--dry-run" in sys.argv[3:]
+    moved, duplicates = migrate_flat(sys.argv[2], dry_run=dry_run)
+    print(f"{'Would move' if dry_run else 'Moved'} {moved} files, {duplicates} duplicates left in place.")
@@ -4,154 +4,1008 @@
     config.json lists the sources to watch for and backup destinations and folders.
 
     Program:
-    1. Wait for the external drive to be mounted
-    2. When found,
+    1. Wait for the external drive to be mounted (mount events, see mount_monitor.py)
+    2. When found, start a job for it on the asyncio event loop (see backup_scheduler.py),
         if drive is a source volume copy new photos and videos to local backup directory
         if drive is a backup volume, copy from new photos and videos in local backup directory to backup volume
     3. Dismount the external drive
 
+    Jobs for different drives run at the same time. stop() cancels them: rsync
+    is terminated and the native engines stop after the file they are copying.
+
 '''
 
 from datetime import datetime
+import asyncio
+import concurrent.futures
+import dataclasses
+import functools
 import os
+import queue
+import sys
 import threading
 import time
 from file_watcher import FileWatcher
-from json_config_reader import JsonConfigReader
-from blink_led import ToggleLed
+from mount_monitor import MountMonitor
+from backup_config import load_config, ConfigError, ConfigWatcher
+from blink_led import LedStatus
+from backup_scheduler import BackupScheduler
 from dir_sync import DirSync
-from terminal_tailer import TerminalTailer
+from native_sync import NativeSync, SyncCancelled
+from exclude_matcher import get_matcher, entry_rules, rules_file
+from fs_profile import FsProfiles
+from archive_layout import DatedIngest
+from source_state import SourceState
+from media_index import MediaIndex
+from drive_catalog import DriveCatalog
+from verify import Verifier
+from copy_journal import CopyJournal
+from ioprio import io_priority
+from delete_copied import SourceCleaner
+from sync_metrics import SyncMetrics, MetricsServer
+from sync_budget import SyncBudget
+from sync_plan import InsufficientSpace, plan_backup, plan_source
+from sync_log import SyncLog, SUBSCRIBER_QUEUE, open_log
+from throttle import ReplicationThrottle, INGEST_PRIORITY, BACKUP_PRIORITY
+from thumbnail_cache import ThumbnailCache, Thumbnailer
+
+# config.json settings apply_config() can change while running
+RELOADABLE = {"sources", "backups", "exclude_rules", "verify_after_sync", "menus", "tee_ingest",
+              "backup_max_seconds", "backup_max_bytes", "backup_max_mbps", "adaptive_throttle",
+              "fs_profiles"}
+
+# seconds a backup drive waits for a source inserted with it, so the ingest can tee to it
+TEE_GRACE = 5
+# seconds a backup drive waits for ingests at most, then syncs alongside them
+TEE_MAX_WAIT = 1800
+
+def _dest_state(dest_dir, rel_paths):
+    """ (size, inode, ctime) of the files present on a destination. Both engines
+        put a copied file in place with a rename, so a file a sync wrote has a
+        new inode or ctime, and one it found there already has not.
+    """
+    state = {}
+    for rel_path in rel_paths:
+        try:
+            st = os.stat(os.path.join(dest_dir, rel_path))
+        except OSError:
+            continue
+        state[rel_path] = (st.st_size, st.st_ino, st.st_ctime_ns)
+    return state
+
+
+def _transferred(before, after, sizes):
+    """ The files a sync copied, given _dest_state() before and after it. """
+    return [rel_path for rel_path, size in sizes.items()
+            if rel_path in after and after[rel_path][0] == size and after[rel_path] != before.get(rel_path)]
+
 
 class AutoBackup(threading.Thread):
-    def __init__(self, local_backup_dir, sources, backups, backup_subdir, exclude_file, rsync_log_file, *args, **kwargs):
+    def __init__(self, local_backup_dir, sources, backups, backup_subdir, exclude_file, rsync_log_file, *args,
+                 max_local_reads=2, max_jobs=4, max_jobs_per_device=1, index_db=None, source_state_file=None, archive_layout="flat",
+                 verify=True, verify_workers=2, events_file=None, metrics_listen=None, exclude_rules=(),
+                 tee_ingest=True, thumbnail_cache_dir=None, thumbnail_cache_mb=256, thumbnail_workers=1,
+                 backup_max_seconds=None, backup_max_bytes=None, backup_max_mbps=None, adaptive_throttle=True,
+                 fs_profiles=(), **kwargs):
         super().__init__(*args, **kwargs)
+        self.config = None
         self.local_backup_dir = local_backup_dir
         self._stop_event = threading.Event()
         self.sources = sources
         self.backups = backups
         self.backup_subdir = backup_subdir
         self.exclude_file = exclude_file
-
-        self.sync_manager = DirSync(log_file=rsync_log_file)
+        # global rules from config.json, checked before the exclude file
+        self.exclude_rules = list(exclude_rules)
+
+        # Journal of copies in flight so the native engines can resume them
+        self.journal = CopyJournal(os.path.join(local_backup_dir, "copy_journal.db"))
+
+        # Every engine logs to the rotating sync log, which the menu can tail in process
+        if not isinstance(rsync_log_file, SyncLog):
+            rsync_log_file = SyncLog(rsync_log_file)
+        self.sync_log = rsync_log_file
+
+        # Progress events from every sync go to a JSON lines journal, rotated like the log, and live metrics
+        if events_file is None:
+            events_file = os.path.join(local_backup_dir, "sync_events.jsonl")
+        self.sync_metrics = SyncMetrics(events_file, max_bytes=self.sync_log.max_bytes,
+                                        max_age_days=self.sync_log.max_age_days, keep=self.sync_log.keep)
+        self.metrics_server = MetricsServer(self.sync_metrics.registry, metrics_listen) if metrics_listen else None
+        self._subscribers = []    # queues of in-process listeners, see subscribe()
+
+        # "engine" in a source or backup entry selects how it is synced
+        self.sync_manager = DirSync(log_file=self.sync_log, events=self._sync_event)
+        self.sync_engines = {
+            "rsync": self.sync_manager,
+            "native": NativeSync(log_file=self.sync_log, journal=self.journal, events=self._sync_event),
+        }
+
+        # How syncs compare files and which rsync options they use, by filesystem (see fs_profile.py)
+        self.fs_profiles = FsProfiles(fs_profiles)
+
+        # "dated" files ingested photos under backup_subdir/YYYY/YYYY-MM-DD/
+        self.archive_layout = archive_layout
+        self.dated_ingest = DatedIngest(log_file=self.sync_log, journal=self.journal, events=self._sync_event)
+
+        # Backup drives waiting for ingests, which write new files to them as well
+        self.tee_ingest = tee_ingest
+        self._tee_pending = 0   # ingests that can tee and have not taken their mirrors yet
+        self._tee_changed = asyncio.Event()
+        self._tee_ready = {}    # watcher -> backup entry, drives waiting in wait_for_ingests()
+        self._teeing = set()    # watchers of drives an ingest is writing to
+        self._mirrored = {}     # watcher -> paths an ingest wrote to the drive and verified
 
         self.red_led_blink_rate = 0.25 
         self.green_led_blink_rate = 0.75
+        self.led_status = LedStatus(red_rate=self.red_led_blink_rate, green_rate=self.green_led_blink_rate)
+
+        # Index of the files in the local backup directory
+        if index_db is None:
+            index_db = os.path.join(local_backup_dir, "media_index.db")
+        self.index = MediaIndex(index_db, os.path.join(local_backup_dir, backup_subdir))
+
+        # Hash new copies on both sides after each sync
+        self.verify = verify
+        self.verifier = Verifier(self.index, workers=verify_workers)
+
+        # High-water marks of what was already ingested from each source
+        if source_state_file is None:
+            source_state_file = os.path.join(local_backup_dir, "source_state.json")
+        self.source_state = SourceState(source_state_file)
+
+        # Thumbnails of ingested photos for the menu, made at idle priority; 0 workers turns it off
+        self.thumbnailer = None
+        if thumbnail_workers:
+            if thumbnail_cache_dir is None:
+                thumbnail_cache_dir = os.path.join(local_backup_dir, ".thumbnails")
+            cache = ThumbnailCache(thumbnail_cache_dir, max_bytes=int(thumbnail_cache_mb * 1024 * 1024))
+            self.thumbnailer = Thumbnailer(cache, local_backup_dir, workers=thumbnail_workers)
+
+        # Time / byte budget of every backup session without its own (see sync_budget.py)
+        self.backup_max_seconds = backup_max_seconds
+        self.backup_max_bytes = backup_max_bytes
+
+        # Ingests run at a higher I/O priority than backups, and native backups
+        # are slowed down while ingests slow down (see throttle.py)
+        self.throttle = ReplicationThrottle(backup_max_mbps * 1e6 if backup_max_mbps else None, adaptive_throttle)
+
+        # Volumes sync in parallel, one job at a time per physical device
+        self.scheduler = BackupScheduler(max_local_reads=max_local_reads, max_jobs=max_jobs,
+                                         max_per_device=max_jobs_per_device)
+        self._loop = None
 
         self.create_file_watchers()
 
+    @classmethod
+    def from_config(cls, config):
+        """ Create an AutoBackup from a backup_config.BackupConfig. """
+        auto_backup = cls(config.local_backup_dir, list(config.sources), list(config.backups), config.backup_subdir,
+                          config.exclude,
+                          SyncLog(config.rsync_log_file, max_bytes=int(config.log_max_mb * 1024 * 1024),
+                                  max_age_days=config.log_max_age_days, keep=config.log_keep),
+                          max_local_reads=config.max_concurrent_backups,
+                          max_jobs=config.max_concurrent_jobs,
+                          max_jobs_per_device=config.max_jobs_per_device,
+                          index_db=config.index_db,
+                          source_state_file=config.source_state_file,
+                          archive_layout=config.archive_layout,
+                          verify=config.verify_after_sync,
+                          verify_workers=config.verify_workers,
+                          events_file=config.sync_events_file,
+                          metrics_listen=config.metrics_listen,
+                          exclude_rules=config.exclude_rules,
+                          tee_ingest=config.tee_ingest,
+                          thumbnail_cache_dir=config.thumbnail_cache_dir,
+                          thumbnail_cache_mb=config.thumbnail_cache_mb,
+                          thumbnail_workers=config.thumbnail_workers,
+                          backup_max_seconds=config.backup_max_seconds,
+                          backup_max_bytes=config.backup_max_bytes,
+                          backup_max_mbps=config.backup_max_mbps,
+                          adaptive_throttle=config.adaptive_throttle,
+                          fs_profiles=config.fs_profiles)
+        auto_backup.config = config
+        return auto_backup
+
     def create_file_watchers(self):
         # Create File Watchers for each source and backup volume
+        self._watch_lock = threading.Lock()
+        self._watched = {}
         for source in self.sources:
-            source_volume = source.get("volume")
-            source_directory = source.get("directory")
-            source_descr = source.get("descr", "No description")
-
-            print(f"Watching for {source_descr}...")
-            watcher = FileWatcher(source_volume,source_directory)
-            source["watcher"] = watcher
-
+            self._watched[self._new_watcher(source)] = ("source", source)
         for backup in self.backups:
-            backup_volume = backup.get("volume")
-            backup_directory = backup.get("directory")
-            backup_descr = backup.get("descr", "No description")
-
-            print(f"Watching for {backup_descr}...")
-            watcher = FileWatcher(backup_volume,backup_directory)
-            backup["watcher"] = watcher
+            self._watched[self._new_watcher(backup)] = ("backup", backup)
+
+        # Mount events put ready volumes on a queue for the event loop
+        self._ready = None
+        self.mount_monitor = MountMonitor(self._watched.keys(), on_ready=self._volume_ready)
+
+    def _new_watcher(self, entry):
+        print(f"Watching for {entry.get('descr', 'No description')}...")
+        return FileWatcher(entry.get("volume"), entry.get("directory", ""))
+
+    def _volume_ready(self, watcher):
+        """Called by the MountMonitor thread when a watched volume has settled."""
+        with self._watch_lock:
+            watched = self._watched.get(watcher)
+        if watched is not None:
+            kind, entry = watched
+            try:
+                self._loop.call_soon_threadsafe(self._ready.put_nowait, (kind, entry, watcher))
+            except (AttributeError, RuntimeError):
+                # event loop not running (yet, or any more)
+                pass
+
+    def apply_config(self, config):
+        """ Swap in a reloaded config.json (see backup_config.ConfigWatcher).
+            Sources and backups are added and removed without touching syncs
+            already running; unchanged entries keep their watchers. Settings
+            read at startup (directories, databases, engines) need a restart.
+        """
+        with self._watch_lock:
+            current = {entry: watcher for watcher, (_, entry) in self._watched.items()}
+            watched = {}
+            for kind, entries in (("source", config.sources), ("backup", config.backups)):
+                for entry in entries:
+                    watcher = current.pop(entry, None) or self._new_watcher(entry)
+                    watched[watcher] = (kind, entry)
+            self._watched = watched
+            self.sources = list(config.sources)
+            self.backups = list(config.backups)
+            self.exclude_rules = list(config.exclude_rules)
+            self.verify = config.verify_after_sync
+            self.tee_ingest = config.tee_ingest
+            self.backup_max_seconds = config.backup_max_seconds
+            self.backup_max_bytes = config.backup_max_bytes
+            self.throttle.configure(config.backup_max_mbps * 1e6 if config.backup_max_mbps else None,
+                                    config.adaptive_throttle)
+            self.fs_profiles = FsProfiles(config.fs_profiles)
+        for entry in current:
+            print(f"No longer watching for {entry.get('descr', 'No description')}.")
+        self.mount_monitor.set_watchers(watched.keys())
+
+        if self.config is not None:
+            restart = [f.name for f in dataclasses.fields(config)
+                       if f.name not in RELOADABLE and getattr(config, f.name) != getattr(self.config, f.name)]
+            if restart:
+                print(f"config.json changes to {', '.join(restart)} take effect after a restart.")
+        self.config = config
+        print("config.json reloaded.")
 
     def stop(self):
-        """Sets the internal flag to signal the thread to stop."""
+        """Sets the internal flag to signal the thread to stop and cancels running jobs."""
         self._stop_event.set()
+        try:
+            # wake up the event loop, jobs are cancelled on its next iteration
+            self._loop.call_soon_threadsafe(self._ready.put_nowait, None)
+        except (AttributeError, RuntimeError):
+            pass
 
     def stopped(self):
         """Checks if the stop event has been set."""
         return self._stop_event.is_set()
-    
+
+    def job_status(self, timeout=0.5):
+        """ Returns (running, queued) job descriptions for another thread, e.g. the
+            Tk menu. The scheduler is only touched on the event loop, so they are
+            read there. None if the loop is not running or does not answer in time.
+        """
+        loop = self._loop
+        if loop is None:
+            return None
+        future = concurrent.futures.Future()
+
+        def snapshot():
+            if future.set_running_or_notify_cancel():
+                future.set_result((self.scheduler.active(), self.scheduler.queued()))
+        try:
+            loop.call_soon_threadsafe(snapshot)
+            return future.result(timeout)
+        except (RuntimeError, concurrent.futures.TimeoutError):
+            # loop closed, or busy
+            future.cancel()
+            return None
+
+    def sync_manager_for(self, entry):
+        """ Return the sync engine selected by a source or backup entry. """
+        engine = entry.get("engine", "rsync")
+        if engine not in self.sync_engines:
+            print(f"Unknown sync engine '{engine}' for '{entry.get('descr', 'No description')}', using rsync.")
+            engine = "rsync"
+        return self.sync_engines[engine]
+
+    def ingest_manager_for(self, source):
+        """ Return the engine that copies a source into the local backup directory. """
+        if self.archive_layout == "dated":
+            return self.dated_ingest
+        return self.sync_manager_for(source)
+
+    async def sync(self, engine, src, dst, exclude_file, files=None, mirrors=None, deadline=None,
+                   priority=None, throttle=None, profile=None):
+        """ Run a sync engine from a job. rsync runs as an asyncio subprocess, the
+            native engines run in a thread and are told to stop if the job is cancelled,
+            or at deadline (time.monotonic()) after the file being copied.
+            rsync is terminated at deadline, in the middle of a file, and SyncCancelled
+            is raised as the native engines do.
+            Only the native engines can tee to mirrors.
+            priority is the (ioprio class, level) of the copy: rsync runs under ionice,
+            a native engine's thread takes it for the sync. Only the native engines
+            can be throttled (see throttle.py), rsync's bandwidth can only be capped
+            with --bwlimit in the profile's rsync_options. profile is the FsProfile
+            deciding what is copied already.
+        """
+        listed = files is not None
+        if isinstance(engine, DirSync):
+            options = profile.rsync_args(listed) if profile is not None else None
+            run = engine.run_sync_async(src, dst, exclude_file, files=files, priority=priority, options=options)
+            if deadline is None:
+                return await run
+            try:
+                return await asyncio.wait_for(run, max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise SyncCancelled(src) from None
+        cancel = threading.Event()
+        timer = None
+        if deadline is not None:
+            timer = asyncio.get_running_loop().call_later(max(0.0, deadline - time.monotonic()), cancel.set)
+        run = functools.partial(engine.run_sync, src, dst, exclude_file, files=files, cancel=cancel,
+                                mirrors=mirrors, throttle=throttle)
+        if profile is not None and profile.recopy(listed):
+            run.keywords["recopy"] = True
+        try:
+            return await asyncio.to_thread(self._run_at, priority, run)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cancel.set()
+
+    @staticmethod
+    def _run_at(priority, run):
+        """ Calls run() at an I/O priority, in the calling thread only. """
+        if priority is None:
+            return run()
+        with io_priority(*priority):
+            return run()
+
+    async def sync_by_need(self, engine, src, dst, exclude_file, files, throttle=None, profile=None):
+        """ Copy files to a backup drive fewest replicas first, newest ingest first
+            among equals (see MediaIndex.by_need), so a drive plugged in briefly
+            gets the files that have the fewest copies. The native engine copies
+            in the order given; rsync sorts its file list, so it runs once per
+            replica count instead.
+        """
+        if not files:
+            return
+        volumes = [backup.get("volume") for backup in self.backups]
+        ordered = await asyncio.to_thread(self.index.by_need, files, volumes)
+        if not isinstance(engine, DirSync):
+            await self.sync(engine, src, dst, exclude_file, files=[p for p, _ in ordered],
+                            priority=BACKUP_PRIORITY, throttle=throttle, profile=profile)
+            return
+        tiers = {}
+        for rel_path, count in ordered:
+            tiers.setdefault(count, []).append(rel_path)
+        for count in sorted(tiers):
+            await self.sync(engine, src, dst, exclude_file, files=tiers[count], priority=BACKUP_PRIORITY,
+                            profile=profile)
+
+    async def sync_budget(self, backup, watcher):
+        """ Returns the SyncBudget of a backup session: "max_seconds" / "max_bytes"
+            on the backup, else "backup_max_seconds" / "backup_max_bytes", or None.
+        """
+        max_seconds = backup.get("max_seconds") or self.backup_max_seconds
+        max_bytes = backup.get("max_bytes") or self.backup_max_bytes
+        if max_seconds is None and max_bytes is None:
+            return None
+        rate = await asyncio.to_thread(self.index.throughput, watcher.volume)
+        return SyncBudget(max_seconds, max_bytes, rate=rate)
+
+    async def sync_within(self, budget, engine, src, dst, exclude_file, sizes, throttle=None, profile=None):
+        """ Copy the most needed files that fit a budget (see sync_budget.py) in
+            chunks, stopping at a file boundary when the time is up.
+
+            Returns the paths copied and whether nothing was left for next time.
+        """
+        volumes = [backup.get("volume") for backup in self.backups]
+        ordered = await asyncio.to_thread(self.index.by_need, sizes, volumes)
+        selected, deferred = budget.select((rel_path, sizes[rel_path]) for rel_path, _ in ordered)
+        print(f"Budget {budget}: copying {len(selected)} of {len(ordered)} files, "
+              f"{sum(size for _, size in selected) / 1e6:.1f} MB.")
+        before = await asyncio.to_thread(_dest_state, dst, sizes)
+
+        attempted = []
+        stopped = False
+        for chunk in budget.chunks(selected):
+            if budget.expired():
+                stopped = True
+                break
+            attempted.extend(chunk)
+            try:
+                await self.sync(engine, src, dst, exclude_file, files=chunk, deadline=budget.deadline,
+                                priority=BACKUP_PRIORITY, throttle=throttle, profile=profile)
+            except SyncCancelled:
+                if not budget.expired():
+                    raise
+                stopped = True
+                break
+
+        # a chunk cut short by the deadline copied only some of its files
+        after = await asyncio.to_thread(_dest_state, dst, sizes)
+        done = [p for p in sizes if p in after and after[p][0] == sizes[p]]
+        left = len(ordered) - len(done)
+        if stopped or deferred:
+            print(f"{'Time is up' if stopped else 'Budget used'}: {left} files, "
+                  f"{(sum(sizes.values()) - sum(sizes[p] for p in done)) / 1e6:.1f} MB left for next time.")
+        return _transferred(before, after, sizes), left == 0
+
+    async def wait_for_ingests(self, backup, watcher):
+        """ Hold a backup drive back for ingests that can write their new files
+            to it too (tee ingest), so they are read from the source once instead
+            of again from the local SSD. The drive first waits TEE_GRACE seconds
+            for a card inserted together with it, then until no ingest that could
+            still take it is starting and none is writing to it, TEE_MAX_WAIT
+            seconds at most. Without a source on a native engine nothing can tee
+            and the drive does not wait.
+        """
+        if not any(self.can_tee(source) for source in self.sources):
+            return
+        self._tee_ready[watcher] = backup
+        try:
+            await asyncio.sleep(TEE_GRACE)
+            await asyncio.wait_for(self._tee_idle(watcher), max(0, TEE_MAX_WAIT - TEE_GRACE))
+        except TimeoutError:
+            print(f"Waited {TEE_MAX_WAIT} sec for ingests, syncing '{backup.get('descr', 'No description')}' now.")
+        finally:
+            self._tee_ready.pop(watcher, None)
+
+    def can_tee(self, source):
+        """ True if ingests from source can write to backup drives as well, only the native engines tee. """
+        return self.tee_ingest and isinstance(self.ingest_manager_for(source), NativeSync)
+
+    async def _tee_idle(self, watcher):
+        while self._tee_pending or watcher in self._teeing:
+            self._tee_changed.clear()
+            await self._tee_changed.wait()
+
+    def _tee_update(self, pending=0, released=()):
+        """ Count an ingest starting or done taking mirrors, release drives it wrote to,
+            and wake the drives waiting in wait_for_ingests(). """
+        self._tee_pending += pending
+        self._teeing.difference_update(released)
+        self._tee_changed.set()
+
+    def claim_mirrors(self, engine):
+        """ Take the backup drives waiting in wait_for_ingests() that no other
+            ingest is writing to. Returns (backup, watcher, root, matcher) tuples.
+        """
+        if not self.tee_ingest or not isinstance(engine, NativeSync):
+            return []
+        claimed = []
+        for watcher, backup in self._tee_ready.items():
+            root = os.path.join(watcher.file_path, self.backup_subdir)
+            if watcher in self._teeing or not os.path.isdir(root):
+                continue
+            self._teeing.add(watcher)
+            claimed.append((backup, watcher, root, get_matcher(self.exclude_file_for(backup))))
+        return claimed
+
+    async def finish_mirrors(self, claimed, result, local_root):
+        """ Verify what an ingest wrote to the backup drives against the local
+            copies and add it to the drives' catalogs.
+        """
+        for backup, watcher, root, _ in claimed:
+            written = getattr(result, "mirrored", {}).get(root, [])
+            error = getattr(result, "mirror_errors", {}).get(root)
+            if error is not None:
+                print(f"Stopped copying to '{backup.get('descr', 'No description')}' during ingest: {error}")
+            if not written:
+                continue
+            print(f"Also copied {len(written)} files to '{backup.get('descr', 'No description')}'.")
+            bad = await self.verify_copies(backup, local_root, root, written)
+            bad_paths = {rel_path for rel_path, _ in bad}
+            good = [rel_path for rel_path in written if rel_path not in bad_paths]
+            self._mirrored.setdefault(watcher, set()).update(good)
+            await asyncio.to_thread(self.index.add_replicas, watcher.volume, good)
+            await asyncio.to_thread(self.update_mirror_catalog, watcher, root, good)
+
+    def update_mirror_catalog(self, watcher, root, written):
+        """ Add files an ingest wrote to a backup drive to its catalog, if the catalog is current. """
+        catalog = DriveCatalog(watcher.volume, root)
+        if catalog.load():
+            self.save_catalog(catalog, written)
+
+    async def verify_copies(self, entry, local_root, other_root, rel_paths, remove_local=False):
+        """ check_copies() in a thread, stopped if the job is cancelled. """
+        cancel = threading.Event()
+        try:
+            return await asyncio.to_thread(self.check_copies, entry, local_root, other_root, rel_paths,
+                                           remove_local, cancel)
+        finally:
+            cancel.set()
+
+    def schedule_source(self, source, watcher):
+        """ Start a job copying a source volume to the local backup directory. """
+        device = self.scheduler.device_key(watcher.volume)
+        self.scheduler.submit(device, source.get('descr', 'No description'),
+                              functools.partial(self.backup_source, source, watcher))
+
+    async def backup_source(self, source, watcher):
+        """ Copy new files from a source volume to the local backup directory. """
+        start_dt = datetime.now()
+        print((f"\n-------- {start_dt:%m-%d-%Y %H:%M} {'-'*40}"))
+        print(f"Source '{source.get('descr', 'No description')}' found.")
+
+        # Blink red LED while any job is running
+        self.led_status.job_started()
+        ok = False
+        # backup drives attached now wait until this ingest has taken them as mirrors
+        tee_pending = self.can_tee(source)
+        if tee_pending:
+            self._tee_update(pending=1)
+        self.throttle.ingest_started()
+        claimed = []
+        try:
+            # Backup new files from source to local backup directory
+            dst = os.path.join(self.local_backup_dir, self.backup_subdir)
+            print(f"Backing up new files from '{watcher.file_path}' to '{dst}'...")
+
+            result = None
+            scan = None
+            full = False
+            files = []
+            try:
+                # Only enumerate what is newer than the last ingest from this source
+                exclude_file = self.exclude_file_for(source)
+                matcher = get_matcher(exclude_file)
+                scan = await asyncio.to_thread(self.source_state.scan, watcher.volume, watcher.file_path, matcher)
+                if scan is None:
+                    # one listing for the plan, the sync and the source's state
+                    print("Listing all files on source...")
+                    full = True
+                    scan = await asyncio.to_thread(self.source_state.list_all, watcher.file_path, matcher)
+
+                # write new files to waiting backup drives while they are read
+                engine = self.ingest_manager_for(source)
+                profile = self.fs_profiles.for_sync(watcher.file_path, dst, source)
+                print(f"Filesystem profile {profile.describe()}.")
+
+                # what the ingest will copy and how long it should take, nothing is copied without room for it
+                plan = await asyncio.to_thread(plan_source, self.index, watcher.file_path, matcher, scan,
+                                               self.archive_layout == "dated")
+                plan.estimate(await asyncio.to_thread(self.index.run_rates, watcher.volume))
+                print(f"Plan: {plan}.")
+                await asyncio.to_thread(plan.check_space)
+
+                claimed = self.claim_mirrors(engine)
+                mirrors = [(root, mirror_matcher) for _, _, root, mirror_matcher in claimed]
+                if tee_pending:
+                    tee_pending = False
+                    self._tee_update(pending=-1)
+                if claimed:
+                    print(f"Also copying to {', '.join(b.get('descr', 'No description') for b, *_ in claimed)}.")
+
+                if full:
+                    # the files the archive does not have, as the plan found them
+                    files = [rel_path for rel_path, _ in plan.files]
+                    print(f"{len(scan.files)} files on source, {len(files)} not in the archive "
+                          f"({scan.listed} directories listed).")
+                else:
+                    files = scan.files
+                    print(f"{len(scan.files)} new files, {scan.size() / 1e6:.1f} MB "
+                          f"({scan.listed} directories listed, {scan.skipped} unchanged).")
+                if files:
+                    result = await self.sync(engine, watcher.file_path, dst, exclude_file,
+                                             files=files, mirrors=mirrors, priority=INGEST_PRIORITY,
+                                             profile=profile)
+                if full:
+                    await asyncio.to_thread(self.source_state.record_full, watcher.volume, watcher.file_path,
+                                            matcher, scan)
+                else:
+                    await asyncio.to_thread(self.source_state.record_scan, watcher.volume, scan)
+                ok = True
+            except InsufficientSpace as e:
+                print(f"Not enough space in '{dst}' ({e.strerror}), nothing copied.")
+            except Exception as e:
+                print(f"Error occurred while syncing: {e}")
+            if result is not None or scan is None:
+                await asyncio.to_thread(self.update_index, result)
+
+            # Check the new local copies against the source
+            if getattr(result, "sources", None):
+                copies = list(result.sources.items())
+            else:
+                copies = files
+            bad = await self.verify_copies(source, dst, watcher.file_path, copies, remove_local=True)
+            if bad:
+                ok = False
+                # list the whole source next time so bad copies are made again
+                await asyncio.to_thread(self.source_state.forget, watcher.volume)
+                await asyncio.to_thread(self.update_index, None)
+
+            # "delete_copied": remove what is safely in the archive from the source
+            if ok and source.get("delete_copied"):
+                verified = []
+                if source.get("verify", self.verify):
+                    failed = {rel_path for rel_path, _ in bad}
+                    verified = [p[1] if isinstance(p, tuple) else p for p in copies if p not in failed]
+                await self.delete_copied(source, watcher, matcher, verified)
+
+            await asyncio.to_thread(watcher.dismount)
+            print(f"Source '{source.get('descr', 'No description')}' copied to local backup directory.")
+            print(f"Source '{source.get('descr', 'No description')}' dismounted.")
+
+            await self.finish_mirrors(claimed, result, dst)
+        finally:
+            if tee_pending or claimed:
+                self._tee_update(pending=-1 if tee_pending else 0,
+                                       released=[mirror_watcher for _, mirror_watcher, _, _ in claimed])
+            self.throttle.ingest_finished()
+            self.led_status.job_finished(ok=ok)
+            self.print_waiting()
+
+    async def delete_copied(self, source, watcher, matcher, verified):
+        """ Delete files from a source once their copies are confirmed, see delete_copied.py.
+            The report goes to the sync log, a summary to the console.
+        """
+        cleaner = SourceCleaner(self.index, self.verifier, source.get("delete_min_backups", 0),
+                                [backup.get("volume") for backup in self.backups])
+        dry_run = source.get("delete_dry_run", True)
+        cancel = threading.Event()
+        try:
+            plan = await asyncio.to_thread(cleaner.plan, watcher.file_path, matcher, verified, cancel)
+            deleted, errors = await asyncio.to_thread(cleaner.run, plan, matcher, dry_run)
+        except Exception as e:
+            print(f"Error occurred while deleting copied files from source: {e}")
+            return
+        finally:
+            cancel.set()
+
+        with open_log(self.sync_log, watcher.file_path, self.index.root) as log:
+            log.write(f"\n-------- {datetime.now():%m-%d-%Y %H:%M} delete copied{' (dry run)' if dry_run else ''}\n")
+            plan.report(log)
+            for rel_path, error in errors:
+                log.write(f"  error  {rel_path}: {error}\n")
+        if dry_run:
+            print(f"Dry run: would delete {len(plan.delete)} files ({plan.bytes / 1e6:.1f} MB) from source, "
+                  f"see '{self.sync_log}'.")
+        else:
+            print(f"Deleted {len(deleted)} copied files from source, {len(errors)} errors, "
+                  f"{len(plan.missing) + len(plan.unbacked) + len(plan.mismatched)} kept.")
+        if deleted:
+            # the source changed, list it again next time
+            await asyncio.to_thread(self.source_state.forget, watcher.volume)
+
+    def exclude_file_for(self, entry):
+        """ Return the exclude file for a source or backup: the global exclude file,
+            or a generated one when config.json adds rules ("exclude_rules", or
+            "include" / "exclude" lists on the entry).
+        """
+        return rules_file(self.exclude_file, entry_rules(entry, self.exclude_rules),
+                          os.path.join(self.local_backup_dir, ".exclude_rules"))
+
+    def _sync_event(self, event):
+        """ Progress events from the sync engines: metrics, thumbnails of new photos,
+            ingest latency for the throttle, the run history for estimates, and the red LED
+            blinks faster as a sync completes. """
+        self.sync_metrics.handle(event)
+        if event.get("event") == "file_done" and event.get("dest") == self.index.root:
+            self.throttle.ingest_file(event)
+        elif event.get("event") == "run_end" and event.get("returncode") == 0:
+            self._off_loop(self.record_run, event)
+        if self.thumbnailer is not None:
+            self.thumbnailer.handle_event(event)
+        for q in list(self._subscribers):
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+        if event.get("event") == "file_done" and event.get("files_total"):
+            self.led_status.progress(event["files_done"] / event["files_total"])
+
+    def _off_loop(self, func, *args):
+        """ Calls func, on a worker thread if called from the event loop (rsync's
+            events are parsed there), so index writes never block the loop. """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            func(*args)
+        else:
+            loop.run_in_executor(None, func, *args)
+
+    def record_run(self, event):
+        """ Adds a finished ingest to the run history of its source volume, for
+            sync_plan.py's estimates. A backup session is recorded as a whole by
+            backup_to_volume(), since it can take several sync runs.
+        """
+        if event.get("dest") != self.index.root:
+            return
+        path = event.get("source")
+        volumes = [entry.get("volume") for entry in self.sources]
+        volumes = [v for v in volumes if path and (path == v or path.startswith(v.rstrip("/") + "/"))]
+        if not volumes:
+            return
+        try:
+            self.index.record_run(max(volumes, key=len), event.get("files", 0), event.get("bytes", 0),
+                                  event.get("seconds", 0))
+        except Exception as e:
+            print(f"Error recording sync run: {e}")
+
+    def subscribe(self, q=None):
+        """
+        Args:
+            q (queue.Queue, optional): Queue to put the events on, a new one if not given.
+
+        Returns:
+            queue.Queue: Receives every sync event from now on, for a GUI to drain
+                         on its own thread. Events are dropped, not waited for, if the queue is full.
+        """
+        if q is None:
+            q = queue.Queue(SUBSCRIBER_QUEUE)
+        self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        if q in self._subscribers:
+            self._subscribers.remove(q)
+
+    def update_index(self, result):
+        """ Add files that just landed in the local backup directory to the index.
+            The native engine reports what it copied, anything else is reconciled.
+        """
+        try:
+            copied = getattr(result, "copied", None)
+            if copied is not None:
+                self.index.add_files(copied)
+            else:
+                added, removed, changed = self.index.reconcile()
+                print(f"Index updated: {added} added, {removed} removed, {changed} changed.")
+        except Exception as e:
+            print(f"Error occurred while updating index: {e}")
+
+    def schedule_backup(self, backup, watcher):
+        """ Start a job for a backup volume so that several attached
+            backup drives sync at the same time.
+        """
+        device = self.scheduler.device_key(watcher.volume)
+        self.scheduler.submit(device, backup.get('descr', 'No description'),
+                              functools.partial(self.backup_to_volume, backup, watcher))
+
+    async def backup_to_volume(self, backup, watcher):
+        """ Copy new files from the local backup directory to a backup volume. """
+        start_dt = datetime.now()
+        print((f"\n-------- {start_dt:%m-%d-%Y %H:%M} {'-'*40}"))
+        print(f"Backup '{backup.get('descr', 'No description')}' found.")
+
+        # Blink red LED while any job is running
+        self.led_status.job_started()
+        ok = False
+        try:
+            if self.tee_ingest:
+                await self.wait_for_ingests(backup, watcher)
+            # copies an ingest already made and verified on this drive
+            mirrored = self._mirrored.pop(watcher, set())
+
+            # Backup new files from local backup directory to backup volume
+            src = os.path.join(self.local_backup_dir, self.backup_subdir)
+            dst = os.path.join(watcher.file_path, self.backup_subdir)
+            print(f"Backing up from '{src}' to '{dst}'...")
+
+            catalog = None
+            try:
+                # Trust the drive's catalog if it is current and only copy the delta,
+                # otherwise let the sync list the whole drive
+                exclude_file = self.exclude_file_for(backup)
+                matcher = get_matcher(exclude_file)
+                catalog = DriveCatalog(watcher.volume, dst)
+                profile = self.fs_profiles.for_sync(src, dst, backup, indexed=True)
+                print(f"Filesystem profile {profile.describe()}.")
+                current = await asyncio.to_thread(catalog.load)
+                plan = await asyncio.to_thread(plan_backup, self.index, dst, matcher, catalog if current else None,
+                                               watcher.volume, profile.compare)
+                plan.estimate(await asyncio.to_thread(self.index.run_rates, watcher.volume))
+                files = None
+                if current:
+                    files = [rel_path for rel_path, _ in plan.files]
+                    print(f"Catalog is current: {plan}.")
+                else:
+                    print(f"No current catalog on drive, full sync. Ingested since "
+                          f"'{backup.get('descr', 'No description')}' was last synced: {plan}.")
+
+                budget = await self.sync_budget(backup, watcher)
+                plan.check_space(budget.allowance() if budget is not None else None)
+                sizes = dict(plan.files)
+                sync_started = datetime.now().timestamp()
+                engine = self.sync_manager_for(backup)
+                job = self.throttle.job()
+                # limit how many backups read the local SSD at once
+                async with self.scheduler.local_read_slot():
+                    if budget is not None:
+                        # copy what fits while the drive is attached, the rest waits for the next time
+                        copied, complete = await self.sync_within(budget, engine, src, dst, exclude_file, sizes,
+                                                                  job, profile)
+                    else:
+                        complete = True
+                        before = await asyncio.to_thread(_dest_state, dst, sizes)
+                        # the files this drive is missing first, then a full sync catches anything else
+                        await self.sync_by_need(engine, src, dst, exclude_file, list(sizes), job, profile)
+                        if files is None:
+                            await self.sync(engine, src, dst, exclude_file, priority=BACKUP_PRIORITY, throttle=job,
+                                            profile=profile)
+                        copied = _transferred(before, await asyncio.to_thread(_dest_state, dst, sizes), sizes)
+                    bad = await self.verify_copies(backup, src, dst, [p for p in copied if p not in mirrored])
+                if job.waited:
+                    print(f"Held back {job.waited:.0f} sec ({job.share():.0%}) for ingests, "
+                          f"{self.throttle.backoffs} backoffs so far.")
+                self._sync_event({"ts": time.time(), "event": "throttle", "source": src, "dest": dst,
+                                  "seconds": job.waited, "bytes": job.bytes})
+                # the whole session, copies and verification, is one run of the drive's history
+                await asyncio.to_thread(self.index.record_run, watcher.volume, len(copied),
+                                        sum(sizes[p] for p in copied), datetime.now().timestamp() - sync_started)
+                if complete and not bad:
+                    # files ingested before an incomplete or failed session are still reported as new
+                    await asyncio.to_thread(self.index.mark_synced, watcher.volume, sync_started)
+                if files is None and budget is not None:
+                    # a short session does not walk the drive: record what it copied, and
+                    # keep the catalog untrusted until a full sync rebuilds it
+                    catalog.stale = True
+                    await asyncio.to_thread(self.save_catalog, catalog, copied)
+                    bad_paths = {rel_path for rel_path, _ in bad}
+                    await asyncio.to_thread(self.index.add_replicas, watcher.volume,
+                                            [p for p in copied if p not in bad_paths])
+                else:
+                    await asyncio.to_thread(self.save_catalog, catalog, copied if files is not None else None)
+                    # after a sync the catalog lists what is on the drive, bad copies were removed
+                    await asyncio.to_thread(self.index.set_replicas, watcher.volume, catalog.files)
+                print(f"Local backup copied to '{backup.get('descr', 'No description')}'")
+                ok = not bad
+            except InsufficientSpace as e:
+                print(f"Not enough space on '{backup.get('descr', 'No description')}' ({e.strerror}), "
+                      f"nothing copied.")
+            except Exception as e:
+                print(f"Error occurred while syncing: {e}")
+                if catalog is not None:
+                    # what is on the drive is unknown now, the next sync lists it
+                    catalog.stale = True
+                    await asyncio.to_thread(self.save_catalog, catalog, [])
+
+            # dismount as soon as this drive is done
+            await asyncio.to_thread(watcher.dismount)
+            print(f"Backup '{backup.get('descr', 'No description')}' dismounted.")
+        finally:
+            self.led_status.job_finished(ok=ok)
+            self.print_waiting()
+
+    def check_copies(self, entry, local_root, other_root, rel_paths, remove_local=False, cancel=None):
+        """ Hash new files in the local backup and their copies on the other volume.
+            Copies that do not match are removed so the next sync makes them again:
+            the local copy after an ingest (remove_local), otherwise the copy on the backup drive.
+            Set "verify": false on a source or backup to skip this.
+
+            Returns the paths that did not match.
+        """
+        if not entry.get("verify", self.verify) or not rel_paths:
+            return []
+
+        start = datetime.now()
+        checked, bad = self.verifier.verify(local_root, other_root, rel_paths, cancel)
+        elapsed = (datetime.now() - start).total_seconds()
+        print(f"Verified {checked} files in {elapsed:.0f} sec, {len(bad)} did not match.")
+
+        for rel_path, error in bad:
+            local_rel, other_rel = rel_path if isinstance(rel_path, tuple) else (rel_path, rel_path)
+            print(f"  {other_rel}: {error}")
+            bad_copy = os.path.join(local_root, local_rel) if remove_local else os.path.join(other_root, other_rel)
+            try:
+                os.remove(bad_copy)
+            except OSError:
+                pass
+        return bad
+
+    def save_catalog(self, catalog, copied):
+        """ Write the drive catalog after a successful sync. A full walk
+            is only needed when the catalog was missing or stale, and is
+            left for a full sync when the catalog is marked stale.
+        """
+        try:
+            if copied is None:
+                catalog.rebuild()
+            else:
+                catalog.update(copied)
+            catalog.save()
+        except Exception as e:
+            print(f"Error occurred while writing catalog to '{catalog.volume}': {e}")
+
+    def print_waiting(self):
+        if self.stopped():
+            return
+        active = self.scheduler.active()
+        if self.led_status.jobs() == 0:
+            print("Waiting for new media source or backup...")
+        elif active:
+            print(f"Backups in progress: {', '.join(active)}")
+
     def run(self):
+        asyncio.run(self._main())
 
-        # Start Green Slow blink LED
-        blink_led = ToggleLed(color="green", rate=self.green_led_blink_rate)
+    async def _main(self):
+        self._ready = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
 
-        while not self.stopped():
-            # Wait between checks
-            time.sleep(3)
-            
-            # Check each source for files
-            for source in self.sources:
-                watcher = source.get("watcher")
-                if watcher.find_file():
-                    start_dt = datetime.now()
-                    print((f"\n-------- {start_dt:%m-%d-%Y %H:%M} {'-'*40}"))
-                    print(f"Source '{source.get('descr', 'No description')}' found.")
-
-                    # Stop Green LED blink and start red LED blink
-                    blink_led.stop()
-                    blink_led = ToggleLed(color="red", rate=self.red_led_blink_rate)
-
-                    # Backup new files from source to local backup directory
-                    dst = os.path.join(self.local_backup_dir, self.backup_subdir)
-                    print(f"Backing up new files from '{watcher.file_path}' to '{dst}'...")
-
-                    try:
-                        self.sync_manager.run_sync(watcher.file_path, dst, self.exclude_file)
-                    except Exception as e:
-                        print(f"Error occurred while syncing: {e}")
-
-                    watcher.dismount()
-                    print(f"Source '{source.get('descr', 'No description')}' copied to local backup directory.")
-                    print(f"Source '{source.get('descr', 'No description')}' dismounted.")
-                    print("Waiting for new media source or backup...")
-
-                    # Stop red blinking and restart green blink
-                    blink_led.stop()
-                    blink_led = ToggleLed(color="green", rate=self.green_led_blink_rate)
-
-            # Check each backup for files
-            for backup in self.backups:
-                watcher = backup.get("watcher")
-                if watcher.find_file():
-                    start_dt = datetime.now()
-                    print((f"\n-------- {start_dt:%m-%d-%Y %H:%M} {'-'*40}"))
-                    print(f"Backup '{backup.get('descr', 'No description')}' found.")
-
-                    # Stop Green LED blink and start red LED blink
-                    blink_led.stop()
-                    blink_led = ToggleLed(color="red", rate=self.red_led_blink_rate)
-
-                    # Backup new files from local backup directory to backup volume
-                    src = os.path.join(self.local_backup_dir, self.backup_subdir)
-                    dst = os.path.join(watcher.file_path, self.backup_subdir)
-                    print(f"Backing up from '{src}' to '{dst}'...")
-
-                    self.sync_manager.run_sync(src, dst, self.exclude_file)
-
-                    watcher.dismount()
-                    print(f"Local backup copied to '{backup.get('descr', 'No description')}'")
-                    print(f"Backup '{backup.get('descr', 'No description')}' dismounted.")
-                    print("Waiting for new media source or backup...")
-
-                    # Stop red blinking and restart green blink
-                    blink_led.stop()
-                    blink_led = ToggleLed(color="green", rate=self.green_led_blink_rate)
+        # Start Green Slow blink LED
+        self.led_status.start()
+
+        # Finish or clean up copies interrupted by a crash or unplug
+        completed, removed, waiting = self.journal.recover()
+        if completed or removed or waiting:
+            print(f"Interrupted copies: {completed} completed, {removed} removed, {waiting} left to resume.")
+
+        # Pick up anything changed in the local backup while we were not running
+        await asyncio.to_thread(self.update_index, None)
+
+        if self.metrics_server is not None:
+            try:
+                self.metrics_server.start()
+            except OSError as e:
+                print(f"Error starting metrics server on '{self.metrics_server.listen}': {e}")
+                self.metrics_server = None
+
+        if self.thumbnailer is not None:
+            self.thumbnailer.start()
+
+        # Volumes already mounted at startup are reported right away
+        self.mount_monitor.start()
+
+        try:
+            while not self.stopped():
+                # Wait until a source or backup volume is ready (no polling)
+                event = await self._ready.get()
+                if event is None:
+                    break
+
+                kind, entry, watcher = event
+                if kind == "source":
+                    self.schedule_source(entry, watcher)
+                else:
+                    self.schedule_backup(entry, watcher)
+        finally:
+            # stop jobs still running, rsync is terminated and the native engines
+            # stop after their current file
+            self.scheduler.cancel()
+            await self.scheduler.join()
+
+            self.mount_monitor.stop()
+            await asyncio.to_thread(self.mount_monitor.join)
+            # wait for engine and verify threads to see they were cancelled
+            await self._loop.shutdown_default_executor()
+            if self.thumbnailer is not None:
+                self.thumbnailer.stop()
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+            self.led_status.stop()
+            self.index.close()
+            self.journal.close()
             
 
 if __name__ == "__main__":
-    config = JsonConfigReader("config.json")
-    local_backup_dir = config.get("local_backup_dir")
-    backup_subdir = config.get("backup_subdir")
-    backups = config.get("backups", [])
-    sources = config.get("sources", [])
-    exclude_file = config.get("exclude")
-    rsync_log_file = config.get("rsync_log_file", os.path.join(local_backup_dir, "rsync_log.txt"))
-
-    # show rsync log in terminal window
-    tailer = TerminalTailer(rsync_log_file, terminal_emulator="lxterminal") # Use "xterm" or "gnome-terminal" if lxterminal is not available
-    tailer.start_tailing()
+    try:
+        config = load_config("config.json")
+    except ConfigError as e:
+        print(f"{e.path} has errors:")
+        for problem in e.problems:
+            print(f"  {problem}")
+        sys.exit(1)
+
+    # the sync log is no longer tailed in a terminal window of its own
+    print("Follow the sync log with: python sync_log.py tail -f")
 
     # Create and start the AutoBackup thread
-    thread = AutoBackup(local_backup_dir,sources, backups, backup_subdir, exclude_file, rsync_log_file)
+    thread = AutoBackup.from_config(config)
     thread.start()
 
+    # Add or remove sources and backups when config.json is edited
+    config_watcher = ConfigWatcher("config.json", on_change=thread.apply_config, config=config)
+    config_watcher.start()
+
     # run until user hits Enter
     input("Press Enter to end auto backup...\n\n")
 
@@ -160,9 +1014,7 @@ if __name__ == "__main__":
     thread.stop()
 
     # Wait for the thread to finish its execution
+    config_watcher.stop()
     thread.join()
 
-    # Stop tailing
-    tailer.stop_tailing()
-    
     print("\nMain thread: All threads have stopped.")
\ No newline at end of file
@@ -0,0 +1,383 @@
+import ctypes
+import ctypes.util
+import dataclasses
+import difflib
+import hashlib
+import json
+import os
+import select
+import threading
+import typing
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fs_profile import COMPARE
+
+"""
+Validated, reloadable config.json.
+
+load_config() checks config.json against the dataclasses below and returns an
+immutable BackupConfig. Unknown keys (e.g. "backup_subdirectory" for
+"backup_subdir"), wrong types and values outside a field's choices are
+reported together in one ConfigError. Keys starting with "_" are treated as
+comments.
+
+ConfigWatcher watches config.json with inotify (on its directory, since editors
+replace the file by renaming) and calls back with each new valid config; an
+invalid edit is reported and the running config is kept.
+
+Sources, backups and the config support .get(key, default) like the dicts
+they replace.
+"""
+
+# inotify flags from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+RELOAD_DELAY = 0.5
+
+
+class ConfigError(ValueError):
+    """
+    config.json is missing, not valid JSON or does not match the schema.
+    """
+    def __init__(self, path, problems):
+        self.path = path
+        self.problems = list(problems)
+        super().__init__(f"{path}: " + "; ".join(self.problems))
+
+
+class _Entry:
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        """ dict style access; None values return default """
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+
+@dataclass(frozen=True, slots=True)
+class Source(_Entry):
+    """ A source volume (phone, camera card) ingested into the local backup """
+    volume: str
+    directory: str = ""
+    descr: str = "No description"
+    engine: str = field(default="rsync", metadata={"choices": ("rsync", "native")})
+    verify: Optional[bool] = None
+    include: tuple[str, ...] = ()
+    exclude: tuple[str, ...] = ()
+    delete_copied: bool = False
+    delete_min_backups: int = field(default=0, metadata={"min": 0})
+    delete_dry_run: bool = True
+    fs_profile: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class Backup(_Entry):
+    """ A backup volume the local backup is copied to """
+    volume: str
+    directory: str = ""
+    descr: str = "No description"
+    engine: str = field(default="rsync", metadata={"choices": ("rsync", "native")})
+    verify: Optional[bool] = None
+    include: tuple[str, ...] = ()
+    exclude: tuple[str, ...] = ()
+    max_seconds: Optional[float] = field(default=None, metadata={"min": 1})
+    max_bytes: Optional[int] = field(default=None, metadata={"min": 1})
+    fs_profile: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class FsProfileSettings(_Entry):
+    """ Changes to a filesystem profile, or a new one (see fs_profile.py) """
+    name: str
+    fs_types: Optional[tuple[str, ...]] = None
+    compare: Optional[str] = field(default=None, metadata={"choices": COMPARE})
+    modify_window: Optional[int] = field(default=None, metadata={"min": 0})
+    rsync_options: Optional[tuple[str, ...]] = None
+
+
+@dataclass(frozen=True, slots=True)
+class BackupConfig(_Entry):
+    """ The whole of config.json """
+    local_backup_dir: str
+    backup_subdir: str
+    rsync_log_file: Optional[str] = None
+    log_max_mb: float = field(default=10.0, metadata={"min": 0})
+    log_max_age_days: float = field(default=7.0, metadata={"min": 0})
+    log_keep: int = field(default=10, metadata={"min": 0})
+    exclude: Optional[str] = None
+    archive_layout: str = field(default="flat", metadata={"choices": ("flat", "dated")})
+    max_concurrent_backups: int = field(default=2, metadata={"min": 1})
+    max_concurrent_jobs: int = field(default=4, metadata={"min": 1})
+    max_jobs_per_device: int = field(default=1, metadata={"min": 1})
+    index_db: Optional[str] = None
+    source_state_file: Optional[str] = None
+    verify_after_sync: bool = True
+    verify_workers: int = field(default=2, metadata={"min": 1})
+    tee_ingest: bool = True
+    backup_max_seconds: Optional[float] = field(default=None, metadata={"min": 1})
+    backup_max_bytes: Optional[int] = field(default=None, metadata={"min": 1})
+    backup_max_mbps: Optional[float] = field(default=None, metadata={"min": 0.1})
+    adaptive_throttle: bool = True
+    thumbnail_cache_dir: Optional[str] = None
+    thumbnail_cache_mb: float = field(default=256.0, metadata={"min": 0})
+    thumbnail_workers: int = field(default=1, metadata={"min": 0})
+    sync_events_file: Optional[str] = None
+    metrics_listen: Optional[str] = None
+    exclude_rules: tuple[str, ...] = ()
+    fs_profiles: tuple[FsProfileSettings, ...] = ()
+    menus: tuple = ()
+    sources: tuple[Source, ...] = ()
+    backups: tuple[Backup, ...] = ()
+
+
+def _type_name(typ):
+    if typing.get_origin(typ) is tuple or typ is tuple:
+        args = typing.get_args(typ)
+        return f"list of {_type_name(args[0])}" if args else "list"
+    if typing.get_origin(typ) is typing.Union:
+        return " or ".join(_type_name(t) for t in typing.get_args(typ) if t is not type(None)) + " or null"
+    if dataclasses.is_dataclass(typ):
+        return "object"
+    return {str: "string", int: "integer", float: "number", bool: "true/false"}.get(typ, typ.__name__)
+
+
+def _convert(value, typ, where, problems):
+    """ Checks a JSON value against a field type, returns the (immutable) value or None. """
+    origin = typing.get_origin(typ)
+    if origin is typing.Union:
+        if value is None:
+            return None
+        return _convert(value, [t for t in typing.get_args(typ) if t is not type(None)][0], where, problems)
+    if origin is tuple or typ is tuple:
+        if not isinstance(value, list):
+            problems.append(f"{where}: expected {_type_name(typ)}")
+            return None
+        args = typing.get_args(typ)
+        if not args:
+            return tuple(value)
+        return tuple(_convert(v, args[0], f"{where}[{i}]", problems) for i, v in enumerate(value))
+    if dataclasses.is_dataclass(typ):
+        if not isinstance(value, dict):
+            problems.append(f"{where}: expected an object")
+            return None
+        return _build(typ, value, where, problems)
+    if typ is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    # bool is an int in Python, but not in config.json
+    if typ is int and (isinstance(value, bool) or not isinstance(value, int)):
+        problems.append(f"{where}: expected an integer, got {json.dumps(value)}")
+        return None
+    if not isinstance(value, typ):
+        problems.append(f"{where}: expected {_type_name(typ)}, got {json.dumps(value)}")
+        return None
+    return value
+
+
+def _build(cls, data, where, problems):
+    """ Builds a dataclass from a JSON object, collecting problems instead of stopping at the first. """
+    hints = typing.get_type_hints(cls)
+    fields = {f.name: f for f in dataclasses.fields(cls)}
+    values = {}
+    for key, value in data.items():
+        if key.startswith("_"):
+            continue
+        if key not in fields:
+            close = difflib.get_close_matches(key, fields, n=1)
+            hint = f", did you mean '{close[0]}'?" if close else ""
+            problems.append(f"{where}: unknown key '{key}'{hint}")
+            continue
+        f = fields[key]
+        reported = len(problems)
+        converted = _convert(value, hints[key], f"{where}.{key}", problems)
+        if len(problems) > reported:
+            continue
+        if converted is None:
+            # null for an Optional field, the default
+            values[key] = None
+            continue
+        choices = f.metadata.get("choices")
+        if choices and converted not in choices:
+            problems.append(f"{where}.{key}: '{converted}' is not one of {', '.join(choices)}")
+            continue
+        if "min" in f.metadata and converted < f.metadata["min"]:
+            problems.append(f"{where}.{key}: must be at least {f.metadata['min']}")
+            continue
+        values[key] = converted
+
+    complete = True
+    for name, f in fields.items():
+        if name not in values and f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING:
+            if name not in data:
+                problems.append(f"{where}: missing required key '{name}'")
+            complete = False
+    return cls(**values) if complete else None
+
+
+def parse_config(data, path="config.json"):
+    """
+    Validates a loaded config.json.
+
+    Returns:
+        BackupConfig
+
+    Raises:
+        ConfigError: Listing every problem found.
+    """
+    problems = []
+    if not isinstance(data, dict):
+        raise ConfigError(path, ["expected a JSON object"])
+    config = _build(BackupConfig, data, "config", problems)
+    if problems or config is None:
+        raise ConfigError(path, problems)
+    if config.rsync_log_file is None:
+        config = dataclasses.replace(config, rsync_log_file=os.path.join(config.local_backup_dir, "rsync_log.txt"))
+    return config
+
+
+def load_config(path="config.json"):
+    """
+    Reads and validates config.json.
+
+    Returns:
+        BackupConfig
+
+    Raises:
+        ConfigError: If the file can not be read, is not JSON or does not match the schema.
+    """
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except OSError as e:
+        raise ConfigError(path, [e.strerror or str(e)])
+    except json.JSONDecodeError as e:
+        raise ConfigError(path, [f"invalid JSON: {e}"])
+    return parse_config(data, path)
+
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    A thread that reloads config.json when it changes and passes each new valid config on.
+    """
+
+    def __init__(self, path, on_change, config=None, *args, **kwargs):
+        """
+        Initializes the ConfigWatcher.
+
+        Args:
+            path (str): config.json.
+            on_change (callable): Called with the new BackupConfig after a valid change.
+            config (BackupConfig, optional): The config in use, changes are compared to it.
+        """
+        kwargs.setdefault("daemon", True)
+        super().__init__(*args, **kwargs)
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.config = config
+        self._digest = self._file_digest()
+
+        self._stop_r, self._stop_w = os.pipe()
+        self._fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(os.path.dirname(self.path)),
+                                     IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, f"inotify_add_watch failed: {os.strerror(err)}")
+
+    def _file_digest(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return hashlib.blake2b(f.read(), digest_size=16).digest()
+        except OSError:
+            return None
+
+    def stop(self):
+        """Signals the watcher thread to stop."""
+        os.write(self._stop_w, b"x")
+
+    def reload(self):
+        """ Loads config.json if its contents changed, returns the new config or None. """
+        digest = self._file_digest()
+        if digest is None or digest == self._digest:
+            return None
+        self._digest = digest
+        try:
+            config = load_config(self.path)
+        except ConfigError as e:
+            print(f"Config not reloaded, '{self.path}' has errors:")
+            for problem in e.problems:
+                print(f"  {problem}")
+            return None
+        if config == self.config:
+            return None
+        self.config = config
+        return config
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self._stop_r, select.POLLIN)
+        poller.register(self._fd, select.POLLIN)
+        name = os.fsencode(os.path.basename(self.path))
+        try:
+            while True:
+                events = poller.poll()
+                if any(fd == self._stop_r for fd, _ in events):
+                    return
+                changed = False
+                try:
+                    while True:
+                        data = os.read(self._fd, 65536)
+                        if not data:
+                            break
+                        # struct inotify_event: wd, mask, cookie, len, name
+                        pos = 0
+                        while pos < len(data):
+                            length = int.from_bytes(data[pos + 12:pos + 16], "little")
+                            if data[pos + 16:pos + 16 + length].rstrip(b"\0") == name:
+                                changed = True
+                            pos += 16 + length
+                except BlockingIOError:
+                    pass
+                if not changed:
+                    continue
+
+                # let the editor finish writing, then reload once
+                if poller.poll(int(RELOAD_DELAY * 1000)):
+                    try:
+                        while os.read(self._fd, 65536):
+                            pass
+                    except BlockingIOError:
+                        pass
+                config = self.reload()
+                if config is not None:
+                    try:
+                        self.on_change(config)
+                    except Exception as e:
+                        print(f"Error applying new config: {e}")
+        finally:
+            os.close(self._fd)
+            os.close(self._stop_r)
+            os.close(self._stop_w)
+
+# Command line:
+#   python backup_config.py [config.json]   validate and print the config
+if __name__ == "__main__":
+    import sys
+
+    try:
+        config = load_config(sys.argv[1] if len(sys.argv) > 1 else "config.json")
+    except ConfigError as e:
+        print(f"{e.path} has errors:")
+        for problem in e.problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print(config)
@@ -0,0 +1,140 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+"""
+asyncio scheduler for the sync jobs of attached volumes.
+
+Every job (a source ingest or a backup drive sync) is its own task on the
+AutoBackup event loop, so a card inserted while the phone syncs starts right
+away. Jobs on the same physical device (see device_key()) are limited
+to max_per_device at a time (one by default, so a slow HDD is never hit by two
+syncs), max_jobs caps the jobs running overall, and a separate semaphore caps
+how many jobs read from the local backup SSD at once.
+
+cancel() cancels every job; a job waiting for a slot stops at once, a running
+one at its next await (see AutoBackup.sync for how the engines are stopped).
+"""
+
+class BackupScheduler:
+    """
+    Runs sync jobs as asyncio tasks with per-device and global limits.
+    """
+
+    def __init__(self, max_local_reads=2, max_jobs=4, max_per_device=1):
+        """
+        Initializes the BackupScheduler.
+
+        Args:
+            max_local_reads (int): Maximum number of jobs reading from the
+                                   local backup directory at the same time.
+            max_jobs (int): Maximum number of jobs running at the same time.
+            max_per_device (int): Maximum number of jobs running on one device.
+        """
+        self.max_local_reads = max(1, int(max_local_reads))
+        self.max_jobs = max(1, int(max_jobs))
+        self.max_per_device = max(1, int(max_per_device))
+        self._local_reads = asyncio.BoundedSemaphore(self.max_local_reads)
+        self._jobs = asyncio.BoundedSemaphore(self.max_jobs)
+        self._devices = {}    # device key -> [semaphore, number of jobs queued or running]
+        self._tasks = {}      # task -> description, queued or running
+        self._active = {}     # task -> description of running job
+
+    @staticmethod
+    def device_key(path, sysfs_root="/sys"):
+        """
+        Returns a key identifying the physical device holding path.
+
+        Every gvfs mount shares the st_dev of the gvfsd-fuse daemon, so those are
+        keyed by their mount name up to the first comma ("mtp:host=Pixel_8_...",
+        "smb-share:server=nas"): the storages of one phone share a key, two phones
+        do not. Partitions of one disk have different st_dev, so block devices are
+        keyed by the disk found in sysfs. Falls back to st_dev, and to the path
+        itself if it can not be stat'ed.
+        """
+        parts = os.path.abspath(path).split(os.sep)
+        if "gvfs" in parts[:-1]:
+            mount = parts[parts.index("gvfs") + 1]
+            return "gvfs:" + mount.split(",")[0]
+        try:
+            dev = os.stat(path).st_dev
+        except OSError:
+            return path
+        block = os.path.join(sysfs_root, "dev", "block", f"{os.major(dev)}:{os.minor(dev)}")
+        try:
+            real = os.path.realpath(block)
+            if os.path.exists(os.path.join(real, "partition")):
+                # /sys/devices/.../block/sda/sda1
+                real = os.path.dirname(real)
+            if os.path.isdir(real):
+                return "disk:" + os.path.basename(real)
+        except OSError:
+            pass
+        return dev
+
+    @asynccontextmanager
+    async def local_read_slot(self):
+        """
+        Async context manager that holds one of the local read slots.
+        Wrap only the part of a job that reads the local SSD.
+        """
+        async with self._local_reads:
+            yield
+
+    def submit(self, device, descr, job):
+        """
+        Starts a job task. It waits for its device and a global slot before running.
+        Must be called on the event loop.
+
+        Args:
+            device: Device key, see device_key().
+            descr (str): Description of the job, used for status.
+            job (callable): Coroutine function with no arguments to run.
+
+        Returns:
+            asyncio.Task
+        """
+        slot = self._devices.get(device)
+        if slot is None:
+            slot = self._devices[device] = [asyncio.Semaphore(self.max_per_device), 0]
+        slot[1] += 1
+        task = asyncio.create_task(self._run(device, slot, descr, job), name=f"backup-{descr}")
+        self._tasks[task] = descr
+        return task
+
+    async def _run(self, device, slot, descr, job):
+        task = asyncio.current_task()
+        try:
+            async with slot[0], self._jobs:
+                self._active[task] = descr
+                await job()
+        except asyncio.CancelledError:
+            print(f"Backup job '{descr}' cancelled.")
+            raise
+        except Exception as e:
+            print(f"Error occurred in backup job '{descr}': {e}")
+        finally:
+            self._active.pop(task, None)
+            self._tasks.pop(task, None)
+            slot[1] -= 1
+            if slot[1] == 0:
+                # no more work for this device
+                del self._devices[device]
+
+    def active(self):
+        """Returns descriptions of jobs currently running."""
+        return list(self._active.values())
+
+    def queued(self):
+        """Returns descriptions of jobs waiting for a device or global slot."""
+        return [descr for task, descr in self._tasks.items() if task not in self._active]
+
+    def cancel(self):
+        """Cancels every queued and running job."""
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def join(self):
+        """Waits for all jobs, including ones submitted while waiting, to finish."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
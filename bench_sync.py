@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from dir_sync import DirSync
+from native_sync import NativeSync
+from archive_layout import DatedIngest
+from fs_profile import PROFILES
+
+"""
+Benchmark for the sync engines on synthetic photo archives.
+
+Generates a source tree of JPEG, RAW and video sized files and a destination
+that already holds all but a configurable fraction of them (hard linked, so
+setup is fast and uses no extra space), then runs each engine's run_sync()
+against it and reports:
+
+    files/s, MB/s   for the copy run
+    scan time       a second run with nothing left to copy, i.e. pure compare cost
+    peak RSS        of this process plus any subprocesses (rsync), sampled from /proc
+    subprocesses    number of processes started during the run
+    recopied        files the second run copied again, 0 unless the comparison is wrong
+
+Each result is appended as one JSON line to the results file so runs can be
+compared over time. Use a tmpfs work directory to measure the engines rather
+than the disk.
+
+To check a filesystem profile (see fs_profile.py) on a real drive, put the
+destination on it. Files are then copied there instead of hard linked, with
+the times the filesystem keeps, and rsync runs with the profile's options:
+
+    python bench_sync.py --files 10000 --new-ratio 0.01 --workdir /dev/shm/bench
+    python bench_sync.py --engines rsync --profile fat --dest /media/pi/SDCARD/bench
+    python bench_sync.py compare bench_results.jsonl
+"""
+
+# name: (share of files, min size, max size, extension)
+FILE_TYPES = {
+    "jpeg":  (0.85, 2 * 1024 * 1024, 6 * 1024 * 1024, ".JPG"),
+    "raw":   (0.12, 15 * 1024 * 1024, 25 * 1024 * 1024, ".ORF"),
+    "video": (0.03, 1024 * 1024 * 1024, 4 * 1024 * 1024 * 1024, ".MP4"),
+}
+
+ENGINES = {
+    "rsync": lambda log, events: DirSync(log_file=log, events=events),
+    "native": lambda log, events: NativeSync(log_file=log, fsync=False, events=events),
+    "dated": lambda log, events: DatedIngest(log_file=log, fsync=False, events=events),
+}
+
+_BLOCK = os.urandom(1024 * 1024)
+
+
+def write_file(path, size):
+    """ Writes size bytes of incompressible data without generating it all. """
+    offset = random.randrange(len(_BLOCK))
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            chunk = _BLOCK[offset:] + _BLOCK[:offset]
+            n = min(remaining, len(chunk))
+            f.write(chunk[:n])
+            remaining -= n
+
+
+def generate_tree(root, files, scale, per_dir, seed):
+    """
+    Creates a synthetic source tree.
+
+    Args:
+        root (str): Directory to create the files in.
+        files (int): Number of files.
+        scale (float): Multiplier for file sizes, e.g. 0.001 for a quick run.
+        per_dir (int): Files per directory, 0 for one flat directory.
+        seed (int): Random seed, the same seed gives the same tree.
+
+    Returns:
+        list: (relative path, size) of the files created.
+    """
+    rng = random.Random(seed)
+    kinds = list(FILE_TYPES)
+    weights = [FILE_TYPES[k][0] for k in kinds]
+    created = []
+    for i in range(files):
+        kind = rng.choices(kinds, weights)[0]
+        _, low, high, ext = FILE_TYPES[kind]
+        size = max(1, int(rng.randint(low, high) * scale))
+        name = f"PXL_{20240101 + i // 1000:08d}_{i:09d}{ext}"
+        rel_path = os.path.join(f"{i // per_dir:04d}", name) if per_dir else name
+        path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file(path, size)
+        created.append((rel_path, size))
+    return created
+
+
+def populate_dest(source, dest, created, new_ratio, seed):
+    """
+    Hard links all but new_ratio of the source files into dest, so they look
+    already synced, or copies them where dest can not link to source.
+    Returns the number of files left to copy.
+    """
+    rng = random.Random(seed + 1)
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+    os.makedirs(dest)
+    new = 0
+    for rel_path, _ in created:
+        if rng.random() < new_ratio:
+            new += 1
+            continue
+        target = os.path.join(dest, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(os.path.join(source, rel_path), target)
+        except OSError:
+            # another filesystem: a real copy, with the times it can keep
+            shutil.copy2(os.path.join(source, rel_path), target)
+    return new
+
+
+class ProcessSampler(threading.Thread):
+    """
+    Samples /proc to find the peak RSS of this process and its descendants
+    and how many subprocesses were started.
+    """
+
+    def __init__(self, interval=0.02):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_rss = 0
+        self.children = set()
+        self._stop_event = threading.Event()
+
+    def _descendants(self):
+        parents = {}
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/stat", 'r') as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                parents[int(pid)] = int(fields[1])
+            except (OSError, IndexError, ValueError):
+                pass
+        found = {os.getpid()}
+        changed = True
+        while changed:
+            changed = False
+            for pid, ppid in parents.items():
+                if ppid in found and pid not in found:
+                    found.add(pid)
+                    changed = True
+        return found
+
+    def _rss(self, pid):
+        try:
+            with open(f"/proc/{pid}/status", 'r') as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def run(self):
+        while not self._stop_event.is_set():
+            pids = self._descendants()
+            self.children.update(pid for pid in pids if pid != os.getpid())
+            self.peak_rss = max(self.peak_rss, sum(self._rss(pid) for pid in pids))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def timed_run(engine, source, dest, exclude_file, **kwargs):
+    """ Runs one sync, returns (seconds, peak RSS, subprocess count). """
+    sampler = ProcessSampler()
+    sampler.start()
+    start = time.perf_counter()
+    engine.run_sync(source, dest, exclude_file, **kwargs)
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+    return elapsed, sampler.peak_rss, len(sampler.children)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.realpath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def run_benchmark(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_sync_")
+    source = os.path.join(workdir, "source")
+    dest = args.dest or os.path.join(workdir, "dest")
+    log = os.path.join(workdir, "bench_log.txt")
+
+    if os.path.exists(source):
+        shutil.rmtree(source)
+    print(f"Generating {args.files} files in '{source}'...")
+    start = time.perf_counter()
+    created = generate_tree(source, args.files, args.scale, args.per_dir, args.seed)
+    total_bytes = sum(size for _, size in created)
+    print(f"  {total_bytes / 1e6:.1f} MB in {time.perf_counter() - start:.1f} sec")
+
+    exclude_file = os.path.join(workdir, "exclude.txt")
+    with open(exclude_file, 'w') as f:
+        f.write("# benchmark\n._*\n*.AAE\n")
+
+    results = []
+    for name in args.engines:
+        new = populate_dest(source, dest, created, args.new_ratio, args.seed)
+        # start without a manifest left by a previous engine
+        manifest = NativeSync.manifest_path(dest)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        new_bytes = sum(os.path.getsize(os.path.join(source, p)) for p, _ in created
+                        if not os.path.exists(os.path.join(dest, p)))
+
+        copies = []
+        try:
+            engine = ENGINES[name](log, lambda event: event["event"] == "file_done" and copies.append(event["path"]))
+            options = {}
+            if args.profile and isinstance(engine, DirSync):
+                options["options"] = PROFILES[args.profile].rsync_args()
+            copy_sec, copy_rss, copy_procs = timed_run(engine, source, dest, exclude_file, **options)
+            copies.clear()
+            scan_sec, scan_rss, scan_procs = timed_run(engine, source, dest, exclude_file, **options)
+        except Exception as e:
+            print(f"{name}: failed: {e}")
+            continue
+
+        result = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "host": platform.node(),
+            "engine": name,
+            "profile": args.profile if name == "rsync" else None,
+            "files": args.files,
+            "new_files": new,
+            "new_ratio": args.new_ratio,
+            "scale": args.scale,
+            "per_dir": args.per_dir,
+            "total_mb": round(total_bytes / 1e6, 1),
+            "copied_mb": round(new_bytes / 1e6, 1),
+            "copy_sec": round(copy_sec, 3),
+            "files_per_sec": round(new / copy_sec, 1) if copy_sec else None,
+            "mb_per_sec": round(new_bytes / 1e6 / copy_sec, 1) if copy_sec else None,
+            "scan_sec": round(scan_sec, 3),
+            "peak_rss_mb": round(max(copy_rss, scan_rss) / 1e6, 1),
+            "subprocesses": copy_procs + scan_procs,
+            "recopied": len(copies),
+        }
+        results.append(result)
+        print(f"{name:>7}: {result['copy_sec']:8.2f} s copy, {result['files_per_sec']} files/s, "
+              f"{result['mb_per_sec']} MB/s, {result['scan_sec']:.2f} s scan, "
+              f"{result['peak_rss_mb']} MB peak RSS, {result['subprocesses']} subprocesses")
+        if copies:
+            print(f"{'':>9}{len(copies)} files copied again on the second run, check the profile")
+
+    with open(args.results, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    print(f"Results appended to '{args.results}'")
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir)
+        if args.dest:
+            shutil.rmtree(dest)
+
+
+def compare(results_file):
+    """ Prints results grouped by engine and tree size, oldest first. """
+    with open(results_file, 'r') as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    results.sort(key=lambda r: (r["engine"], r.get("profile") or "", r["files"], r["new_ratio"], r["time"]))
+    for r in results:
+        engine = f"{r['engine']}/{r['profile']}" if r.get("profile") else r["engine"]
+        print(f"{r['time']} {r.get('commit') or '-':>8} {engine:>7} {r['files']:>8} files "
+              f"{r['new_ratio']:>6} new: {r['copy_sec']:8.2f} s copy, {r['mb_per_sec']} MB/s, "
+              f"{r['scan_sec']:.2f} s scan, {r['peak_rss_mb']} MB, {r['subprocesses']} procs")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        compare(sys.argv[2] if len(sys.argv) > 2 else "bench_results.jsonl")
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark sync engines on a synthetic photo archive.")
+    parser.add_argument("--files", type=int, default=1000, help="number of files in the archive (1k to 1M)")
+    parser.add_argument("--new-ratio", type=float, default=0.01, help="fraction of files not yet synced")
+    parser.add_argument("--scale", type=float, default=0.01, help="file size multiplier, 1.0 for real sizes")
+    parser.add_argument("--per-dir", type=int, default=0, help="files per directory, 0 for a flat archive")
+    parser.add_argument("--engines", nargs="+", default=["rsync", "native"], choices=sorted(ENGINES))
+    parser.add_argument("--profile", choices=sorted(PROFILES), help="filesystem profile rsync runs with")
+    parser.add_argument("--dest", help="destination directory, e.g. on the drive a profile is checked on")
+    parser.add_argument("--workdir", help="where to build the trees, e.g. /dev/shm/bench (default: temp dir)")
+    parser.add_argument("--results", default="bench_results.jsonl", help="JSON lines file results are added to")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="keep the generated trees")
+    run_benchmark(parser.parse_args())
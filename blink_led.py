@@ -1,5 +1,6 @@
 import os
 import subprocess
+import threading
 import time
 
 class ToggleLed():
@@ -36,7 +37,260 @@ class ToggleLed():
             self._process.kill() # Sends SIGKILL if cleanup takes too long
             print("Bash script forcefully terminated.")
 
+# LED sysfs directories, relative to the leds root
+ACT = "ACT"     # green light
+PWR = "PWR"     # red light
+LEDS = (ACT, PWR)
+SYSFS_LEDS = "/sys/class/leds"
+# Pi 5: ACT is active-low, writing 1 turns it off
+ACTIVE_LOW = {ACT}
+
+
+def blink(led, half_period):
+    """ Pattern: one LED on for half_period, off for half_period, the other LED off """
+    return [({**dict.fromkeys(LEDS, 0), led: 1}, half_period), (dict.fromkeys(LEDS, 0), half_period)]
+
+
+# Named patterns: lists of ({led: 1 lit or 0 dark}, seconds) steps, repeated until changed.
+# Every step sets both LEDs; LedDriver handles ACT's polarity.
+PATTERNS = {
+    "off":   [({ACT: 0, PWR: 0}, 1.0)],
+    "idle":  blink(ACT, 0.75),
+    "copying": blink(PWR, 0.25),
+    # three quick red blinks then a pause
+    "error": blink(PWR, 0.1) * 3 + [({ACT: 0, PWR: 0}, 0.7)],
+}
+
+# progress pattern: red half period goes from slow to fast as a sync completes
+PROGRESS_SLOW = 0.5
+PROGRESS_FAST = 0.08
+
+
+def make_fake_sysfs(root):
+    """
+    Creates a fake /sys/class/leds tree (ACT and PWR brightness files) so
+    LedDriver can run off-Pi. Returns root.
+    """
+    for led in LEDS:
+        os.makedirs(os.path.join(root, led), exist_ok=True)
+        with open(os.path.join(root, led, "brightness"), 'w') as f:
+            f.write("0\n")
+    return root
+
+
+class LedDriver(threading.Thread):
+    """ Blinks the ACT and PWR LEDs in process.
+
+        The brightness files are opened once and kept open; patterns are
+        timed against time.monotonic() deadlines so they do not drift, and a
+        pattern change takes effect immediately. Writing the brightness files
+        needs root or a udev rule giving the user write access.
+    """
+
+    def __init__(self, sysfs_root=SYSFS_LEDS):
+        """
+        Initializes the LedDriver and opens the brightness files.
+
+        Args:
+            sysfs_root (str): Directory holding the ACT and PWR LED directories,
+                              a make_fake_sysfs() directory for testing.
+
+        Raises:
+            OSError: If a brightness file can not be opened for writing.
+        """
+        super().__init__(daemon=True)
+        self.sysfs_root = sysfs_root
+        self._fds = {}
+        try:
+            for led in LEDS:
+                self._fds[led] = os.open(os.path.join(sysfs_root, led, "brightness"), os.O_WRONLY)
+        except OSError:
+            self._close()
+            raise
+        self._cond = threading.Condition()
+        self._pattern = PATTERNS["off"]
+        self._changed = False
+        self._stopping = False
+        # both dark, the same start state as blink.sh
+        self._write(ACT, 0)
+        self._write(PWR, 0)
+
+    def _write(self, led, lit):
+        """ Lights (1) or darkens (0) an LED, writing the brightness its polarity needs """
+        if led in ACTIVE_LOW:
+            lit = not lit
+        os.pwrite(self._fds[led], b"1\n" if lit else b"0\n", 0)
+
+    def _close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+
+    def set_pattern(self, pattern):
+        """ Switch to a pattern, by name (see PATTERNS) or as a list of steps.
+            An LED a step leaves out is dark during that step.
+        """
+        if isinstance(pattern, str):
+            pattern = PATTERNS[pattern]
+        pattern = [({**dict.fromkeys(LEDS, 0), **values}, seconds) for values, seconds in pattern]
+        with self._cond:
+            self._pattern = pattern
+            self._changed = True
+            self._cond.notify()
+
+    def run(self):
+        with self._cond:
+            deadline = time.monotonic()
+            while not self._stopping:
+                pattern = self._pattern
+                if self._changed:
+                    # start the new pattern now, otherwise carry on from the last deadline
+                    self._changed = False
+                    deadline = time.monotonic()
+                for values, seconds in pattern:
+                    for led, value in values.items():
+                        self._write(led, value)
+                    deadline += seconds
+                    while not (self._changed or self._stopping):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    if self._changed or self._stopping:
+                        break
+
+            # same end state as the blink.sh cleanup: red dark, green lit
+            self._write(PWR, 0)
+            self._write(ACT, 1)
+            self._close()
+
+    def stop(self):
+        """ Stop blinking, turn the LEDs off and close the brightness files """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self.is_alive():
+            self.join()
+        elif self._fds:
+            self._close()
+
+
+class LedStatus():
+    """ Shows the number of sync jobs in flight on the LEDs:
+        slow green blink while idle, fast red blink while any job is running,
+        the error pattern while idle after a job failed. The red blink speeds
+        up with progress() when the sync reports it.
+
+        Uses LedDriver, or ToggleLed (blink.sh) if the LED brightness files
+        can not be opened.
+    """
+
+    def __init__(self, red_rate=0.25, green_rate=0.75, sysfs_root=SYSFS_LEDS):
+        self.red_rate = red_rate
+        self.green_rate = green_rate
+        self.sysfs_root = sysfs_root
+        self._lock = threading.Lock()
+        self._jobs = 0
+        self._failed = False
+        self._progress = None
+        self._driver = None
+        self._led = None
+
+    def start(self):
+        """ Start the idle (green) blink """
+        with self._lock:
+            try:
+                self._driver = LedDriver(self.sysfs_root)
+                self._driver.start()
+            except OSError as e:
+                print(f"Can not write LED brightness ({e}), using blink.sh.")
+                self._driver = None
+            self._update()
+
+    def _update(self):
+        """ Show the pattern for the current state, called with the lock held """
+        if self._jobs:
+            color, rate = "red", self.red_rate
+            if self._progress is not None:
+                rate = PROGRESS_SLOW - (PROGRESS_SLOW - PROGRESS_FAST) * self._progress
+            pattern = blink(PWR, rate)
+        elif self._failed:
+            color, rate, pattern = "red", 0.1, PATTERNS["error"]
+        else:
+            color, rate = "green", self.green_rate
+            pattern = blink(ACT, rate)
+
+        if self._driver is not None:
+            self._driver.set_pattern(pattern)
+        else:
+            self._set(color=color, rate=rate)
+
+    def _set(self, color, rate):
+        if self._led is not None:
+            self._led.stop()
+        self._led = ToggleLed(color=color, rate=rate)
+
+    def job_started(self):
+        """ Count a new job, switching to red if it is the first """
+        with self._lock:
+            self._jobs += 1
+            if self._jobs == 1:
+                self._failed = False
+                self._progress = None
+                self._update()
+
+    def job_finished(self, ok=True):
+        """ Count a finished job, switching to green (or error if a job failed) if it was the last """
+        with self._lock:
+            self._jobs = max(0, self._jobs - 1)
+            if not ok:
+                self._failed = True
+            if self._jobs == 0:
+                self._progress = None
+                self._update()
+
+    def progress(self, fraction):
+        """ Speed up the red blink as a sync progresses (0.0 to 1.0).
+            Only the blink rate of the LedDriver is changed, not blink.sh's.
+        """
+        with self._lock:
+            if not self._jobs or self._driver is None:
+                return
+            fraction = min(1.0, max(0.0, fraction))
+            # only re-time the pattern on visible changes
+            if self._progress is None or abs(fraction - self._progress) >= 0.05:
+                self._progress = fraction
+                self._update()
+
+    def jobs(self):
+        """ Number of jobs in flight """
+        with self._lock:
+            return self._jobs
+
+    def stop(self):
+        """ Stop blinking """
+        with self._lock:
+            if self._driver is not None:
+                self._driver.stop()
+                self._driver = None
+            if self._led is not None:
+                self._led.stop()
+                self._led = None
+
 if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 2 and sys.argv[1] == "--fake":
+        # python blink_led.py --fake /tmp/leds   (watch /tmp/leds/*/brightness)
+        driver = LedDriver(make_fake_sysfs(sys.argv[2]))
+        driver.start()
+        for name in ("idle", "copying", "error"):
+            print(f"Pattern: {name}")
+            driver.set_pattern(name)
+            time.sleep(3)
+        driver.stop()
+        sys.exit(0)
+
     print("\nMain thread: Blink Red LED...")
 
     # Create subprocess to blink red LED
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import threading
+import time
+
+"""
+Write-ahead journal of copies in flight.
+
+Before the native engines create a .partial temp file they record it here with
+the source file's size and mtime. While copying, the number of bytes safely on
+disk (fsync'ed) is committed every COMMIT_BYTES. If a phone, card or drive is
+pulled mid-copy, the temp file and its journal entry are kept, and the next
+copy of the same unchanged source file resumes from the last committed offset
+instead of starting over. Entries are removed once the temp file is renamed
+into place.
+
+recover() runs at startup: finished copies whose rename never happened are
+completed, and temp files whose journal entries are older than max_age_days
+are removed.
+"""
+
+COMMIT_BYTES = 64 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inflight (
+    tmp_path     TEXT PRIMARY KEY,
+    src_path     TEXT NOT NULL,
+    dst_path     TEXT NOT NULL,
+    size         INTEGER NOT NULL,
+    src_mtime_ns INTEGER NOT NULL,
+    committed    INTEGER NOT NULL DEFAULT 0,
+    started_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+"""
+
+
+class CopyJournal:
+    """
+    SQLite (WAL mode) journal of temp files being written.
+    """
+
+    def __init__(self, db_path):
+        """
+        Initializes the CopyJournal, creating the database if needed.
+
+        Args:
+            db_path (str): Path of the SQLite database file.
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def begin(self, tmp_path, src_path, dst_path, st):
+        """
+        Records a copy about to start, or finds one to resume.
+
+        Args:
+            tmp_path (str): Temp file the copy is written to.
+            src_path (str): Source file.
+            dst_path (str): Final destination.
+            st (os.stat_result): stat of the source file.
+
+        Returns:
+            int: Offset to resume from, 0 to start over.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT src_path, size, src_mtime_ns, committed FROM inflight WHERE tmp_path = ?",
+                (tmp_path,)).fetchone()
+            if row and row[:3] == (src_path, st.st_size, st.st_mtime_ns):
+                try:
+                    if os.path.getsize(tmp_path) >= row[3]:
+                        return row[3]
+                except OSError:
+                    pass
+            self._conn.execute(
+                """INSERT OR REPLACE INTO inflight
+                   (tmp_path, src_path, dst_path, size, src_mtime_ns, committed, started_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, 0, ?, ?)""",
+                (tmp_path, src_path, dst_path, st.st_size, st.st_mtime_ns, now, now))
+        return 0
+
+    def commit(self, tmp_path, offset):
+        """ Records that the temp file holds offset bytes on disk. """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE inflight SET committed = ?, updated_at = ? WHERE tmp_path = ?",
+                               (offset, time.time(), tmp_path))
+
+    def finish(self, tmp_path):
+        """ Forgets a copy once it was renamed into place (or abandoned). """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM inflight WHERE tmp_path = ?", (tmp_path,))
+
+    def pending(self):
+        """
+        Returns:
+            list: (tmp_path, src_path, dst_path, size, committed, updated_at) of copies in flight.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT tmp_path, src_path, dst_path, size, committed, updated_at FROM inflight").fetchall()
+
+    def recover(self, max_age_days=30):
+        """
+        Cleans up after a crash or unplug. Completes temp files that were fully
+        written, drops entries whose temp file is gone and removes temp files
+        not touched for max_age_days. Anything else is left to be resumed.
+
+        Returns:
+            tuple: (completed, removed, left to resume)
+        """
+        completed = removed = waiting = 0
+        cutoff = time.time() - max_age_days * 86400
+        for tmp_path, src_path, dst_path, size, committed, updated_at in self.pending():
+            if not os.path.exists(os.path.dirname(tmp_path)):
+                # drive not attached, resume the next time it is
+                if updated_at < cutoff:
+                    self.finish(tmp_path)
+                    removed += 1
+                else:
+                    waiting += 1
+                continue
+
+            try:
+                tmp_size = os.path.getsize(tmp_path)
+            except OSError:
+                self.finish(tmp_path)
+                removed += 1
+                continue
+
+            if committed == size and tmp_size == size:
+                try:
+                    st = os.stat(src_path)
+                    os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+                except OSError:
+                    pass
+                os.replace(tmp_path, dst_path)
+                self.finish(tmp_path)
+                completed += 1
+            elif updated_at < cutoff:
+                os.remove(tmp_path)
+                self.finish(tmp_path)
+                removed += 1
+            else:
+                waiting += 1
+        return completed, removed, waiting
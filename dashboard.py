@@ -0,0 +1,313 @@
+import os
+import queue
+import time
+import tkinter as tk
+from collections import deque
+from datetime import datetime
+from tkinter import ttk
+
+"""
+Live progress of the backup for the menu (menu.py).
+
+AutoBackup runs on its own thread and puts every sync event (see
+sync_metrics.py for the events) on a queue the menu subscribed with
+AutoBackup.subscribe(). The Tk mainloop never waits on the backup: the menu
+drains the queue every POLL_MS with SyncProgress.drain(), at most
+MAX_EVENTS_PER_TICK events at a time, and an open Dashboard redraws from the
+SyncProgress on the same timer.
+
+SyncProgress keeps, per destination, the files done, the throughput over the
+last RATE_WINDOW seconds and the ETA of the run, plus a history of the files
+copied (up to MAX_HISTORY rows). The history is shown in a VirtualList, which
+draws only the rows in view, so it costs the same with 10 rows or 100k.
+"""
+
+POLL_MS = 200
+MAX_EVENTS_PER_TICK = 5000
+RATE_WINDOW = 10.0
+MAX_HISTORY = 100000
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1000:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1000
+    return f"{n:.1f} TB"
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+class DestProgress:
+    """ Progress of the syncs into one destination. """
+
+    def __init__(self, dest):
+        self.dest = dest
+        self.source = ""
+        self.engine = ""
+        self.running = False
+        self.files_done = 0
+        self.files_total = None
+        self.bytes_done = 0       # bytes of the files finished this run
+        self.current = None       # path of the file being copied
+        self.current_bytes = 0    # bytes of it copied so far
+        self.eta = None
+        self.eta_ts = None
+        self.returncode = None
+        self.samples = deque()    # (ts, bytes_done + current_bytes) over the last RATE_WINDOW
+
+    def _sample(self, ts):
+        self.samples.append((ts, self.bytes_done + self.current_bytes))
+        while len(self.samples) > 2 and ts - self.samples[0][0] > RATE_WINDOW:
+            self.samples.popleft()
+
+    def throughput(self, now=None):
+        """ Bytes per second over the last RATE_WINDOW seconds, 0 when idle. """
+        if not self.running or len(self.samples) < 2:
+            return 0.0
+        now = time.time() if now is None else now
+        (t0, b0), (t1, b1) = self.samples[0], self.samples[-1]
+        span = max(now, t1) - t0
+        return (b1 - b0) / span if span > 0 else 0.0
+
+    def remaining(self, now=None):
+        """ Seconds left in the run, counted down from the last ETA reported. """
+        if not self.running or self.eta is None:
+            return None
+        now = time.time() if now is None else now
+        return max(0.0, self.eta - (now - self.eta_ts))
+
+
+class SyncProgress:
+    """
+    Folds sync events into per destination progress and a history of copied files.
+    """
+
+    def __init__(self, max_history=MAX_HISTORY):
+        self.max_history = max_history
+        self.dests = {}      # dest -> DestProgress
+        self.history = []    # (ts, dest, path, size, rate), oldest first
+        self.dropped = 0     # rows trimmed from the front of history so far
+
+    def handle(self, event):
+        dest = event.get("dest") or ""
+        progress = self.dests.get(dest)
+        if progress is None:
+            progress = self.dests[dest] = DestProgress(dest)
+        name = event.get("event")
+        ts = event.get("ts", time.time())
+
+        if name == "run_start":
+            progress.__init__(dest)
+            progress.source = event.get("source") or ""
+            progress.engine = event.get("engine", "")
+            progress.running = True
+            progress._sample(ts)
+        elif name == "file_start":
+            progress.current = event.get("path")
+            progress.current_bytes = 0
+        elif name == "progress":
+            progress.current = event.get("path")
+            progress.current_bytes = event.get("bytes", 0)
+            progress._sample(ts)
+        elif name == "file_done":
+            progress.files_done = event.get("files_done", progress.files_done + 1)
+            progress.files_total = event.get("files_total", progress.files_total)
+            progress.bytes_done += event.get("size", 0)
+            progress.current = None
+            progress.current_bytes = 0
+            if event.get("eta") is not None:
+                progress.eta, progress.eta_ts = event["eta"], ts
+            progress._sample(ts)
+            self.history.append((ts, dest, event.get("path"), event.get("size", 0), event.get("rate", 0)))
+        elif name == "run_end":
+            progress.running = False
+            progress.current = None
+            progress.returncode = event.get("returncode")
+
+    def drain(self, events, limit=MAX_EVENTS_PER_TICK):
+        """
+        Handles the events waiting on a queue without blocking.
+
+        Returns:
+            int: Number of events handled, limit if more are waiting.
+        """
+        handled = 0
+        try:
+            while handled < limit:
+                self.handle(events.get_nowait())
+                handled += 1
+        except queue.Empty:
+            pass
+        self._trim()
+        return handled
+
+    def _trim(self):
+        """ Drops the oldest tenth of the history once it is over max_history. """
+        if len(self.history) > self.max_history:
+            count = len(self.history) - self.max_history + self.max_history // 10
+            del self.history[:count]
+            self.dropped += count
+
+
+class VirtualList(ttk.Frame):
+    """
+    Scrollable list that only draws the rows in view.
+    The rows are a list owned by the caller, which calls refresh() after changing it.
+    Scrolled to the end it follows new rows.
+    """
+
+    def __init__(self, parent, rows, format_row, row_height=18, font="TkFixedFont"):
+        super().__init__(parent)
+        self.rows = rows
+        self.format_row = format_row
+        self.row_height = row_height
+        self.font = font
+        self.top = 0
+        self.follow = True
+        self._items = []
+
+        self.canvas = tk.Canvas(self, highlightthickness=0, background="white")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        self.canvas.bind("<Configure>", self._resize)
+        for widget in (self.canvas, self):
+            widget.bind("<MouseWheel>", lambda event: self.scroll_to(self.top - event.delta // 40))
+            widget.bind("<Button-4>", lambda event: self.scroll_to(self.top - 3))
+            widget.bind("<Button-5>", lambda event: self.scroll_to(self.top + 3))
+
+    def visible(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def _resize(self, event):
+        count = self.visible() + 1
+        while len(self._items) < count:
+            y = len(self._items) * self.row_height + 2
+            self._items.append(self.canvas.create_text(4, y, anchor="nw", font=self.font))
+        while len(self._items) > count:
+            self.canvas.delete(self._items.pop())
+        self.refresh()
+
+    def yview(self, *args):
+        """ Scrollbar command. """
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.rows)))
+        elif args[0] == "scroll":
+            step = self.visible() if args[2] == "pages" else 1
+            self.scroll_to(self.top + int(args[1]) * step)
+
+    def scroll_to(self, top):
+        last = max(0, len(self.rows) - self.visible())
+        self.top = max(0, min(int(top), last))
+        self.follow = self.top >= last
+        self.refresh()
+
+    def dropped(self, count):
+        """ Keeps the view on the same rows after count rows were removed from the front. """
+        self.top = max(0, self.top - count)
+
+    def refresh(self):
+        n = len(self.rows)
+        visible = self.visible()
+        if self.follow:
+            self.top = max(0, n - visible)
+        for i, item in enumerate(self._items):
+            index = self.top + i
+            self.canvas.itemconfigure(item, text=self.format_row(self.rows[index]) if index < n else "")
+        if n == 0:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.top / n, min(1.0, (self.top + visible) / n))
+
+
+class Dashboard(tk.Toplevel):
+    """
+    Window with live per destination progress and the files copied.
+    """
+
+    COLUMNS = (("dest", "Destination", 200), ("files", "Files", 90), ("rate", "Throughput", 90),
+               ("eta", "ETA", 70), ("current", "Current file", 220))
+
+    def __init__(self, parent, progress, status=None):
+        """
+        Initializes the Dashboard.
+
+        Args:
+            parent (tk.Misc): Parent window.
+            progress (SyncProgress): Progress to show, kept up to date by the caller.
+            status (callable, optional): Returns a line of status text shown above the progress.
+        """
+        super().__init__(parent)
+        self.progress = progress
+        self.status = status
+        self._dropped = progress.dropped
+        self._poll_id = None
+
+        self.title("Backup Progress")
+        self.geometry("720x480")
+
+        frame = ttk.Frame(self, padding=10)
+        frame.pack(fill="both", expand=True)
+
+        self.status_label = ttk.Label(frame, text="")
+        self.status_label.pack(anchor="w")
+
+        self.dest_view = ttk.Treeview(frame, columns=[c[0] for c in self.COLUMNS], show="headings", height=4)
+        for column, heading, width in self.COLUMNS:
+            self.dest_view.heading(column, text=heading)
+            self.dest_view.column(column, width=width, stretch=column in ("dest", "current"))
+        self.dest_view.pack(fill="x", pady=(5, 10))
+
+        self.history_label = ttk.Label(frame, text="Files copied:")
+        self.history_label.pack(anchor="w")
+        self.history = VirtualList(frame, self.progress.history, self._format_row)
+        self.history.pack(fill="both", expand=True)
+
+        self.bind("<Destroy>", self._destroyed)
+        self._poll()
+
+    @staticmethod
+    def _format_row(row):
+        ts, dest, path, size, rate = row
+        return (f"{datetime.fromtimestamp(ts):%H:%M:%S}  {format_bytes(size):>9}  {format_bytes(rate):>9}/s  "
+                f"{os.path.basename(dest.rstrip('/'))}/{path}")
+
+    def _poll(self):
+        self.redraw()
+        self._poll_id = self.after(POLL_MS, self._poll)
+
+    def redraw(self):
+        now = time.time()
+        if self.progress.dropped != self._dropped:
+            self.history.dropped(self.progress.dropped - self._dropped)
+            self._dropped = self.progress.dropped
+        for dest, p in self.progress.dests.items():
+            if not dest:
+                continue
+            files = f"{p.files_done}/{p.files_total}" if p.files_total else str(p.files_done)
+            if p.running:
+                values = (dest, files, f"{format_bytes(p.throughput(now))}/s", format_seconds(p.remaining(now)),
+                          p.current or "")
+            else:
+                values = (dest, files, "-", "-", "done" if p.returncode == 0 else f"failed ({p.returncode})"
+                          if p.returncode is not None else "")
+            if self.dest_view.exists(dest):
+                self.dest_view.item(dest, values=values)
+            else:
+                self.dest_view.insert("", "end", iid=dest, values=values)
+        self.history_label.config(text=f"Files copied: {len(self.progress.history) + self.progress.dropped}")
+        self.history.refresh()
+        if self.status is not None:
+            self.status_label.config(text=self.status())
+
+    def _destroyed(self, event):
+        if event.widget is self and self._poll_id is not None:
+            self.after_cancel(self._poll_id)
+            self._poll_id = None
@@ -0,0 +1,233 @@
+import os
+import shutil
+import subprocess
+import sys
+from datetime import datetime
+
+from exclude_matcher import get_matcher
+from native_sync import NativeSync
+
+"""
+Deletes ingested files from a source ("delete_copied": true on a source).
+
+After an ingest the source is listed with the backup's exclude rules, so an
+excluded file (grandfather.jpg) is never even a candidate. Each file is looked
+up in the local index by path and size, or by name and size in the dated
+layout, and is only deleted when:
+
+    - its local copy hashes the same as the file on the source (files the
+      ingest just verified are not hashed again), and
+    - with "delete_min_backups": N on the source, the index records a copy of
+      the file on at least N of the configured backup drives (its replicas,
+      verified there after the sync unless "verify" is off). A replica stops
+      counting when the local file is rewritten.
+
+Deletions are batched per directory: gvfs (MTP/PTP) sources get one
+`gio remove` per directory and batch of files instead of one call per file,
+other sources are unlinked directly. Sources only report what would be
+deleted until "delete_dry_run": false is set on them. From a shell, a dry run unless --delete is given:
+
+    python delete_copied.py <source volume or description> [--delete]
+"""
+
+GIO_BATCH = 200
+
+
+class DeletePlan:
+    """
+    What a SourceCleaner would delete from a source, and what it keeps and why.
+    """
+
+    def __init__(self, source_root, local_root):
+        self.source_root = source_root
+        self.local_root = local_root
+        self.delete = []       # (local path, source path) confirmed copies
+        self.missing = []      # source paths with no copy of the same size in the archive
+        self.unbacked = []     # (source path, number of backup drives) below delete_min_backups
+        self.mismatched = []   # (source path, error) whose copy does not hash the same
+        self.excluded = 0
+        self.bytes = 0
+
+    def report(self, out, verbose=True):
+        """ Writes the plan to a file-like object. """
+        out.write(f"{len(self.delete)} files ({self.bytes / 1e6:.1f} MB) confirmed copied, "
+                  f"{len(self.missing)} not in the archive, {len(self.unbacked)} not on enough backup drives, "
+                  f"{len(self.mismatched)} did not match, {self.excluded} excluded.\n")
+        if not verbose:
+            return
+        for _, source_rel in self.delete:
+            out.write(f"  delete {source_rel}\n")
+        for source_rel in self.missing:
+            out.write(f"  keep   {source_rel}: not in the archive\n")
+        for source_rel, drives in self.unbacked:
+            out.write(f"  keep   {source_rel}: on {drives} backup drives\n")
+        for source_rel, error in self.mismatched:
+            out.write(f"  keep   {source_rel}: {error}\n")
+
+
+def _is_gvfs(path):
+    return "/gvfs/" in os.path.abspath(path)
+
+
+def delete_files(root, rel_paths, use_gio=None):
+    """
+    Deletes files under root, one batch per directory.
+
+    Args:
+        root (str): Directory the paths are relative to.
+        rel_paths (iterable): Files to delete.
+        use_gio (bool, optional): Remove through `gio remove`, by default when root is a gvfs mount.
+
+    Returns:
+        tuple: (list of deleted paths, list of (path, error))
+    """
+    if use_gio is None:
+        use_gio = _is_gvfs(root) and shutil.which("gio") is not None
+    by_dir = {}
+    for rel_path in rel_paths:
+        by_dir.setdefault(os.path.dirname(rel_path), []).append(rel_path)
+
+    deleted = []
+    errors = []
+    for rel_dir in sorted(by_dir):
+        batch = by_dir[rel_dir]
+        if not use_gio:
+            for rel_path in batch:
+                try:
+                    os.remove(os.path.join(root, rel_path))
+                    deleted.append(rel_path)
+                except OSError as e:
+                    errors.append((rel_path, str(e)))
+            continue
+        for start in range(0, len(batch), GIO_BATCH):
+            chunk = batch[start:start + GIO_BATCH]
+            result = subprocess.run(["gio", "remove", "--", *(os.path.join(root, p) for p in chunk)],
+                                    capture_output=True, text=True)
+            # gio carries on past a file it can not remove, check which are gone
+            for rel_path in chunk:
+                if os.path.lexists(os.path.join(root, rel_path)):
+                    errors.append((rel_path, result.stderr.strip() or f"gio exited with {result.returncode}"))
+                else:
+                    deleted.append(rel_path)
+    return deleted, errors
+
+
+class SourceCleaner:
+    """
+    Plans and makes the deletion of files from a source that are safely in the archive.
+    """
+
+    def __init__(self, index, verifier, min_backups=0, backup_volumes=()):
+        """
+        Initializes the SourceCleaner.
+
+        Args:
+            index (MediaIndex): Index of the local archive.
+            verifier (Verifier): Hashes local copies against the source.
+            min_backups (int): Backup drives that must hold a copy before its source is deleted.
+            backup_volumes (iterable): Volumes of the configured backup drives.
+        """
+        self.index = index
+        self.verifier = verifier
+        self.min_backups = min_backups
+        self.backup_volumes = list(backup_volumes)
+
+    def plan(self, source_root, matcher=None, verified=(), cancel=None):
+        """
+        Finds the files on a source that can be deleted.
+
+        Args:
+            source_root (str): Directory on the source that is ingested.
+            matcher (ExcludeMatcher, optional): The source's exclude rules, excluded files are kept.
+            verified (iterable): Source paths the ingest just hashed against their local copy.
+            cancel (threading.Event, optional): Stops hashing when set.
+
+        Returns:
+            DeletePlan
+
+        Raises:
+            SyncCancelled: If cancel was set.
+        """
+        plan = DeletePlan(source_root, self.index.root)
+        source_files, plan.excluded = NativeSync.scan_source(source_root, matcher or get_matcher())
+
+        archived = dict(self.index.files())
+        by_name = {(os.path.basename(path), size): path for path, size in archived.items()}
+        volumes = set(self.backup_volumes)
+        verified = set(verified)
+
+        to_hash = []
+        for source_rel in sorted(source_files):
+            size = source_files[source_rel]
+            local_rel = source_rel if archived.get(source_rel) == size else \
+                by_name.get((os.path.basename(source_rel), size))
+            if local_rel is None:
+                plan.missing.append(source_rel)
+                continue
+            if self.min_backups:
+                drives = len(self.index.replicas(local_rel) & volumes)
+                if drives < self.min_backups:
+                    plan.unbacked.append((source_rel, drives))
+                    continue
+            (plan.delete if source_rel in verified else to_hash).append((local_rel, source_rel))
+            plan.bytes += size
+
+        if to_hash:
+            _, bad = self.verifier.verify(self.index.root, source_root, to_hash, cancel)
+            bad = {pair: error for pair, error in bad}
+            for pair in to_hash:
+                if pair in bad:
+                    plan.mismatched.append((pair[1], bad[pair]))
+                    plan.bytes -= source_files[pair[1]]
+                else:
+                    plan.delete.append(pair)
+        plan.delete.sort(key=lambda pair: pair[1])
+        return plan
+
+    def run(self, plan, matcher=None, dry_run=False):
+        """
+        Deletes the files of a plan from the source.
+
+        Returns:
+            tuple: (list of deleted source paths, list of (path, error)), nothing deleted on a dry run.
+        """
+        rel_paths = [source_rel for _, source_rel in plan.delete
+                     if matcher is None or not matcher.excluded(source_rel)]
+        if dry_run:
+            return [], []
+        return delete_files(plan.source_root, rel_paths)
+
+
+# Example Usage:
+#   python delete_copied.py <source volume or description> [--delete]
+if __name__ == "__main__":
+    from backup_config import load_config
+    from exclude_matcher import entry_rules, rules_file
+    from media_index import MediaIndex
+    from verify import Verifier
+
+    config = load_config("config.json")
+    source = next((s for s in config.sources if sys.argv[1] in (s.volume, s.descr)), None)
+    if source is None:
+        print(f"No source '{sys.argv[1]}' in config.json.")
+        sys.exit(1)
+
+    local_root = os.path.join(config.local_backup_dir, config.backup_subdir)
+    index = MediaIndex(config.index_db or os.path.join(config.local_backup_dir, "media_index.db"), local_root)
+    exclude_file = rules_file(config.exclude, entry_rules(source, config.exclude_rules),
+                              os.path.join(config.local_backup_dir, ".exclude_rules"))
+    matcher = get_matcher(exclude_file)
+    cleaner = SourceCleaner(index, Verifier(index, workers=config.verify_workers), source.delete_min_backups,
+                            [b.volume for b in config.backups])
+    try:
+        plan = cleaner.plan(os.path.join(source.volume, source.directory), matcher)
+        plan.report(sys.stdout)
+        if "--delete" in sys.argv:
+            deleted, errors = cleaner.run(plan, matcher)
+            print(f"{datetime.now():%m-%d-%Y %H:%M} deleted {len(deleted)} files, {len(errors)} errors.")
+            for rel_path, error in errors:
+                print(f"  {rel_path}: {error}")
+        else:
+            print("Dry run, nothing deleted. Add --delete to delete.")
+    finally:
+        index.close()
@@ -1,8 +1,20 @@
+import asyncio
+import codecs
+import signal
 import subprocess
 import os
+import re
+import shutil
+import tempfile
 from datetime import datetime
 from typing import Optional
 
+from sync_log import open_log
+from sync_metrics import RsyncProgressParser
+
+# seconds a cancelled script gets to exit before it is killed
+TERMINATE_TIMEOUT = 5
+
 ''' 
   Google Search Prompt:
     generate a python class to execute a bash script named dir_sync.sh 
@@ -17,12 +29,15 @@ class DirSync:
     This class uses Python's subprocess module to run a bash script to
     synchronize directories, with specified source, destination, and exclude file arguments.
     """
-    def __init__(self, script_path=None, log_file="rsync_log.txt"):
+    def __init__(self, script_path=None, log_file="rsync_log.txt", events=None):
         """
         Initializes the DirSync instance.
         
         Args:
             script_path (str): The full path to the dir_sync.sh script.
+            log_file (str or SyncLog): Where the rsync output is logged.
+            events (callable, optional): Called with structured progress events parsed
+                from the rsync output as it runs (see sync_metrics.py).
         """
         if script_path is None:
             script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -33,8 +48,11 @@ class DirSync:
         
         self.script_path = script_path
         self.log_file = log_file
+        self.events = events
         
-    def run_sync(self, source_dir: str, dest_dir: str, exclude_file: Optional[str] = None):
+    def run_sync(self, source_dir: str, dest_dir: str, exclude_file: Optional[str] = None,
+                 files: Optional[list] = None, priority: Optional[tuple] = None,
+                 options: Optional[list] = None):
         """
         Executes the dir_sync.sh script with the specified arguments.
         
@@ -43,6 +61,12 @@ class DirSync:
             dest_dir (str): The destination directory for the sync.
             exclude_file (Optional[str]): The name of the file containing exclude statements.
                 If None, the exclude file argument is omitted.
+            files (Optional[list]): Paths relative to source_dir to copy. If given, only these
+                files are considered (rsync --files-from) instead of listing the whole source.
+            priority (Optional[tuple]): (ioprio class, level) the script runs at through ionice,
+                if ionice is installed (see throttle.py).
+            options (Optional[list]): rsync options replacing --size-only, from the
+                destination's filesystem profile (see fs_profile.py).
         
         Returns:
             subprocess.CompletedProcess: The result of the completed process.
@@ -50,50 +74,185 @@ class DirSync:
         Raises:
             subprocess.CalledProcessError: If the script returns a non-zero exit code.
         """
+        command, files_from = self._command(source_dir, dest_dir, exclude_file, files, priority)
+        start_dt = datetime.now()
+        try:
+            with open_log(self.log_file, source_dir, dest_dir) as log:
+                self._log_start(log, start_dt, source_dir, dest_dir)
+                returncode = self._run(command, log, source_dir, dest_dir, self._env(options))
+                return self._finish(command, returncode, log, start_dt)
+        except (FileNotFoundError, subprocess.CalledProcessError) as e:
+            self._report(e)
+            raise
+        finally:
+            if files_from:
+                os.remove(files_from)
+
+    async def run_sync_async(self, source_dir: str, dest_dir: str, exclude_file: Optional[str] = None,
+                             files: Optional[list] = None, priority: Optional[tuple] = None,
+                             options: Optional[list] = None):
+        """
+        run_sync() for an asyncio task. The script runs with asyncio.create_subprocess_exec,
+        so the event loop is free while it copies, and it is terminated (with rsync)
+        as soon as the task is cancelled.
+        """
+        command, files_from = self._command(source_dir, dest_dir, exclude_file, files, priority)
+        start_dt = datetime.now()
+        try:
+            with open_log(self.log_file, source_dir, dest_dir) as log:
+                self._log_start(log, start_dt, source_dir, dest_dir)
+                returncode = await self._run_async(command, log, source_dir, dest_dir, self._env(options))
+                return self._finish(command, returncode, log, start_dt)
+        except (FileNotFoundError, subprocess.CalledProcessError) as e:
+            self._report(e)
+            raise
+        finally:
+            if files_from:
+                os.remove(files_from)
+
+    def _command(self, source_dir, dest_dir, exclude_file, files, priority=None):
+        """ Returns the script command and the --files-from list written for it (or None). """
         # Construct the command as a list of strings for security
         # This prevents shell injection vulnerabilities.
         command = [self.script_path, source_dir, dest_dir]
+        if priority is not None and shutil.which("ionice"):
+            io_class, level = priority
+            command = ["ionice", "-c", str(io_class), "-n", str(level)] + command
 
         if exclude_file:
             command.append(exclude_file)
 
+        files_from = None
+        if files is not None:
+            if not exclude_file:
+                raise ValueError("dir_sync.sh needs an exclude file when a list of files is given")
+            with tempfile.NamedTemporaryFile('w', prefix="dir_sync_", suffix=".txt", delete=False) as f:
+                f.writelines(f"{rel_path}\n" for rel_path in files)
+                files_from = f.name
+            command.append(files_from)
+
         # print(command)
         # print(f"Executing command: {' '.join(command)}.")
         # print(f"--Check log file at {self.log_file} for details.")
+        return command, files_from
 
-        start_dt = datetime.now()
-        with open(self.log_file, 'a') as log:
-            log.write(f"\n-------- {start_dt:%m-%d-%Y %H:%M} {'-'*40}\n")
-            log.write(f"from {source_dir}\n")
-            log.write(f"  to {dest_dir}\n\n")
+    @staticmethod
+    def _env(options):
+        """ Environment of the script, passing rsync options one per line. """
+        if options is None:
+            return None
+        return dict(os.environ, DIR_SYNC_OPTIONS="\n".join(options))
 
-        try:
-            with open(self.log_file, 'a') as log:
-
-                result = subprocess.run(
-                    command,
-                    capture_output=False,
-                    stdout=log,
-                    stderr=log,
-                    text=True,
-                    check=True
-                )
-                end_dt = datetime.now()
-                diff = end_dt - start_dt
-                min = int(diff.total_seconds() // 60)
-                sec = int(diff.total_seconds() % 60)
-
-                log.write(f"-------- elapsed: {min} min, {sec} sec {'-'*40}\n")
-                return result
-        except FileNotFoundError:
+    def _log_start(self, log, start_dt, source_dir, dest_dir):
+        log.write(f"\n-------- {start_dt:%m-%d-%Y %H:%M} {'-'*40}\n")
+        log.write(f"from {source_dir}\n")
+        log.write(f"  to {dest_dir}\n\n")
+
+    def _finish(self, command, returncode, log, start_dt):
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+        end_dt = datetime.now()
+        diff = end_dt - start_dt
+        min = int(diff.total_seconds() // 60)
+        sec = int(diff.total_seconds() % 60)
+
+        log.write(f"-------- elapsed: {min} min, {sec} sec {'-'*40}\n")
+        return subprocess.CompletedProcess(command, returncode)
+
+    def _report(self, e):
+        if isinstance(e, FileNotFoundError):
             print("Error: The script or one of the directories was not found.")
-            raise
-        except subprocess.CalledProcessError as e:
+        else:
             print("Error: Script execution failed.")
             print(f"Return code: {e.returncode}")
             print(f"rsync command failed with error: {e}")
             print(f"Error output can be found in {self.log_file}")
+
+    def _run(self, command, log, source_dir, dest_dir, env=None):
+        """
+        Runs the script, copying its output to the log as it arrives.
+
+        Returns:
+            int: The script's return code.
+        """
+        output = _Output(self, log, source_dir, dest_dir)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0, env=env)
+        try:
+            while True:
+                chunk = process.stdout.read(65536)
+                if not chunk:
+                    break
+                output.feed(chunk)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+            output.finish(returncode)
+        return returncode
+
+    async def _run_async(self, command, log, source_dir, dest_dir, env=None):
+        """
+        _run() on the event loop. The script gets its own process group so
+        that cancelling stops rsync too, not just the shell running it.
+        """
+        output = _Output(self, log, source_dir, dest_dir)
+        process = await asyncio.create_subprocess_exec(*command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                                       start_new_session=True, env=env)
+        returncode = None
+        try:
+            while True:
+                chunk = await process.stdout.read(65536)
+                if not chunk:
+                    break
+                output.feed(chunk)
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            log.write("\n-------- cancelled\n")
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            try:
+                await asyncio.wait_for(process.wait(), TERMINATE_TIMEOUT)
+            except asyncio.TimeoutError:
+                os.killpg(process.pid, signal.SIGKILL)
+                await process.wait()
+            returncode = process.returncode
             raise
+        finally:
+            output.finish(returncode if returncode is not None else -1)
+        return returncode
+
+
+class _Output:
+    """
+    Copies script output to the log and, if DirSync has an events callback,
+    feeds each line (rsync ends progress updates with \\r) to an RsyncProgressParser.
+    """
+
+    def __init__(self, dir_sync, log, source_dir, dest_dir):
+        self.log = log
+        self.parser = None
+        if dir_sync.events is not None:
+            self.parser = RsyncProgressParser(source_dir, dest_dir, dir_sync.events)
+            self.parser.start()
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.pending = b""
+        log.flush()
+
+    def feed(self, chunk):
+        self.log.write(self.decoder.decode(chunk))
+        self.log.flush()
+        if self.parser is not None:
+            *lines, self.pending = re.split(rb"[\r\n]", self.pending + chunk)
+            for line in lines:
+                self.parser.feed(line.decode(errors="replace"))
+
+    def finish(self, returncode):
+        self.log.write(self.decoder.decode(b"", final=True))
+        if self.parser is not None:
+            if self.pending:
+                self.parser.feed(self.pending.decode(errors="replace"))
+            self.parser.finish(returncode)
 
 # --- Example Usage ---
 
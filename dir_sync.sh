@@ -2,13 +2,14 @@
 
 # Check if both source and destination directories are provided as arguments
 if [ -z "$1" ] || [ -z "$2" ] || [ -z "$3" ]; then
-  echo "Usage: $0 <source_directory> <destination_directory> <exclude_file>"
+  echo "Usage: $0 <source_directory> <destination_directory> <exclude_file> [files_from]"
   exit 1
 fi
 
 SOURCE_DIR="$1"
 DEST_DIR="$2"
 EXCLUDE_FILE="$3"
+FILES_FROM="$4"
 
 # Check if source directory exists
 if [ ! -d "$SOURCE_DIR" ]; then
@@ -38,6 +39,24 @@ fi
 # --exclude-from= specify file with patterns to exclude
 # --dry-run: (optional) for testing, remove to perform actual copy
 # --no-perms: do not preserve permissions - caused problems with iOS and possibly others
+# --files-from= (optional 4th argument) only copy the listed files, skips listing the whole source
+# DIR_SYNC_OPTIONS: (optional environment variable) rsync options of the destination's
+#   filesystem profile, one per line, used instead of --size-only (see fs_profile.py)
 #rsync -auv --progress "$SOURCE_DIR"/ "$DEST_DIR"
-rsync -ahv --size-only --no-perms --progress --exclude-from="$EXCLUDE_FILE" "$SOURCE_DIR"/ "$DEST_DIR"
+OPTIONS=(--size-only)
+if [ -n "${DIR_SYNC_OPTIONS+set}" ]; then
+  OPTIONS=()
+  while IFS= read -r OPTION; do
+    [ -n "$OPTION" ] && OPTIONS+=("$OPTION")
+  done <<< "$DIR_SYNC_OPTIONS"
+fi
+if [ -n "$FILES_FROM" ]; then
+  if [ ! -f "$FILES_FROM" ]; then
+    echo "Error: Files from list '$FILES_FROM' not found."
+    exit 1
+  fi
+  rsync -ahv "${OPTIONS[@]}" --no-perms --progress --exclude-from="$EXCLUDE_FILE" --files-from="$FILES_FROM" "$SOURCE_DIR"/ "$DEST_DIR"
+else
+  rsync -ahv "${OPTIONS[@]}" --no-perms --progress --exclude-from="$EXCLUDE_FILE" "$SOURCE_DIR"/ "$DEST_DIR"
+fi
 # echo "New or updated files copied from '$SOURCE_DIR' to '$DEST_DIR'."
\ No newline at end of file
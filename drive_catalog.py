@@ -0,0 +1,175 @@
+import gzip
+import json
+import os
+import time
+
+"""
+Catalog of what a backup drive holds, kept at the root of the drive.
+
+Written atomically at the end of each successful sync. It records the size of
+every file in the backup directory and the mtime of every directory under it.
+While those directory mtimes are unchanged the catalog is trusted, so only the
+delta between the local index and the catalog has to be copied, without listing
+the whole tree on a slow USB hard drive.
+
+A time or byte limited session on a drive without a current catalog adds what
+it copied to the catalog instead of walking the drive, and saves it marked
+stale: it is not trusted until a full sync rebuilds it.
+"""
+
+CATALOG_NAME = ".backup_pics_catalog.json.gz"
+CATALOG_VERSION = 1
+
+
+class DriveCatalog:
+    """
+    Reads and writes the catalog file at the root of a backup volume.
+    """
+
+    def __init__(self, volume, backup_dir):
+        """
+        Initializes the DriveCatalog.
+
+        Args:
+            volume (str): Mount point of the backup volume.
+            backup_dir (str): Directory on the volume the catalog describes.
+        """
+        self.volume = volume
+        self.backup_dir = backup_dir
+        self.path = os.path.join(volume, CATALOG_NAME)
+        self.generation = 0
+        self.stale = False  # saved by a session that did not list the drive
+        self.files = {}     # path relative to backup_dir -> size
+        self.dirs = {}      # path relative to backup_dir -> mtime_ns
+
+    def _rel_backup_dir(self):
+        return os.path.relpath(self.backup_dir, self.volume)
+
+    def load(self):
+        """
+        Loads the catalog and checks it is still current.
+
+        Returns:
+            bool: True if the catalog can be trusted, False if it is missing or stale.
+        """
+        try:
+            with gzip.open(self.path, 'rt') as f:
+                catalog = json.load(f)
+        except (OSError, ValueError, EOFError):
+            return False
+
+        if catalog.get("version") != CATALOG_VERSION or catalog.get("backup_dir") != self._rel_backup_dir():
+            return False
+
+        self.generation = catalog.get("generation", 0)
+        self.stale = catalog.get("stale", False)
+        self.files = catalog.get("files", {})
+        self.dirs = catalog.get("dirs", {})
+        if self.stale:
+            print(f"Catalog on '{self.volume}' is stale: the last sync did not list the drive.")
+            return False
+
+        # any file added, removed or renamed outside of a sync changes a directory mtime
+        for rel_dir, mtime_ns in self.dirs.items():
+            try:
+                if os.stat(os.path.join(self.backup_dir, rel_dir)).st_mtime_ns != mtime_ns:
+                    print(f"Catalog on '{self.volume}' is stale: '{rel_dir or '.'}' changed.")
+                    return False
+            except OSError:
+                return False
+        return bool(self.dirs)
+
+    def rebuild(self):
+        """ Walks the whole backup directory to rebuild the catalog. """
+        self.stale = False
+        self.files = {}
+        self.dirs = {}
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            prefix = f"{rel_dir}/" if rel_dir else ""
+            path = os.path.join(self.backup_dir, rel_dir)
+            self.dirs[rel_dir] = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(prefix + entry.name)
+                    elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(".partial"):
+                        self.files[prefix + entry.name] = entry.stat(follow_symlinks=False).st_size
+
+    def delta(self, local_files, matcher=None):
+        """
+        Args:
+            local_files (iterable): (path, size) of files in the local backup.
+            matcher (ExcludeMatcher, optional): Files it excludes are never copied, so are left out.
+
+        Returns:
+            list: (path, size) of local files missing from the drive or with a different size.
+        """
+        files = self.files
+        if matcher:
+            excluded = matcher.excluded
+            return [(rel_path, size) for rel_path, size in local_files
+                    if files.get(rel_path) != size and not excluded(rel_path)]
+        return [(rel_path, size) for rel_path, size in local_files if files.get(rel_path) != size]
+
+    def update(self, rel_paths):
+        """
+        Records files just copied to the drive, stat'ing only those files
+        and their directories.
+        """
+        touched = set()
+        for rel_path in rel_paths:
+            try:
+                self.files[rel_path] = os.stat(os.path.join(self.backup_dir, rel_path)).st_size
+            except OSError:
+                self.files.pop(rel_path, None)
+            # include new parent directories
+            rel_dir = os.path.dirname(rel_path)
+            while True:
+                touched.add(rel_dir)
+                if not rel_dir or rel_dir in self.dirs:
+                    break
+                rel_dir = os.path.dirname(rel_dir)
+
+        for rel_dir in touched:
+            try:
+                self.dirs[rel_dir] = os.stat(os.path.join(self.backup_dir, rel_dir)).st_mtime_ns
+            except OSError:
+                self.dirs.pop(rel_dir, None)
+
+    def save(self):
+        """ Atomically writes the catalog to the root of the volume. """
+        self.generation += 1
+        catalog = {
+            "version": CATALOG_VERSION,
+            "generation": self.generation,
+            "written_at": time.time(),
+            "backup_dir": self._rel_backup_dir(),
+            "stale": self.stale,
+            "dirs": self.dirs,
+            "files": self.files,
+        }
+        tmp = self.path + ".tmp"
+        with gzip.open(tmp, 'wt', compresslevel=6) as f:
+            json.dump(catalog, f, separators=(",", ":"))
+        with open(tmp, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+# Example Usage:
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} <volume> <backup_directory>")
+        sys.exit(1)
+
+    catalog = DriveCatalog(sys.argv[1], sys.argv[2])
+    if catalog.load():
+        print(f"Catalog generation {catalog.generation} is current: {len(catalog.files)} files")
+    else:
+        start = time.time()
+        catalog.rebuild()
+        catalog.save()
+        print(f"Catalog rebuilt in {time.time() - start:.1f} sec: {len(catalog.files)} files")
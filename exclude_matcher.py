@@ -0,0 +1,266 @@
+import functools
+import hashlib
+import os
+import re
+import threading
+
+"""
+Compiled exclude / include rules.
+
+Rules use rsync filter syntax, as in sync_exclude.txt:
+
+    P5190001.JPG     exclude a name anywhere (plain lines are excludes)
+    - *.AAE          exclude, explicit
+    + keep.AAE       include, wins over later excludes (first matching rule decides)
+    /DCIM/tmp/       a leading "/" anchors at the sync root, a trailing "/" only matches directories
+    a/b/*.jpg        a pattern with a "/" matches the end of the path, "*" stops at "/", "**" does not
+
+As with rsync, everything below an excluded directory is excluded: excluded()
+checks each parent directory of a path (cached per directory) before the path
+itself. Walkers that already prune excluded directories pass parents=False.
+
+An ExcludeMatcher turns a rule list into a set of literal names plus combined
+regexes for the globs (one for name globs, one for path globs), so checking a
+path is a dict lookup and at most two regex matches regardless of the number
+of rules. get_matcher() caches the compiled matcher for an exclude file by its
+mtime and size.
+
+Per source / backup rules come from config.json: a global "exclude_rules"
+list and "exclude" / "include" lists on each source or backup entry.
+rules_file() merges them with the global exclude file into one content
+addressed rules file, which every engine (rsync included) is given as its
+exclude file.
+"""
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _glob_to_regex(pattern):
+    """ Translates an rsync glob to a regex: "*" and "?" do not match "/", "**" does. """
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern[i:i + 2] == "**":
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body.replace(chr(92), chr(92) * 2)}]")
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def parse_rule(line):
+    """
+    Parses one rule line.
+
+    Returns:
+        tuple: (include, pattern) or None for blank lines and comments.
+    """
+    line = line.strip()
+    if not line or line.startswith(("#", ";")):
+        return None
+    if line.startswith(("+ ", "- ")):
+        return line[0] == "+", line[2:].strip()
+    return False, line
+
+
+def read_rules(exclude_file):
+    """ Returns the rule lines of an exclude file, comments and blank lines dropped. """
+    rules = []
+    if exclude_file:
+        with open(exclude_file, 'r') as f:
+            for line in f:
+                if parse_rule(line) is not None:
+                    rules.append(line.strip())
+    return rules
+
+
+class ExcludeMatcher:
+    """
+    A compiled list of rsync style include / exclude rules.
+    """
+
+    def __init__(self, rules=()):
+        """
+        Compiles the rules.
+
+        Args:
+            rules (iterable): Rule lines, see the module doc.
+        """
+        self.rules = []
+        for line in rules:
+            rule = parse_rule(line)
+            if rule is not None:
+                self.rules.append(rule)
+        self._has_includes = any(include for include, _ in self.rules)
+        self._file = self._compile(dirs=False)
+        self._dir = self._compile(dirs=True)
+        self._dir_excluded = functools.lru_cache(maxsize=4096)(self._check_dir)
+
+    def _compile(self, dirs):
+        """
+        Returns (literal name -> rule index, name regex, path regex) for files or dirs.
+        Each regex is (compiled, group number -> rule index) or None.
+        """
+        literals = {}
+        names = ([], [])
+        paths = ([], [])
+        for index, (include, pattern) in enumerate(self.rules):
+            if pattern.endswith("/"):
+                if not dirs:
+                    continue
+                pattern = pattern.rstrip("/")
+            if not pattern:
+                continue
+            if "/" not in pattern:
+                if not any(c in pattern for c in "*?["):
+                    literals.setdefault(pattern, index)
+                    continue
+                # matched against the last path component only
+                target, regex = names, _glob_to_regex(pattern)
+            elif pattern.startswith("/"):
+                target, regex = paths, _glob_to_regex(pattern[1:])
+            else:
+                target, regex = paths, "(?:.*/)?" + _glob_to_regex(pattern)
+            target[0].append(f"({regex})")
+            target[1].append(index)
+        return (literals,
+                (re.compile("|".join(names[0])), names[1]) if names[0] else None,
+                (re.compile("|".join(paths[0])), paths[1]) if paths[0] else None)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def excluded(self, rel_path, is_dir=False, parents=True):
+        """
+        Checks a path relative to the sync root.
+
+        Args:
+            rel_path (str): Path relative to the sync root.
+            is_dir (bool): The path is a directory.
+            parents (bool): Also check the parent directories, False when the
+                            caller walks the tree and prunes excluded directories.
+
+        Returns:
+            bool: True if the path or one of its parent directories is excluded.
+        """
+        if parents and self.rules:
+            rel_dir = rel_path.rpartition("/")[0]
+            if rel_dir and self._dir_excluded(rel_dir):
+                return True
+        return self._match(rel_path, is_dir)
+
+    def _check_dir(self, rel_dir):
+        parent = rel_dir.rpartition("/")[0]
+        return bool(parent and self._dir_excluded(parent)) or self._match(rel_dir, True)
+
+    def _match(self, rel_path, is_dir):
+        """ Returns True if the first rule matching the path itself is an exclude. """
+        literals, name_re, path_re = self._dir if is_dir else self._file
+        name = rel_path.rpartition("/")[2]
+        literal = literals.get(name)
+        if not self._has_includes:
+            return (literal is not None
+                    or (name_re is not None and name_re[0].fullmatch(name) is not None)
+                    or (path_re is not None and path_re[0].fullmatch(rel_path) is not None))
+
+        first = literal
+        for regex, text in ((name_re, name), (path_re, rel_path)):
+            if regex is not None:
+                m = regex[0].fullmatch(text)
+                if m is not None:
+                    index = regex[1][m.lastindex - 1]
+                    if first is None or index < first:
+                        first = index
+        return first is not None and not self.rules[first][0]
+
+    def filter(self, rel_paths, is_dir=False, parents=True):
+        """ Returns the paths that are not excluded, in one pass. """
+        excluded = self.excluded
+        return [rel_path for rel_path in rel_paths if not excluded(rel_path, is_dir, parents)]
+
+
+def get_matcher(exclude_file=None, extra_rules=()):
+    """
+    Returns the compiled matcher for an exclude file plus extra rules. Matchers
+    are cached and only recompiled when the file's mtime or size changes.
+
+    Args:
+        exclude_file (str, optional): rsync style exclude file.
+        extra_rules (iterable): Rule lines checked before the file's rules.
+    """
+    extra_rules = tuple(extra_rules)
+    stamp = None
+    if exclude_file:
+        st = os.stat(exclude_file)
+        stamp = (st.st_mtime_ns, st.st_size)
+    key = (exclude_file, extra_rules)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+    matcher = ExcludeMatcher(list(extra_rules) + read_rules(exclude_file))
+    with _cache_lock:
+        _cache[key] = (stamp, matcher)
+    return matcher
+
+
+def entry_rules(entry, global_rules=()):
+    """
+    Returns the extra rules for a source or backup entry from config.json:
+    its "include" list, its "exclude" list, then the global "exclude_rules".
+    """
+    rules = [f"+ {pattern}" for pattern in entry.get("include", [])]
+    rules += [f"- {pattern}" for pattern in entry.get("exclude", [])]
+    rules += list(global_rules)
+    return rules
+
+
+def rules_file(exclude_file, extra_rules, rules_dir):
+    """
+    Returns an exclude file holding extra_rules followed by exclude_file's
+    rules, for engines (rsync) that take a file. The file is named after its
+    contents and only written when they change, so get_matcher() keeps its
+    cached matcher. Without extra rules exclude_file itself is returned.
+    """
+    if not extra_rules:
+        return exclude_file
+    lines = list(extra_rules) + read_rules(exclude_file)
+    text = "# generated from config.json and " + str(exclude_file) + "\n" + "\n".join(lines) + "\n"
+    digest = hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+    path = os.path.join(rules_dir, f"exclude_{digest}.txt")
+    if not os.path.exists(path):
+        os.makedirs(rules_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    return path
+
+# Example Usage:
+#   python exclude_matcher.py sync_exclude.txt path [path...]
+if __name__ == "__main__":
+    import sys
+
+    matcher = get_matcher(sys.argv[1])
+    for rel_path in sys.argv[2:]:
+        print(f"{'excluded' if matcher.excluded(rel_path) else 'included'}  {rel_path}")
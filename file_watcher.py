@@ -2,7 +2,6 @@ import os
 import time
 import subprocess
 
-from json_config_reader import JsonConfigReader
 
 
 """
@@ -79,18 +78,20 @@ class FileWatcher:
 # Example Usage:
 if __name__ == "__main__":
 
-    config = JsonConfigReader("config.json")
-    backup_subdir = config.get("backup_subdirectory", "yyyy-mm-dd_backup")
-    backups = config.get("backups", [])
-    sources = config.get("sources", [])
-    exclude_files = set(config.get("exclude", []))
-    local_backup_directory = os.path.expanduser(config.get("local_backup_directory", "~/Documents/pictures/MEDIA_BACKUP"))  
+    from backup_config import load_config
+
+    config = load_config("config.json")
+    backup_subdir = config.backup_subdir
+    backups = config.backups
+    sources = config.sources
+    exclude_file = config.exclude
+    local_backup_directory = os.path.expanduser(config.local_backup_dir)
 
     # Iterate through each backup destination
     for backup in sources:
-        backup_volume = backup.get("volume")
-        backup_directory = backup.get("directory")
-        backup_descr = backup.get("descr", "No description")
+        backup_volume = backup.volume
+        backup_directory = backup.directory
+        backup_descr = backup.descr
 
         print(f"Watching for {backup_descr}...")
         watcher = FileWatcher(backup_volume,backup_directory, 
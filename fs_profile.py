@@ -0,0 +1,163 @@
+import dataclasses
+import sys
+from dataclasses import dataclass
+
+from mount_monitor import fs_type, read_mounts
+
+"""
+Filesystem profiles: how a sync decides a file is already copied, and which
+rsync options suit the filesystem it writes to.
+
+The filesystem type of each volume is read from the mount table, and a
+profile is picked for the destination:
+
+    posix   ext4, xfs, btrfs, f2fs   size and mtime
+    exfat   exFAT SSDs               hash (from the index)
+    fat     FAT SD cards and sticks  size and mtime within 2 seconds
+    ntfs    NTFS drives              size and mtime
+    mtp     phones through gvfs      size only
+    default anything else            size only, the flags dir_sync.sh always had
+
+Comparisons:
+
+    size    a file with the same size is copied already (rsync --size-only)
+    mtime   same size and modification time, times within modify_window seconds
+            are equal (FAT stores times in 2 second steps)
+    hash    for backups only: files the local index does not record as
+            copied to the drive are copied, even if a file of the same size is
+            there. A copy stops counting once the local file is rewritten
+            (see MediaIndex.unreplicated). Useful where mtimes are unreliable,
+            e.g. exFAT written by machines in other time zones.
+
+A sync uses the destination's profile, with the comparison lowered to size if
+the source's times can not be trusted (mtp) and the wider modify_window of the
+two. The native engines keep track of sizes only, so they compare by size
+unless the profile is hash.
+
+config.json can change a profile, add one or map more filesystem types to it,
+and pin an entry to a profile:
+
+    "fs_profiles": [{"name": "exfat", "compare": "mtime", "modify_window": 1},
+                    {"name": "nas", "fs_types": ["cifs", "nfs4"], "rsync_options": ["--inplace"]}],
+    "backups": [{"volume": "/media/pi/Seagate", "fs_profile": "ntfs", ...}]
+
+bench_sync.py --profile <name> checks a profile on a real drive: run with the
+work directory on it, the second (no change) run must copy nothing.
+"""
+
+COMPARE = ("size", "mtime", "hash")
+
+
+@dataclass(frozen=True)
+class FsProfile:
+    """ Comparison and transfer options for syncs to one kind of filesystem. """
+    name: str
+    compare: str = "size"
+    modify_window: int = 0
+    rsync_options: tuple = ()
+    fs_types: tuple = ()
+
+    def describe(self):
+        compare = {"size": "size", "mtime": "size and mtime", "hash": "index hashes"}[self.compare]
+        if self.compare == "mtime" and self.modify_window:
+            compare += f" within {self.modify_window} s"
+        return f"{self.name} ({compare})"
+
+    def rsync_args(self, listed=False):
+        """
+        Returns the options dir_sync.sh passes to rsync for this profile.
+
+        Args:
+            listed (bool): The sync is given the list of files to copy (--files-from).
+        """
+        if self.compare == "mtime":
+            compare = [f"--modify-window={self.modify_window}"] if self.modify_window else []
+        elif self.compare == "hash" and listed:
+            # the index chose these files, copy them whatever is on the drive
+            compare = ["--ignore-times"]
+        else:
+            compare = ["--size-only"]
+        return compare + list(self.rsync_options)
+
+    def recopy(self, listed=False):
+        """ Whether the native engines copy listed files even if the destination has the same size. """
+        return self.compare == "hash" and listed
+
+
+# local disks: no delta transfer, the file is read anyway; allocate it in one piece
+_LOCAL = ("--whole-file", "--preallocate")
+# no owners on FAT, exFAT and (through ntfs-3g) NTFS; rsync -a as root fails to chown
+_NO_OWNER = ("--whole-file", "--no-owner", "--no-group")
+
+PROFILES = {
+    "posix": FsProfile("posix", "mtime", 0, _LOCAL, ("ext2", "ext3", "ext4", "xfs", "btrfs", "f2fs", "tmpfs")),
+    "exfat": FsProfile("exfat", "hash", 0, _NO_OWNER, ("exfat",)),
+    "fat": FsProfile("fat", "mtime", 2, _NO_OWNER, ("vfat", "msdos", "fat")),
+    "ntfs": FsProfile("ntfs", "mtime", 0, _NO_OWNER, ("ntfs", "ntfs3", "fuseblk")),
+    "mtp": FsProfile("mtp", "size", 0, (), ("fuse.gvfsd-fuse",)),
+    "default": FsProfile("default", "size", 0, ()),
+}
+
+
+class FsProfiles:
+    """
+    The profiles in use, with config.json's changes, and the profile of a sync.
+    """
+
+    def __init__(self, overrides=(), mounts=None):
+        """
+        Initializes the FsProfiles.
+
+        Args:
+            overrides (iterable): backup_config.FsProfileSettings from config.json.
+            mounts (dict, optional): Mount point -> filesystem type, read when needed if not given.
+        """
+        self.mounts = mounts
+        self.profiles = dict(PROFILES)
+        for override in overrides:
+            profile = self.profiles.get(override.name, dataclasses.replace(PROFILES["default"], name=override.name))
+            changes = {key: override.get(key) for key in ("compare", "modify_window", "rsync_options", "fs_types")
+                       if override.get(key) is not None}
+            self.profiles[override.name] = dataclasses.replace(profile, **changes)
+        self.by_fs_type = {}
+        for profile in self.profiles.values():
+            for fs in profile.fs_types:
+                # a profile from config.json takes a type over from a built-in one
+                if fs not in self.by_fs_type or profile.name not in PROFILES:
+                    self.by_fs_type[fs] = profile
+
+    def detect(self, path):
+        """ Returns the profile for the filesystem holding path. """
+        fs = fs_type(path, self.mounts if self.mounts is not None else read_mounts())
+        return self.by_fs_type.get(fs, self.profiles["default"])
+
+    def for_sync(self, source_dir, dest_dir, entry=None, indexed=False):
+        """
+        Returns the profile of a sync from source_dir to dest_dir.
+
+        Args:
+            entry (Source or Backup, optional): Its "fs_profile" names the destination's profile.
+            indexed (bool): The local index knows what the destination holds (backups),
+                            without it hash falls back to size.
+        """
+        name = entry.get("fs_profile") if entry is not None else None
+        if name is not None and name not in self.profiles:
+            print(f"Unknown fs_profile '{name}', detecting the filesystem.")
+            name = None
+        profile = self.profiles[name] if name is not None else self.detect(dest_dir)
+        source = self.detect(source_dir)
+        compare = profile.compare
+        if source.compare == "size" or (compare == "hash" and not indexed):
+            compare = "size"
+        return dataclasses.replace(profile, compare=compare,
+                                   modify_window=max(profile.modify_window, source.modify_window))
+
+
+# Example Usage:
+#   python fs_profile.py <directory> [directory...]
+if __name__ == "__main__":
+    profiles = FsProfiles()
+    mounts = read_mounts()
+    for path in sys.argv[1:]:
+        profile = profiles.detect(path)
+        print(f"{path}: {fs_type(path, mounts)}, {profile.describe()}: rsync {' '.join(profile.rsync_args())}")
@@ -0,0 +1,82 @@
+import ctypes
+import ctypes.util
+import os
+import platform
+from contextlib import contextmanager
+
+"""
+CPU and I/O priority of the calling process, like nice(1) and ionice(1).
+
+ioprio_set(2) has no wrapper in Python or glibc, so it is called through
+syscall(2) with the syscall number for the machine (the Pi 5 is aarch64).
+Priorities only matter to I/O schedulers that honour them (BFQ, and CFQ on
+older kernels); elsewhere setting them is harmless.
+"""
+
+IOPRIO_CLASS_RT = 1
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+
+_SYS_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "armv7l": 314, "armv6l": 314, "i686": 289}
+_SYS_IOPRIO_GET = {"x86_64": 252, "aarch64": 31, "armv7l": 315, "armv6l": 315, "i686": 290}
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+
+def set_io_priority(io_class, level=0, pid=0):
+    """
+    Sets the I/O scheduling class and level (0 highest .. 7 lowest) of a
+    process; pid 0 is the calling thread.
+
+    Returns:
+        bool: True if the kernel accepted it.
+    """
+    number = _SYS_IOPRIO_SET.get(platform.machine())
+    if number is None:
+        return False
+    value = (io_class << IOPRIO_CLASS_SHIFT) | (level if io_class != IOPRIO_CLASS_IDLE else 0)
+    return _libc.syscall(number, IOPRIO_WHO_PROCESS, pid, value) == 0
+
+
+def get_io_priority(pid=0):
+    """
+    Returns:
+        tuple: (I/O class, level) of a process or the calling thread (pid 0),
+               None if it can not be read.
+    """
+    number = _SYS_IOPRIO_GET.get(platform.machine())
+    if number is None:
+        return None
+    value = _libc.syscall(number, IOPRIO_WHO_PROCESS, pid)
+    if value < 0:
+        return None
+    return value >> IOPRIO_CLASS_SHIFT, value & ((1 << IOPRIO_CLASS_SHIFT) - 1)
+
+
+@contextmanager
+def io_priority(io_class, level=0):
+    """
+    Runs a block at an I/O priority in the calling thread, restoring the
+    previous one afterwards (pool threads are reused by other jobs).
+    """
+    previous = get_io_priority()
+    set_io_priority(io_class, level)
+    try:
+        yield
+    finally:
+        if previous is not None:
+            set_io_priority(*previous)
+
+
+def lower_priority(nice=19, io_class=IOPRIO_CLASS_IDLE, level=7):
+    """
+    Makes the calling process (or thread, for the I/O class) yield to
+    everything else: nice 19 and the idle I/O class by default.
+    """
+    try:
+        os.nice(nice - os.nice(0))
+    except OSError:
+        pass
+    set_io_priority(io_class, level)
@@ -14,61 +14,50 @@
 
 '''
 
+import queue
 import time
 from file_watcher import FileWatcher
-from json_config_reader import JsonConfigReader
+from backup_config import load_config
 from blink_led import ToggleLed
+from mount_monitor import MountMonitor
 
-config = JsonConfigReader("config.json")
-backup_subdir = config.get("backup_subdirectory", "yyyy-mm-dd_backup")
-backups = config.get("backups", [])
-sources = config.get("sources", [])
-exclude_files = set(config.get("exclude", []))
+config = load_config("config.json")
+backup_subdir = config.backup_subdir
+backups = config.backups
+sources = config.sources
+exclude_file = config.exclude
+
+watched = {}
 
 def create_file_watchers():
     # Create File Watchers for each source and backup volume
     for source in sources:
-        source_volume = source.get("volume")
-        source_directory = source.get("directory")
-        source_descr = source.get("descr", "No description")
-
-        print(f"Watching for {source_descr}...")
-        watcher = FileWatcher(source_volume,source_directory)
-        source["watcher"] = watcher
+        print(f"Watching for {source.descr}...")
+        watcher = FileWatcher(source.volume, source.directory)
+        watched[watcher] = ("Source", source)
 
     for backup in backups:
-        backup_volume = backup.get("volume")
-        backup_directory = backup.get("directory")
-        backup_descr = backup.get("descr", "No description")
-
-        print(f"Watching for {backup_descr}...")
-        watcher = FileWatcher(backup_volume,backup_directory)
-        backup["watcher"] = watcher
+        print(f"Watching for {backup.descr}...")
+        watcher = FileWatcher(backup.volume, backup.directory)
+        watched[watcher] = ("Backup", backup)
 
 create_file_watchers()
 # print(sources)
 # print(backups)
 
+ready = queue.Queue()
+
+# Mount events replace polling find_file() in a busy loop
+monitor = MountMonitor(watched.keys(), on_ready=lambda watcher: ready.put((watcher,) + watched[watcher]))
+monitor.start()
+
 while True:
     # TODO: start autobackup and then display menu
-    # Check each source for files
-    for source in sources:
-        watcher = source.get("watcher")
-        if watcher.find_file():
-            print(f"Source '{source.get('descr', 'No description')}' found.")
-            # TODO: NOTE: this is done in auto backup - Add code to backup new files from source to local backup directory
-            # print("waiting 3 seconds before dismounting...")
-            time.sleep(3)
-            watcher.dismount()
-            print("dismounted")
-
-    # Check each backup for files
-    for backup in backups:
-        watcher = backup.get("watcher")
-        if watcher.find_file():
-            print(f"Backup '{backup.get('descr', 'No description')}' found.")
-            # TODO: NOTE: this is done in auto backup - Add code to backup new files from local backup directory to backup volume
-            # print("waiting 5 seconds before dismounting...")
-            time.sleep(3)
-            watcher.dismount()
-            print("dismounted")
\ No newline at end of file
+    # Wait for a source or backup volume to be mounted
+    watcher, kind, entry = ready.get()
+    print(f"{kind} '{entry.get('descr', 'No description')}' found.")
+    # TODO: NOTE: this is done in auto backup - Add code to backup new files
+    # print("waiting 3 seconds before dismounting...")
+    time.sleep(3)
+    watcher.dismount()
+    print("dismounted")
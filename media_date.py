@@ -0,0 +1,386 @@
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+
+"""
+Reads the capture date of a photo or video from its header only.
+
+JPEG:        EXIF APP1 segment, in the first 64 KB
+ORF/DNG/TIF: TIFF IFDs, read tag by tag with seeks
+HEIC/HEIF:   'meta' box -> Exif item located via 'iinf'/'iloc'
+MP4/MOV:     'moov' -> 'mvhd' creation time, found by seeking over top level boxes
+
+No reader ever reads the whole file; each read is bounded to a few KB (the
+HEIF 'meta' box is capped at 1 MB). When no date is found, or the header is
+truncated or malformed, the file mtime is used instead.
+
+exif_thumbnail() uses the same readers to pull the small JPEG preview most
+cameras embed in IFD1, without decoding the image.
+"""
+
+MAX_SEGMENT = 64 * 1024
+MAX_META_BOX = 1024 * 1024
+
+# TIFF / EXIF tags
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_DATETIME_DIGITIZED = 0x9004
+TAG_THUMBNAIL_OFFSET = 0x0201
+TAG_THUMBNAIL_LENGTH = 0x0202
+MAX_THUMBNAIL = 256 * 1024
+
+# seconds between 1904-01-01 (QuickTime epoch) and 1970-01-01
+_QT_EPOCH_OFFSET = 2082844800
+
+JPEG_EXT = {".jpg", ".jpeg"}
+TIFF_EXT = {".orf", ".dng", ".nef", ".cr2", ".arw", ".tif", ".tiff"}
+HEIF_EXT = {".heic", ".heif", ".avif"}
+MOVIE_EXT = {".mp4", ".mov", ".m4v", ".3gp"}
+
+# what a truncated or malformed header raises in the readers
+_MALFORMED = (OSError, struct.error, ValueError, IndexError, KeyError, OverflowError)
+
+
+def capture_date(path, fallback=True):
+    """
+    Returns the capture date of a photo or video.
+
+    Args:
+        path (str): The file to read.
+        fallback (bool): Use the file's mtime if no date is found in the header.
+
+    Returns:
+        datetime: Capture date in local time, or None if not found and fallback is False.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    date = None
+    try:
+        with open(path, 'rb') as f:
+            if ext in JPEG_EXT:
+                date = _jpeg_date(f)
+            elif ext in TIFF_EXT:
+                date = _tiff_date(f, 0)
+            elif ext in HEIF_EXT:
+                date = _heif_date(f)
+            elif ext in MOVIE_EXT:
+                date = _movie_date(f)
+            else:
+                date = _sniff_date(f)
+    except _MALFORMED:
+        date = None
+
+    if date is None and fallback:
+        try:
+            date = datetime.fromtimestamp(os.stat(path).st_mtime)
+        except OSError:
+            return None
+    return date
+
+
+def _sniff_date(f):
+    """ Picks a reader from the first bytes when the extension is unknown. """
+    head = f.read(12)
+    f.seek(0)
+    if head[:2] == b"\xff\xd8":
+        return _jpeg_date(f)
+    if head[:2] in (b"II", b"MM"):
+        return _tiff_date(f, 0)
+    if head[4:8] == b"ftyp":
+        if head[8:12] in (b"heic", b"heix", b"mif1", b"msf1", b"avif"):
+            return _heif_date(f)
+        return _movie_date(f)
+    return None
+
+
+def _parse_exif_date(raw):
+    text = raw.split(b"\x00", 1)[0].decode("ascii", "ignore").strip()
+    try:
+        return datetime.strptime(text[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def _jpeg_exif_base(f):
+    """ Returns the offset of the TIFF structure in a JPEG's EXIF segment, or None. """
+    if f.read(2) != b"\xff\xd8":
+        return None
+    pos = 2
+    for _ in range(32):
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        (length,) = struct.unpack(">H", marker[2:4])
+        if code == 0xE1:
+            if f.read(6) == b"Exif\x00\x00":
+                return pos + 10
+        if code == 0xDA or pos > 4 * MAX_SEGMENT:
+            # start of image data, EXIF always comes before this
+            return None
+        pos += 2 + length
+        f.seek(pos)
+    return None
+
+
+def _jpeg_date(f):
+    base = _jpeg_exif_base(f)
+    return None if base is None else _tiff_date(f, base)
+
+
+def _read_ifd(f, base, offset, bo):
+    """ Returns {tag: (type, count, raw value/offset)} for one IFD. """
+    f.seek(base + offset)
+    raw = f.read(2)
+    if len(raw) < 2:
+        return {}
+    (count,) = struct.unpack(bo + "H", raw)
+    if count > 1000:
+        return {}
+    data = f.read(12 * count)
+    tags = {}
+    for i in range(len(data) // 12):
+        tag, typ, n = struct.unpack(bo + "HHI", data[i * 12:i * 12 + 8])
+        tags[tag] = (typ, n, data[i * 12 + 8:i * 12 + 12])
+    return tags
+
+
+def _tag_ascii(f, base, bo, entry):
+    typ, n, raw = entry
+    if typ != 2:
+        return None
+    if n <= 4:
+        return _parse_exif_date(raw[:n])
+    (offset,) = struct.unpack(bo + "I", raw)
+    f.seek(base + offset)
+    return _parse_exif_date(f.read(min(n, 64)))
+
+
+def _tiff_date(f, base):
+    """ Reads DateTimeOriginal from a TIFF structure starting at base. """
+    f.seek(base)
+    header = f.read(8)
+    if header[:2] == b"II":
+        bo = "<"
+    elif header[:2] == b"MM":
+        bo = ">"
+    else:
+        return None
+    (ifd0,) = struct.unpack(bo + "I", header[4:8])
+    tags = _read_ifd(f, base, ifd0, bo)
+
+    if TAG_EXIF_IFD in tags:
+        (exif_offset,) = struct.unpack(bo + "I", tags[TAG_EXIF_IFD][2])
+        exif = _read_ifd(f, base, exif_offset, bo)
+        for tag in (TAG_DATETIME_ORIGINAL, TAG_DATETIME_DIGITIZED):
+            if tag in exif:
+                date = _tag_ascii(f, base, bo, exif[tag])
+                if date:
+                    return date
+    if TAG_DATETIME in tags:
+        return _tag_ascii(f, base, bo, tags[TAG_DATETIME])
+    return None
+
+
+def _tag_int(bo, entry):
+    """ Value of a SHORT or LONG tag. """
+    typ, _, raw = entry
+    return struct.unpack(bo + "H", raw[:2])[0] if typ == 3 else struct.unpack(bo + "I", raw)[0]
+
+
+def _tiff_thumbnail(f, base):
+    """ Reads the JPEG thumbnail from IFD1 of a TIFF structure starting at base. """
+    f.seek(base)
+    header = f.read(8)
+    if header[:2] == b"II":
+        bo = "<"
+    elif header[:2] == b"MM":
+        bo = ">"
+    else:
+        return None
+    (ifd0,) = struct.unpack(bo + "I", header[4:8])
+    f.seek(base + ifd0)
+    raw = f.read(2)
+    if len(raw) < 2:
+        return None
+    (count,) = struct.unpack(bo + "H", raw)
+    # the offset of the next IFD (IFD1) follows the entries
+    f.seek(base + ifd0 + 2 + 12 * count)
+    raw = f.read(4)
+    if len(raw) < 4:
+        return None
+    (ifd1,) = struct.unpack(bo + "I", raw)
+    if not ifd1:
+        return None
+    tags = _read_ifd(f, base, ifd1, bo)
+    if TAG_THUMBNAIL_OFFSET not in tags or TAG_THUMBNAIL_LENGTH not in tags:
+        return None
+    offset = _tag_int(bo, tags[TAG_THUMBNAIL_OFFSET])
+    length = _tag_int(bo, tags[TAG_THUMBNAIL_LENGTH])
+    if not 0 < length <= MAX_THUMBNAIL:
+        return None
+    f.seek(base + offset)
+    data = f.read(length)
+    return data if data[:2] == b"\xff\xd8" else None
+
+
+def exif_thumbnail(path):
+    """
+    Returns the JPEG thumbnail embedded in a JPEG or TIFF based raw file, or None.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, 'rb') as f:
+            if ext in JPEG_EXT:
+                base = _jpeg_exif_base(f)
+                return None if base is None else _tiff_thumbnail(f, base)
+            if ext in TIFF_EXT:
+                return _tiff_thumbnail(f, 0)
+    except _MALFORMED:
+        pass
+    return None
+
+
+def _boxes(data, start=0, end=None):
+    """ Yields (type, payload start, payload end) of ISO BMFF boxes in a buffer. """
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, typ = struct.unpack(">I4s", data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", data[pos + 8:pos + 16])
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield typ, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _file_boxes(f):
+    """ Yields (type, payload offset, payload size) of top level boxes, seeking over them. """
+    pos = 0
+    while True:
+        f.seek(pos)
+        head = f.read(16)
+        if len(head) < 8:
+            return
+        size, typ = struct.unpack(">I4s", head[:8])
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", head[8:16])
+            header = 16
+        elif size == 0:
+            size = os.fstat(f.fileno()).st_size - pos
+        if size < header:
+            return
+        yield typ, pos + header, size - header
+        pos += size
+
+
+def _movie_date(f):
+    for typ, offset, size in _file_boxes(f):
+        if typ != b"moov":
+            continue
+        # walk moov children without reading the (possibly large) sample tables
+        pos = offset
+        end = offset + size
+        while pos + 8 <= end:
+            f.seek(pos)
+            child_size, child = struct.unpack(">I4s", f.read(8))
+            if child == b"mvhd":
+                data = f.read(20)
+                if len(data) < 20:
+                    return None
+                version = data[0]
+                if version == 1:
+                    (created,) = struct.unpack(">Q", data[4:12])
+                else:
+                    (created,) = struct.unpack(">I", data[4:8])
+                if created <= _QT_EPOCH_OFFSET:
+                    return None
+                # mvhd times are UTC
+                utc = datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=created - _QT_EPOCH_OFFSET)
+                return utc.astimezone().replace(tzinfo=None)
+            if child_size < 8:
+                return None
+            pos += child_size
+        return None
+    return None
+
+
+def _uint(data, pos, size):
+    """ Reads a big-endian integer of 0, 2, 4 or 8 bytes, returns it and the position after it. """
+    if size == 0:
+        return 0, pos
+    if size not in (2, 4, 8) or pos + size > len(data):
+        raise ValueError(f"bad {size} byte field at {pos}")
+    return int.from_bytes(data[pos:pos + size], "big"), pos + size
+
+
+def _heif_date(f):
+    meta = None
+    for typ, offset, size in _file_boxes(f):
+        if typ == b"meta":
+            if size > MAX_META_BOX:
+                return None
+            f.seek(offset)
+            meta = f.read(size)
+            break
+    if meta is None:
+        return None
+
+    # meta is a full box: skip version and flags
+    exif_id = None
+    locations = {}
+    for typ, start, end in _boxes(meta, 4):
+        if typ == b"iinf":
+            version = meta[start]
+            pos = start + 4 + (2 if version == 0 else 4)
+            for infe, istart, iend in _boxes(meta, pos, end):
+                if infe != b"infe" or meta[istart] < 2:
+                    continue
+                id_size = 2 if meta[istart] == 2 else 4
+                item_id, pos2 = _uint(meta, istart + 4, id_size)
+                if meta[pos2 + 2:pos2 + 6] == b"Exif":
+                    exif_id = item_id
+        elif typ == b"iloc":
+            version = meta[start]
+            offset_size = meta[start + 4] >> 4
+            length_size = meta[start + 4] & 0x0F
+            base_offset_size = meta[start + 5] >> 4
+            index_size = meta[start + 5] & 0x0F if version in (1, 2) else 0
+            pos = start + 6
+            count, pos = _uint(meta, pos, 2 if version < 2 else 4)
+            for _ in range(count):
+                item_id, pos = _uint(meta, pos, 2 if version < 2 else 4)
+                if version in (1, 2):
+                    pos += 2    # construction method
+                pos += 2        # data reference index
+                base_offset, pos = _uint(meta, pos, base_offset_size)
+                extents, pos = _uint(meta, pos, 2)
+                first = None
+                for _ in range(extents):
+                    _, pos = _uint(meta, pos, index_size)
+                    extent_offset, pos = _uint(meta, pos, offset_size)
+                    _, pos = _uint(meta, pos, length_size)
+                    if first is None:
+                        first = base_offset + extent_offset
+                locations[item_id] = first
+
+    offset = locations.get(exif_id)
+    if offset is None:
+        return None
+    # Exif item: 4 byte offset to the TIFF header, usually past "Exif\0\0"
+    f.seek(offset)
+    (tiff_offset,) = struct.unpack(">I", f.read(4))
+    return _tiff_date(f, offset + 4 + tiff_offset)
+
+# Example Usage:
+if __name__ == "__main__":
+    import sys
+
+    for path in sys.argv[1:]:
+        print(f"{capture_date(path, fallback=False)}  {path}")
@@ -0,0 +1,502 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+"""
+Persistent index of the local backup directory (local_backup_dir/backup_subdir).
+
+Keeps every file's relative path, size, mtime, optional content hash and the
+time it was ingested in a SQLite database (WAL mode), so questions such as
+"what is new since drive X was last synced" are answered by an indexed query
+instead of a walk of the whole archive.
+
+It also keeps the replica map: which backup volumes hold a verified copy of
+each file, maintained from sync results, so backups can copy the files with
+the fewest copies first (by_need()) and under-replicated files can be listed
+without any drive attached.
+
+reconcile() picks up changes made outside of this program by comparing
+directory mtimes with the ones recorded, and re-listing only the directories
+that changed. Adding, removing or renaming a file changes its directory's
+mtime; rewriting a file in place does not and is not detected.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,
+    size        INTEGER NOT NULL,
+    mtime_ns    INTEGER NOT NULL,
+    hash        TEXT,
+    ingested_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_ingested_at ON files (ingested_at);
+
+CREATE TABLE IF NOT EXISTS dirs (
+    path     TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS volume_syncs (
+    volume         TEXT PRIMARY KEY,
+    last_synced_at REAL NOT NULL
+);
+
+-- replaced by sync_runs
+DROP TABLE IF EXISTS volume_throughput;
+
+-- finished sync runs per device (the source volume of an ingest, the backup
+-- volume of a backup), for estimates of how long a sync will take and how
+-- much a time limited backup session can copy
+CREATE TABLE IF NOT EXISTS sync_runs (
+    device   TEXT NOT NULL,
+    ended_at REAL NOT NULL,
+    files    INTEGER NOT NULL,
+    bytes    INTEGER NOT NULL,
+    seconds  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sync_runs_device ON sync_runs (device, ended_at);
+
+CREATE TABLE IF NOT EXISTS replicas (
+    path   TEXT NOT NULL,
+    volume TEXT NOT NULL,
+    PRIMARY KEY (path, volume)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS replicas_volume ON replicas (volume);
+
+-- a copy of an old version is not a replica, nor is a copy of a removed file
+CREATE TRIGGER IF NOT EXISTS files_resized AFTER UPDATE OF size ON files WHEN old.size != new.size
+BEGIN
+    DELETE FROM replicas WHERE path = new.path;
+END;
+-- nor is a copy of a file since rewritten with the same size, which backups
+-- with the "hash" comparison (see fs_profile.py) rely on to find changed files
+CREATE TRIGGER IF NOT EXISTS files_modified AFTER UPDATE OF mtime_ns ON files WHEN old.mtime_ns != new.mtime_ns
+BEGIN
+    DELETE FROM replicas WHERE path = new.path;
+END;
+CREATE TRIGGER IF NOT EXISTS files_rehashed AFTER UPDATE OF hash ON files
+    WHEN old.hash IS NOT NULL AND new.hash IS NOT NULL AND old.hash != new.hash
+BEGIN
+    DELETE FROM replicas WHERE path = new.path;
+END;
+CREATE TRIGGER IF NOT EXISTS files_removed AFTER DELETE ON files
+BEGIN
+    DELETE FROM replicas WHERE path = old.path;
+END;
+"""
+
+# sync runs kept per device
+RUN_HISTORY = 20
+
+
+class MediaIndex:
+    """
+    SQLite index of the files in the local backup directory.
+    """
+
+    def __init__(self, db_path, root):
+        """
+        Initializes the MediaIndex, creating the database if needed.
+
+        Args:
+            db_path (str): Path of the SQLite database file.
+            root (str): Directory being indexed. Paths in the index are relative to it.
+        """
+        self.db_path = db_path
+        self.root = root
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add_files(self, rel_paths, ingested_at=None):
+        """
+        Adds or updates files that just landed in the local backup directory.
+        A file keeps its original ingest time unless its size changed.
+
+        Args:
+            rel_paths (iterable): Paths relative to the index root.
+            ingested_at (float, optional): Ingest time, defaults to now.
+
+        Returns:
+            int: Number of files added or updated.
+        """
+        ingested_at = time.time() if ingested_at is None else ingested_at
+        rows = []
+        for rel_path in rel_paths:
+            try:
+                st = os.stat(os.path.join(self.root, rel_path))
+            except OSError:
+                continue
+            rows.append((rel_path, st.st_size, st.st_mtime_ns, ingested_at))
+
+        # directory mtimes are left alone, so the next reconcile()
+        # still notices anything else that changed in those directories
+        with self._lock, self._conn:
+            self._upsert(rows)
+        return len(rows)
+
+    def _upsert(self, rows):
+        self._conn.executemany(
+            """INSERT INTO files (path, size, mtime_ns, ingested_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(path) DO UPDATE SET
+                   hash = CASE WHEN files.size = excluded.size THEN files.hash ELSE NULL END,
+                   ingested_at = CASE WHEN files.size = excluded.size
+                                      THEN files.ingested_at ELSE excluded.ingested_at END,
+                   size = excluded.size,
+                   mtime_ns = excluded.mtime_ns""",
+            rows)
+
+    def set_hash(self, rel_path, digest):
+        """ Records the content hash of a file. """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE files SET hash = ? WHERE path = ?", (digest, rel_path))
+
+    def get(self, rel_path):
+        """
+        Returns:
+            tuple: (size, mtime_ns, hash, ingested_at) of a file, or None if not indexed.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT size, mtime_ns, hash, ingested_at FROM files WHERE path = ?",
+                (rel_path,)).fetchone()
+
+    def count(self):
+        """ Returns the number of files and their total size. """
+        with self._lock:
+            n, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+        return n, size
+
+    def files(self):
+        """
+        Returns:
+            list: (path, size) of every indexed file.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT path, size FROM files").fetchall()
+
+    def files_since(self, since):
+        """
+        Returns:
+            list: (path, size) of files ingested after the given time, oldest first.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, size FROM files WHERE ingested_at > ? ORDER BY ingested_at, path",
+                (since,)).fetchall()
+
+    def last_synced(self, volume):
+        """ Returns when a backup volume was last synced, or None if never. """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_synced_at FROM volume_syncs WHERE volume = ?", (volume,)).fetchone()
+        return row[0] if row else None
+
+    def new_since_sync(self, volume):
+        """
+        Returns:
+            list: (path, size) of files ingested since a backup volume was last synced.
+                  Every file if the volume has never been synced.
+        """
+        return self.files_since(self.last_synced(volume) or 0)
+
+    def mark_synced(self, volume, synced_at):
+        """
+        Records a successful sync of a backup volume. Pass the time the sync
+        started so files ingested while it ran are reported next time.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO volume_syncs (volume, last_synced_at) VALUES (?, ?)",
+                (volume, synced_at))
+
+    def throughput(self, volume):
+        """ Returns a volume's bytes per second over its recent sync runs, or None if not known. """
+        rates = self.run_rates(volume)
+        return rates[0] if rates else None
+
+    def record_run(self, device, files, nbytes, seconds):
+        """ Adds a finished sync run that copied files to a device's history, keeping the last RUN_HISTORY. """
+        if files <= 0 or seconds <= 0:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO sync_runs (device, ended_at, files, bytes, seconds) VALUES (?, ?, ?, ?, ?)",
+                               (device, time.time(), files, nbytes, seconds))
+            self._conn.execute(
+                """DELETE FROM sync_runs WHERE device = ? AND ended_at <
+                       (SELECT MIN(ended_at) FROM (SELECT ended_at FROM sync_runs WHERE device = ?
+                                                  ORDER BY ended_at DESC LIMIT ?))""",
+                (device, device, RUN_HISTORY))
+
+    def run_rates(self, device):
+        """
+        Returns:
+            tuple: (bytes per second, files per second, number of runs) over a device's
+                   recent sync runs, or None if it has none.
+        """
+        with self._lock:
+            runs, files, nbytes, seconds = self._conn.execute(
+                "SELECT COUNT(*), SUM(files), SUM(bytes), SUM(seconds) FROM sync_runs WHERE device = ?",
+                (device,)).fetchone()
+        if not runs:
+            return None
+        return nbytes / seconds, files / seconds, runs
+
+    def add_replicas(self, volume, rel_paths):
+        """ Records that a backup volume holds copies of files. """
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO replicas (path, volume) VALUES (?, ?)",
+                                   ((rel_path, volume) for rel_path in rel_paths))
+
+    def remove_replicas(self, volume, rel_paths):
+        """ Records that copies on a backup volume are gone or bad. """
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM replicas WHERE path = ? AND volume = ?",
+                                   ((rel_path, volume) for rel_path in rel_paths))
+
+    def set_replicas(self, volume, files):
+        """
+        Replaces what a backup volume is recorded to hold, e.g. from its catalog after a sync.
+
+        Args:
+            volume (str): The backup volume.
+            files (dict): Relative path -> size of the files on the volume. Only
+                          files with the size of the indexed file are replicas.
+        """
+        indexed = dict(self.files())
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM replicas WHERE volume = ?", (volume,))
+            self._conn.executemany("INSERT OR IGNORE INTO replicas (path, volume) VALUES (?, ?)",
+                                   ((rel_path, volume) for rel_path, size in files.items()
+                                    if indexed.get(rel_path) == size))
+
+    def replicas(self, rel_path):
+        """ Returns the set of backup volumes holding a file. """
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT volume FROM replicas WHERE path = ?", (rel_path,))}
+
+    def _replica_counts(self, volumes=None):
+        """ path -> (number of replicas, size, ingested_at) of every indexed file,
+            counting only the given volumes if any. """
+        query = """SELECT f.path, f.size, f.ingested_at, COUNT(r.volume) FROM files f
+                   LEFT JOIN replicas r ON r.path = f.path {} GROUP BY f.path"""
+        with self._lock:
+            if volumes is None:
+                rows = self._conn.execute(query.format("")).fetchall()
+            else:
+                volumes = list(volumes)
+                marks = ", ".join("?" * len(volumes))
+                rows = self._conn.execute(query.format(f"AND r.volume IN ({marks})"), volumes).fetchall()
+        return {path: (count, size, ingested_at) for path, size, ingested_at, count in rows}
+
+    def by_need(self, rel_paths, volumes=None):
+        """
+        Orders files for a backup: fewest replicas first, newest ingest first among equals.
+
+        Args:
+            rel_paths (iterable): Paths relative to the index root.
+            volumes (iterable, optional): Only count replicas on these volumes (the configured backups).
+
+        Returns:
+            list: (path, number of replicas) in the order to copy them. Paths not
+                  in the index count as having no replicas and come last among those.
+        """
+        counts = self._replica_counts(volumes)
+        need = []
+        for rel_path in rel_paths:
+            count, _, ingested_at = counts.get(rel_path, (0, 0, 0))
+            need.append((count, -ingested_at, rel_path))
+        need.sort()
+        return [(rel_path, count) for count, _, rel_path in need]
+
+    def under_replicated(self, min_replicas, volumes=None):
+        """
+        Returns:
+            list: (path, size, number of replicas) of files with fewer than min_replicas
+                  replicas, in by_need() order.
+        """
+        counts = self._replica_counts(volumes)
+        under = [(count, -ingested_at, path, size) for path, (count, size, ingested_at) in counts.items()
+                 if count < min_replicas]
+        under.sort()
+        return [(path, size, count) for count, _, path, size in under]
+
+    def unreplicated(self, volume):
+        """
+        Returns:
+            list: (path, size) of files a backup volume holds no current copy of, by path.
+        """
+        with self._lock:
+            return self._conn.execute(
+                """SELECT path, size FROM files f WHERE NOT EXISTS
+                       (SELECT 1 FROM replicas r WHERE r.path = f.path AND r.volume = ?)
+                   ORDER BY path""", (volume,)).fetchall()
+
+    def replica_volumes(self):
+        """ Returns (volume, number of files, total size) for each volume with replicas. """
+        with self._lock:
+            return self._conn.execute(
+                """SELECT r.volume, COUNT(*), COALESCE(SUM(f.size), 0) FROM replicas r
+                   JOIN files f ON f.path = r.path GROUP BY r.volume ORDER BY r.volume""").fetchall()
+
+    def reconcile(self):
+        """
+        Brings the index in line with the files on disk. Only directories whose
+        mtime differs from the one recorded are re-listed. Directories are listed
+        without the lock, which is only held to write each one's changes, so
+        ingests and backups using the index are not held up by the walk.
+
+        Returns:
+            tuple: (files added, files removed, files changed)
+        """
+        added = removed = changed = 0
+        with self._lock:
+            known_dirs = dict(self._conn.execute("SELECT path, mtime_ns FROM dirs"))
+        if "" not in known_dirs:
+            known_dirs[""] = None
+
+        pending = []
+        for rel_dir, mtime_ns in known_dirs.items():
+            try:
+                current = os.stat(os.path.join(self.root, rel_dir)).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime_ns:
+                pending.append(rel_dir)
+
+        while pending:
+            rel_dir = pending.pop()
+            listing = self._list_dir(rel_dir)
+            with self._lock, self._conn:
+                a, r, c = self._apply_listing(rel_dir, listing)
+            added += a
+            removed += r
+            changed += c
+            if listing is not None:
+                for sub in listing[3]:
+                    if sub not in known_dirs:
+                        known_dirs[sub] = None
+                        pending.append(sub)
+
+        return added, removed, changed
+
+    def _list_dir(self, rel_dir):
+        """
+        Lists one directory of the local backup.
+
+        Returns:
+            tuple: (time listed, directory mtime, {path: (size, mtime_ns)} of its files,
+                    paths of its sub directories), None if the directory is gone.
+        """
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        path = os.path.join(self.root, rel_dir)
+        listed_at = time.time()
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            entries = list(os.scandir(path))
+        except OSError:
+            return None
+
+        files = {}
+        sub_dirs = []
+        for entry in entries:
+            rel_path = prefix + entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append(rel_path)
+                elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(".partial"):
+                    st = entry.stat(follow_symlinks=False)
+                    files[rel_path] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                # removed while listing
+                continue
+        return listed_at, mtime_ns, files, sub_dirs
+
+    def _apply_listing(self, rel_dir, listing):
+        """
+        Writes a directory listing from _list_dir() into the index. Called with
+        the lock held. Files indexed after the listing was taken (e.g. by an
+        ingest running meanwhile) are kept.
+
+        Returns:
+            tuple: (files added, files removed, files changed)
+        """
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        if listing is None:
+            # directory is gone: drop it, its sub directories and their files
+            like = prefix.replace("%", r"\%").replace("_", r"\_") + "%"
+            cur = self._conn.execute(r"DELETE FROM files WHERE path LIKE ? ESCAPE '\'", (like,))
+            self._conn.execute(r"DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\'", (rel_dir, like))
+            return 0, cur.rowcount, 0
+
+        listed_at, mtime_ns, files, _ = listing
+        # the files directly in rel_dir, not those of its sub directories
+        indexed = {rel_path: (size, ingested_at) for rel_path, size, ingested_at in self._conn.execute(
+            "SELECT path, size, ingested_at FROM files WHERE path >= ? AND path < ? AND instr(substr(path, ?), '/') = 0",
+            (prefix, prefix + "\uffff", len(prefix) + 1))}
+
+        rows = []
+        added = changed = 0
+        for rel_path, (size, file_mtime_ns) in files.items():
+            if rel_path not in indexed:
+                added += 1
+            elif indexed[rel_path][0] != size:
+                changed += 1
+            else:
+                continue
+            rows.append((rel_path, size, file_mtime_ns, listed_at))
+
+        gone = [(p,) for p, (_, ingested_at) in indexed.items() if p not in files and ingested_at < listed_at]
+        self._conn.executemany("DELETE FROM files WHERE path = ?", gone)
+        self._upsert(rows)
+        self._conn.execute("INSERT OR REPLACE INTO dirs (path, mtime_ns) VALUES (?, ?)", (rel_dir, mtime_ns))
+        return added, len(gone), changed
+
+# Command line:
+#   python media_index.py reconcile      - update the index from the local backup directory
+#   python media_index.py new <volume>   - list files not yet synced to a backup volume
+#   python media_index.py replicas [n]   - list files on fewer than n (2) backup volumes, fewest first
+if __name__ == "__main__":
+    from backup_config import load_config
+
+    config = load_config("config.json")
+    root = os.path.join(config.local_backup_dir, config.backup_subdir)
+    db_path = config.index_db or os.path.join(config.local_backup_dir, "media_index.db")
+
+    index = MediaIndex(db_path, root)
+    command = sys.argv[1] if len(sys.argv) > 1 else "reconcile"
+
+    if command == "reconcile":
+        start = time.time()
+        added, removed, changed = index.reconcile()
+        n, size = index.count()
+        print(f"{added} added, {removed} removed, {changed} changed in {time.time() - start:.1f} sec")
+        print(f"{n} files, {size / 1e9:.1f} GB indexed")
+    elif command == "replicas":
+        # reads only the index, no backup drive has to be attached
+        volumes = [backup.volume for backup in config.backups]
+        min_replicas = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+        for volume, n, size in index.replica_volumes():
+            print(f"{volume}: {n} files, {size / 1e9:.1f} GB")
+        under = index.under_replicated(min_replicas, volumes)
+        for rel_path, size, count in under:
+            print(f"{count}  {rel_path}")
+        print(f"{len(under)} files, {sum(size for _, size, _ in under) / 1e6:.1f} MB "
+              f"on fewer than {min_replicas} backup volumes")
+    elif command == "new" and len(sys.argv) > 2:
+        files = index.new_since_sync(sys.argv[2])
+        for rel_path, size in files:
+            print(rel_path)
+        print(f"{len(files)} files, {sum(size for _, size in files) / 1e6:.1f} MB not yet synced")
+    else:
+        print(f"Usage: {sys.argv[0]} reconcile | new <volume> | replicas [n]")
+    index.close()
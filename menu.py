@@ -1,7 +1,20 @@
+import os
+import queue
 import tkinter as tk
 from tkinter import ttk, messagebox
 import sv_ttk
 
+from auto_backup import AutoBackup
+from backup_config import load_config, ConfigError, ConfigWatcher
+from dashboard import Dashboard, SyncProgress, POLL_MS, MAX_EVENTS_PER_TICK
+from sync_log import SUBSCRIBER_QUEUE
+from thumbnail_cache import ThumbnailCache, load_last_ingest
+
+try:
+    from PIL import Image, ImageTk
+except ImportError:
+    ImageTk = None
+
 '''
 python 3.11 TKinter program to display a list of functions and allow you to select one of the functions to run. 
 Each function would have a lookup table that defines the python program to run for a given function.
@@ -29,13 +42,14 @@ def say_hello(caller):
     if response:
         if caller.backup_running:
             print("stopping backup...")
-            caller.backup_running = False
+            caller.stop_backup()
             item_txt = f'{item + 1}. Start Backup Monitor?'
             caller.function_listbox.delete(item)
             caller.function_listbox.insert(item, item_txt)
         else:
             print("starting backup...")
-            caller.backup_running = True
+            if not caller.start_backup():
+                return
             item_txt = f'{item + 1}. Stop Backup Monitor?'
             caller.function_listbox.delete(item)
             caller.function_listbox.insert(item, item_txt)
@@ -52,6 +66,25 @@ def display_info(caller):
 def run_task(caller):
     messagebox.showinfo("Function Executed", "Running a generic task for function 4.")
 
+def show_progress(caller):
+    caller.show_dashboard()
+
+def browse_last_ingest(caller):
+    if ImageTk is None:
+        messagebox.showerror("Browse", "Showing thumbnails needs Pillow: pip install pillow")
+        return
+    try:
+        config = load_config("config.json")
+    except ConfigError as e:
+        messagebox.showerror("Browse", f"{e.path} has errors:\n" + "\n".join(e.problems))
+        return
+    cache_dir = config.thumbnail_cache_dir or os.path.join(config.local_backup_dir, ".thumbnails")
+    files = load_last_ingest(cache_dir)
+    if not files:
+        messagebox.showinfo("Browse", "No thumbnails of an ingest yet.")
+        return
+    ThumbnailBrowser(caller, ThumbnailCache(cache_dir, max_bytes=int(config.thumbnail_cache_mb * 1024 * 1024)), files)
+
 
 # --- Lookup Table (Dictionary) ---
 # This dictionary maps the function number and name to the actual function reference.
@@ -60,14 +93,113 @@ function_lookup = {
     1: {"name": "Start Backup Monitor?", "function": say_hello},
     2: {"name": "Show a Message", "function": show_message},
     3: {"name": "Display Information", "function": display_info},
-    4: {"name": "Run a Task", "function": run_task}
+    4: {"name": "Run a Task", "function": run_task},
+    5: {"name": "Browse Last Ingest", "function": browse_last_ingest},
+    6: {"name": "Show Backup Progress", "function": show_progress}
 }
 
+class ThumbnailBrowser(tk.Toplevel):
+    """
+    Pages through the thumbnails of the last ingest, a grid per page.
+    Thumbnails come from the cache the backup fills in the background, and the
+    next page is decoded while the current one is shown so paging is instant.
+    """
+    COLUMNS = 4
+    ROWS = 3
+
+    def __init__(self, parent, cache, files):
+        super().__init__(parent)
+        self.cache = cache
+        self.files = files    # (relative path, key) of the last ingest
+        self.per_page = self.COLUMNS * self.ROWS
+        self.page = 0
+        self._images = {}     # key -> PhotoImage of the current and next page
+
+        self.title(f"Last Ingest - {len(files)} photos")
+
+        grid = ttk.Frame(self, padding=10)
+        grid.pack(fill="both", expand=True)
+        self.cells = []
+        for i in range(self.per_page):
+            cell = ttk.Label(grid, compound="top", anchor="center")
+            cell.grid(row=i // self.COLUMNS, column=i % self.COLUMNS, padx=4, pady=4)
+            self.cells.append(cell)
+
+        nav = ttk.Frame(self, padding=(10, 0, 10, 10))
+        nav.pack(fill="x")
+        ttk.Button(nav, text="< Prev", command=self.prev_page).pack(side="left")
+        ttk.Button(nav, text="Next >", command=self.next_page).pack(side="right")
+        self.page_label = ttk.Label(nav, anchor="center")
+        self.page_label.pack(fill="x")
+
+        self.bind("<Left>", lambda event: self.prev_page())
+        self.bind("<Prior>", lambda event: self.prev_page())
+        self.bind("<Right>", lambda event: self.next_page())
+        self.bind("<Next>", lambda event: self.next_page())
+        self.bind("<Escape>", lambda event: self.destroy())
+
+        self.show_page(0)
+
+    def pages(self):
+        return max(1, -(-len(self.files) // self.per_page))
+
+    def _page_files(self, page):
+        return self.files[page * self.per_page:(page + 1) * self.per_page]
+
+    def _image(self, key):
+        image = self._images.get(key)
+        if image is None:
+            path = self.cache.get(key)
+            if path is None:
+                return None
+            try:
+                with Image.open(path) as thumb:
+                    image = ImageTk.PhotoImage(thumb)
+            except OSError:
+                return None
+            self._images[key] = image
+        return image
+
+    def show_page(self, page):
+        self.page = min(max(page, 0), self.pages() - 1)
+        files = self._page_files(self.page)
+        for i, cell in enumerate(self.cells):
+            if i < len(files):
+                rel_path, key = files[i]
+                image = self._image(key)
+                cell.config(image=image or "", text=os.path.basename(rel_path))
+            else:
+                cell.config(image="", text="")
+        self.page_label.config(text=f"Page {self.page + 1} of {self.pages()}")
+        # keep only this page's images, then decode the next page while idle
+        keep = {key for _, key in files}
+        self._images = {key: image for key, image in self._images.items() if key in keep}
+        self.after_idle(self._preload, self.page + 1)
+
+    def _preload(self, page):
+        if page == self.page + 1:
+            for _, key in self._page_files(page):
+                self._image(key)
+
+    def next_page(self):
+        if self.page + 1 < self.pages():
+            self.show_page(self.page + 1)
+
+    def prev_page(self):
+        if self.page > 0:
+            self.show_page(self.page - 1)
+
 class FunctionRunnerApp(tk.Tk):
-    def __init__(self,parms):
+    def __init__(self, parms=None):
         super().__init__()
 
         self.backup_running = False
+        # AutoBackup runs on its own thread, its sync events come back on a queue drained by _poll_events
+        self.auto_backup = None
+        self.config_watcher = None
+        self.backup_events = queue.Queue(SUBSCRIBER_QUEUE)
+        self.progress = SyncProgress()
+        self.dashboard = None
 
         self.title("Function Runner")
         self.geometry("500x400")
@@ -135,6 +267,9 @@ class FunctionRunnerApp(tk.Tk):
         self.status_label = ttk.Label(main_frame, text="Ready.", relief="groove")
         self.status_label.pack(side="bottom", fill="x", pady=(10, 0))
 
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._poll_events()
+
     def populate_listbox(self):
         """Populates the listbox with function names from the lookup table."""
         for num, func_data in function_lookup.items():
@@ -190,6 +325,83 @@ class FunctionRunnerApp(tk.Tk):
         except IndexError:
             messagebox.showwarning("Warning", "Please select a function from the list first.")
 
+    def start_backup(self):
+        """Starts AutoBackup in the background, once a previous one has finished.
+        Returns False if config.json has errors."""
+        try:
+            config = load_config("config.json")
+        except ConfigError as e:
+            messagebox.showerror("Backup", f"{e.path} has errors:\n" + "\n".join(e.problems))
+            return False
+        self.backup_running = True
+        self._start_when_stopped(config)
+        self.show_dashboard()
+        return True
+
+    def _start_when_stopped(self, config):
+        """Starts AutoBackup, waiting without blocking Tk for a stopped one to finish its jobs,
+        so two never use the index, journal and drives at the same time."""
+        if not self.backup_running:
+            # stopped again while waiting
+            return
+        if self.auto_backup is not None and self.auto_backup.is_alive():
+            self.update_status("Waiting for the previous backup monitor to stop...")
+            self.after(POLL_MS, self._start_when_stopped, config)
+            return
+        self.auto_backup = AutoBackup.from_config(config)
+        self.auto_backup.subscribe(self.backup_events)
+        self.auto_backup.start()
+        # add or remove sources and backups when config.json is edited
+        try:
+            self.config_watcher = ConfigWatcher("config.json", on_change=self.auto_backup.apply_config, config=config)
+            self.config_watcher.start()
+        except OSError as e:
+            print(f"Not watching config.json for changes: {e}")
+            self.config_watcher = None
+        self.update_status("Backup monitor started.")
+
+    def stop_backup(self):
+        """Asks AutoBackup to stop, it cancels its jobs and finishes in the background."""
+        self.backup_running = False
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+            self.config_watcher = None
+        if self.auto_backup is not None:
+            self.auto_backup.stop()
+            self.auto_backup.unsubscribe(self.backup_events)
+
+    def backup_status(self):
+        """Returns a line describing what the backup thread is doing."""
+        if self.auto_backup is None:
+            return "Backup monitor not started."
+        if not self.auto_backup.is_alive():
+            return "Backup monitor stopped."
+        if self.auto_backup.stopped():
+            return "Backup monitor stopping..."
+        status = self.auto_backup.job_status()
+        if status is None:
+            return "Backup monitor busy..."
+        active, queued = status
+        if not active:
+            return "Waiting for new media source or backup..."
+        return f"Running: {', '.join(active)}" + (f" ({len(queued)} queued)" if queued else "")
+
+    def show_dashboard(self):
+        if self.dashboard is not None and self.dashboard.winfo_exists():
+            self.dashboard.lift()
+            return
+        self.dashboard = Dashboard(self, self.progress, status=self.backup_status)
+
+    def _poll_events(self):
+        """Drains the backup's sync events on the Tk thread, never waiting for them."""
+        handled = self.progress.drain(self.backup_events)
+        # come back right away while there is a backlog
+        self.after(1 if handled == MAX_EVENTS_PER_TICK else POLL_MS, self._poll_events)
+
+    def on_close(self):
+        self.stop_backup()
+        self.destroy()
+
     def update_status(self, message):
         """Updates the status bar with a given message."""
         self.status_label.config(text=message)
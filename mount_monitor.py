@@ -0,0 +1,335 @@
+import ctypes
+import ctypes.util
+import math
+import os
+import re
+import select
+import threading
+import time
+
+try:
+    from gi.repository import Gio, GLib
+except ImportError:
+    # without PyGObject gvfs mounts are found by relisting the gvfs root
+    Gio = None
+
+"""
+Event driven replacement for polling FileWatcher.find_file().
+
+Watches /proc/self/mountinfo for mount table changes and uses inotify on the
+directories that hold the watched volumes (e.g. /media/<user> and the gvfs
+root /run/user/<uid>/gvfs). gvfs does not deliver inotify events for its FUSE
+root, so its mounts are followed through the GIO volume monitor when PyGObject
+is installed, and by relisting the gvfs root every fuse_rescan_interval
+otherwise.
+
+A watched volume that appears settles first: it is reported ready once no
+mount event has arrived for settle_seconds and its directory exists. The
+device itself is not listed while it settles, it is only stat'ed once when
+it is due (and again at doubling intervals while an MTP phone has not made
+its storage available yet), so rsync never starts against a half enumerated
+MTP tree.
+"""
+
+MOUNTINFO = "/proc/self/mountinfo"
+
+# inotify flags from <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ONLYDIR = 0x01000000
+
+_WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+
+def read_mounts(mountinfo=MOUNTINFO):
+    """
+    Returns a dictionary of mount point to filesystem type from mountinfo.
+    """
+    mounts = {}
+    try:
+        with open(mountinfo, 'r') as f:
+            for line in f:
+                fields = line.split()
+                sep = fields.index("-")
+                # mount points escape spaces as \040
+                mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[4])
+                mounts[mount_point] = fields[sep + 1]
+    except (OSError, ValueError):
+        pass
+    return mounts
+
+
+def fs_type(path, mounts=None):
+    """
+    Returns the filesystem type of the mount holding path, or None.
+    """
+    mounts = read_mounts() if mounts is None else mounts
+    path = os.path.abspath(path)
+    best = None
+    for mount_point in mounts:
+        if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+            if best is None or len(mount_point) > len(best):
+                best = mount_point
+    return mounts.get(best)
+
+
+class MountMonitor(threading.Thread):
+    """
+    A thread that dispatches a "volume ready" callback for FileWatchers
+    as their volumes are mounted.
+    """
+
+    def __init__(self, watchers, on_ready, on_removed=None, settle_seconds=2.0,
+                 settle_timeout=120, fuse_rescan_interval=5.0, *args, **kwargs):
+        """
+        Initializes the MountMonitor.
+
+        Args:
+            watchers (list): FileWatcher instances to watch for.
+            on_ready (callable): Called with the FileWatcher once its directory
+                                 exists and its listing has settled.
+            on_removed (callable, optional): Called with the FileWatcher when its volume goes away.
+            settle_seconds (float): How long after the last mount event a new volume
+                                    is considered ready.
+            settle_timeout (float): Give up on a volume whose directory does not appear
+                                    within this many seconds.
+            fuse_rescan_interval (float): Without the GIO volume monitor, parent directories on
+                                          FUSE (gvfs) are relisted at this interval. Only the
+                                          parent is listed, never the device. None disables the
+                                          rescan.
+        """
+        kwargs.setdefault("daemon", True)
+        super().__init__(*args, **kwargs)
+        self.watchers = list(watchers)
+        self.on_ready = on_ready
+        self.on_removed = on_removed
+        self.settle_seconds = settle_seconds
+        self.settle_timeout = settle_timeout
+        self.fuse_rescan_interval = fuse_rescan_interval
+
+        self.parents = sorted({os.path.dirname(w.volume.rstrip("/")) for w in self.watchers})
+
+        self._lock = threading.Lock()
+        self._present = set()    # volumes seen mounted
+        self._settling = {}      # volume -> [watcher, due, wait, deadline], monitor thread only
+        self._wds = {}           # parent directory -> inotify watch descriptor
+        self._fuse_parents = set()
+        self._gvfs_loop = None
+        self._closed = False     # run() has exited and closed the pipe
+
+        self._stop_r, self._stop_w = os.pipe()
+        self._inotify_fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._inotify_fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+    def stop(self):
+        """Signals the monitor thread to stop. Does nothing once it has stopped."""
+        self._wake(b"x")
+
+    def _wake(self, command):
+        """Writes to the monitor thread's pipe, unless run() has closed it."""
+        with self._lock:
+            if not self._closed:
+                os.write(self._stop_w, command)
+
+    def set_watchers(self, watchers):
+        """
+        Replaces the watched FileWatchers while running, e.g. after config.json
+        was reloaded. A new watcher whose volume is already mounted is reported
+        ready; volumes no longer watched are forgotten.
+        """
+        with self._lock:
+            self.watchers = list(watchers)
+            self.parents = sorted({os.path.dirname(w.volume.rstrip("/")) for w in self.watchers})
+            self._present &= {w.volume.rstrip("/") for w in self.watchers}
+            self._settling = {v: s for v, s in self._settling.items() if v in self._present}
+        # wake the monitor thread to rescan
+        self._wake(b"r")
+
+    def _add_watches(self, parents):
+        """Adds inotify watches to parent directories that now exist."""
+        mounts = read_mounts()
+        for parent in parents:
+            if parent in self._wds or not os.path.isdir(parent):
+                continue
+            wd = _libc.inotify_add_watch(self._inotify_fd, os.fsencode(parent), _WATCH_MASK)
+            if wd < 0:
+                continue
+            self._wds[parent] = wd
+            ptype = fs_type(parent, mounts) or ""
+            if ptype.startswith("fuse"):
+                self._fuse_parents.add(parent)
+
+    def _rescan(self):
+        """
+        Lists each parent directory and starts settling newly appeared
+        volumes. Only parents are listed, never volumes.
+        """
+        with self._lock:
+            watchers = list(self.watchers)
+            parents = list(self.parents)
+        self._add_watches(parents)
+
+        names = {}
+        for parent in parents:
+            try:
+                names[parent] = set(os.listdir(parent))
+            except OSError:
+                names[parent] = set()
+
+        now = time.monotonic()
+        for watcher in watchers:
+            volume = watcher.volume.rstrip("/")
+            parent, name = os.path.split(volume)
+            mounted = name in names.get(parent, ())
+
+            with self._lock:
+                if mounted and volume not in self._present:
+                    self._present.add(volume)
+                    self._settling[volume] = [watcher, now + self.settle_seconds, self.settle_seconds,
+                                              now + self.settle_timeout]
+                    removed = False
+                elif not mounted and volume in self._present:
+                    self._present.discard(volume)
+                    self._settling.pop(volume, None)
+                    removed = True
+                else:
+                    removed = False
+
+            if removed and self.on_removed:
+                self.on_removed(watcher)
+
+    def _postpone_settling(self):
+        """Another mount event arrived, volumes still settling wait settle_seconds from now."""
+        due = time.monotonic() + self.settle_seconds
+        with self._lock:
+            for settling in self._settling.values():
+                settling[1] = max(settling[1], due)
+
+    def _settle_due(self):
+        """
+        Checks the settling volumes that are due: a volume whose directory exists
+        is reported ready, otherwise it is checked again after twice the wait.
+
+        Returns:
+            float: Seconds until the next volume is due, None if none is settling.
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [(v, s[0]) for v, s in self._settling.items() if s[1] <= now]
+        for volume, watcher in due:
+            ready = os.path.isdir(watcher.file_path)
+            with self._lock:
+                settling = self._settling.get(volume)
+                if settling is None:
+                    continue
+                if ready:
+                    del self._settling[volume]
+                elif now >= settling[3]:
+                    print(f"Volume '{volume}' did not settle within {self.settle_timeout} seconds.")
+                    # forget it so the next mount event tries again
+                    del self._settling[volume]
+                    self._present.discard(volume)
+                else:
+                    settling[2] *= 2
+                    settling[1] = min(now + settling[2], settling[3])
+            if ready:
+                self.on_ready(watcher)
+
+        with self._lock:
+            if not self._settling:
+                return None
+            return max(0.0, min(s[1] for s in self._settling.values()) - time.monotonic())
+
+    def _watch_gvfs(self):
+        """Runs a GLib loop that wakes the monitor thread when gvfs mounts change."""
+        context = self._gvfs_loop.get_context()
+        context.push_thread_default()
+        try:
+            volume_monitor = Gio.VolumeMonitor.get()
+            for signal in ("mount-added", "mount-removed", "mount-changed"):
+                volume_monitor.connect(signal, lambda *args: self._wake(b"r"))
+            self._gvfs_loop.run()
+        finally:
+            context.pop_thread_default()
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self._stop_r, select.POLLIN)
+        poller.register(self._inotify_fd, select.POLLIN)
+
+        try:
+            mountinfo = open(MOUNTINFO, 'r')
+            mountinfo.read()
+            poller.register(mountinfo, select.POLLPRI | select.POLLERR)
+        except OSError:
+            mountinfo = None
+
+        gvfs_thread = None
+        if Gio is not None:
+            self._gvfs_loop = GLib.MainLoop.new(GLib.MainContext.new(), False)
+            gvfs_thread = threading.Thread(target=self._watch_gvfs, daemon=True)
+            gvfs_thread.start()
+
+        self._rescan()
+
+        try:
+            while True:
+                timeout = self._settle_due()
+                if self._fuse_parents and self.fuse_rescan_interval and gvfs_thread is None:
+                    timeout = min(timeout if timeout is not None else math.inf, self.fuse_rescan_interval)
+
+                events = poller.poll(None if timeout is None else math.ceil(timeout * 1000))
+                for fd, _ in events:
+                    if fd == self._stop_r:
+                        # "x" stops, anything else (set_watchers) only rescans
+                        if b"x" in os.read(self._stop_r, 64):
+                            return
+                    if fd == self._inotify_fd:
+                        try:
+                            while os.read(self._inotify_fd, 65536):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    elif mountinfo is not None and fd == mountinfo.fileno():
+                        # re-read from the start to re-arm the poll
+                        mountinfo.seek(0)
+                        mountinfo.read()
+
+                # on any event (or fuse rescan timeout) relist the parents
+                if events:
+                    self._postpone_settling()
+                self._rescan()
+        finally:
+            if gvfs_thread is not None:
+                self._gvfs_loop.quit()
+                gvfs_thread.join()
+            if mountinfo is not None:
+                mountinfo.close()
+            with self._lock:
+                self._closed = True
+                os.close(self._inotify_fd)
+                os.close(self._stop_r)
+                os.close(self._stop_w)
+
+# Example Usage:
+if __name__ == "__main__":
+    from file_watcher import FileWatcher
+    from backup_config import load_config
+
+    config = load_config("config.json")
+    watchers = [FileWatcher(e.volume, e.directory) for e in config.sources + config.backups]
+
+    monitor = MountMonitor(watchers,
+                           on_ready=lambda w: print(f"ready: {w.file_path}"),
+                           on_removed=lambda w: print(f"removed: {w.volume}"))
+    monitor.start()
+
+    input("Press Enter to stop monitoring...\n")
+    monitor.stop()
+    monitor.join()
@@ -0,0 +1,559 @@
+import errno
+import json
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from copy_journal import COMMIT_BYTES
+from exclude_matcher import get_matcher
+from sync_log import open_log
+from tee_ingest import MirrorSink, tee_data
+from throttle import THROTTLE_CHUNK
+
+"""
+In-process alternative to dir_sync.sh / rsync.
+
+The destination is described by a manifest kept next to the destination
+directory, so only the source tree is walked on each run. The manifest records
+the size of every file and the mtime of every directory; a directory whose
+mtime changed since the manifest was written is re-listed, so changes made
+outside of this program are still picked up without a full walk. A file the
+manifest has with the source's size is stat'ed before it is skipped, since a
+file rewritten in place leaves its directory's mtime alone.
+
+Files are compared by size only (same as rsync --size-only), copied with
+os.copy_file_range / os.sendfile, and written to a temporary file that is
+renamed into place once complete.
+"""
+
+CHUNK_SIZE = 8 * 1024 * 1024
+MANIFEST_VERSION = 1
+
+
+def copy_file(src, dst, fsync=True, journal=None, mirrors=(), rel_path=None, throttle=None):
+    """
+    Copies src to dst through a temporary file that is renamed into place,
+    so dst is never left partially written. File times are preserved.
+
+    With a CopyJournal, progress is committed every COMMIT_BYTES and the temp
+    file is kept if the copy fails, so copying the same unchanged source again
+    resumes from the last commit instead of starting over.
+
+    With mirrors (MirrorSinks, see tee_ingest.py) the source is read once and
+    also written to each mirror as rel_path.
+
+    With a throttle (a callable taking a byte count that sleeps as needed, see
+    throttle.py) the copy goes in THROTTLE_CHUNK pieces, each one passed to it first.
+
+    Returns:
+        int: Size of the copied file.
+    """
+    st = os.stat(src)
+    tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.partial")
+    start = journal.begin(tmp, src, dst, st) if journal is not None else 0
+
+    checkpoint = None
+    if journal is not None:
+        def checkpoint(fdst, offset):
+            os.fsync(fdst.fileno())
+            journal.commit(tmp, offset)
+
+    try:
+        with open(src, 'rb', buffering=0) as fsrc, open(tmp, 'r+b' if start else 'wb', buffering=0) as fdst:
+            if start:
+                fdst.truncate(start)
+            if mirrors:
+                copied = tee_data(fsrc, fdst, st.st_size, start, checkpoint, mirrors, rel_path, st, throttle)
+            else:
+                copied = _copy_data(fsrc, fdst, st.st_size, start, checkpoint, throttle)
+            if fsync:
+                os.fsync(fdst.fileno())
+                if journal is not None:
+                    # the whole file is on disk: recover() renames it if the rename below never happens
+                    journal.commit(tmp, copied)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, dst)
+    except BaseException:
+        # with a journal the temp file is kept so the copy can resume
+        if journal is None:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        raise
+    if journal is not None:
+        journal.finish(tmp)
+    return copied
+
+
+def _files_by_dir(files):
+    """ Groups a manifest's files by the directory they are in. """
+    by_dir = {}
+    for rel_path in files:
+        by_dir.setdefault(os.path.dirname(rel_path), set()).add(rel_path)
+    return by_dir
+
+
+def _copy_data(fsrc, fdst, size, start=0, checkpoint=None, throttle=None):
+    """
+    Copy from offset start using the kernel where possible, falling back to
+    large reads. checkpoint(fdst, offset) is called every COMMIT_BYTES,
+    throttle(nbytes) before every THROTTLE_CHUNK.
+    """
+    methods = {"copy_file_range": hasattr(os, "copy_file_range"), "sendfile": True}
+    step = COMMIT_BYTES if checkpoint else max(size, 1)
+    if throttle is not None:
+        step = min(step, THROTTLE_CHUNK)
+    copied = start
+    next_commit = start + COMMIT_BYTES
+    while copied < size:
+        end = min(size, copied + step)
+        if throttle is not None:
+            throttle(end - copied)
+        copied = _copy_range(fsrc, fdst, copied, end, methods)
+        if copied < end:
+            # source is shorter than when it was stat'ed
+            break
+        if checkpoint and copied < size and copied >= next_commit:
+            checkpoint(fdst, copied)
+            next_commit = copied + COMMIT_BYTES
+
+    # plain reads for anything left (files that grew)
+    os.lseek(fsrc.fileno(), copied, os.SEEK_SET)
+    os.lseek(fdst.fileno(), copied, os.SEEK_SET)
+    return copied + _copy_buffered(fsrc, fdst, None)
+
+
+def _copy_range(fsrc, fdst, pos, end, methods):
+    """ Copies bytes pos..end, returns the offset reached. """
+    in_fd = fsrc.fileno()
+    out_fd = fdst.fileno()
+    os.lseek(in_fd, pos, os.SEEK_SET)
+    os.lseek(out_fd, pos, os.SEEK_SET)
+
+    # copy_file_range: in kernel copy, may reflink on filesystems that support it
+    if methods["copy_file_range"]:
+        try:
+            while pos < end:
+                n = os.copy_file_range(in_fd, out_fd, min(CHUNK_SIZE, end - pos))
+                if n == 0:
+                    break
+                pos += n
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                raise
+            methods["copy_file_range"] = False
+
+    # sendfile: still in kernel, works across filesystems
+    if pos < end and methods["sendfile"]:
+        os.lseek(out_fd, pos, os.SEEK_SET)
+        try:
+            while pos < end:
+                n = os.sendfile(out_fd, in_fd, pos, min(CHUNK_SIZE, end - pos))
+                if n == 0:
+                    break
+                pos += n
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+            methods["sendfile"] = False
+
+    # plain reads (e.g. FUSE sources)
+    if pos < end:
+        os.lseek(in_fd, pos, os.SEEK_SET)
+        os.lseek(out_fd, pos, os.SEEK_SET)
+        pos += _copy_buffered(fsrc, fdst, end - pos)
+    return pos
+
+
+def _copy_buffered(fsrc, fdst, limit):
+    """ Copies up to limit bytes (None for all) with large reads. """
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    copied = 0
+    while limit is None or copied < limit:
+        want = CHUNK_SIZE if limit is None else min(CHUNK_SIZE, limit - copied)
+        n = fsrc.readinto(view[:want])
+        if not n:
+            break
+        out = view[:n]
+        while out:
+            out = out[fdst.write(out):]
+        copied += n
+    return copied
+
+
+class SyncCancelled(Exception):
+    """
+    A sync was stopped through its cancel event. Files copied so far are kept.
+    """
+
+
+class SyncResult:
+    """
+    Summary of a NativeSync.run_sync() call.
+    """
+    def __init__(self, source_dir, dest_dir):
+        self.source_dir = source_dir
+        self.dest_dir = dest_dir
+        self.copied = []        # relative paths copied
+        self.sources = {}       # destination relative path -> source relative path
+        self.bytes_copied = 0
+        self.skipped = 0        # files already on the destination
+        self.excluded = 0
+        self.returncode = 0
+        self.mirrored = {}      # mirror root -> relative paths written there (tee ingest)
+        self.mirror_errors = {} # mirror root -> error that dropped it
+
+
+class NativeSync:
+    """
+    A pure Python directory sync with the same run_sync() interface as DirSync.
+    """
+    def __init__(self, log_file="rsync_log.txt", fsync=True, journal=None, events=None):
+        """
+        Initializes the NativeSync instance.
+
+        Args:
+            log_file (str or SyncLog): File to append the sync log to.
+            fsync (bool): fsync each file before it is renamed into place.
+            journal (CopyJournal, optional): Journal used to resume interrupted copies.
+            events (callable, optional): Called with structured progress events (see sync_metrics.py).
+        """
+        self.log_file = log_file
+        self.fsync = fsync
+        self.journal = journal
+        self.events = events
+
+    def _event(self, name, source_dir, dest_dir, **fields):
+        if self.events is None:
+            return
+        event = {"ts": round(time.time(), 3), "event": name, "source": source_dir, "dest": dest_dir}
+        event.update(fields)
+        self.events(event)
+
+    def _file_done(self, result, rel_path, n, file_started, run_started, total):
+        """ Emits a file_done event in the same form RsyncProgressParser does. """
+        if self.events is None:
+            return
+        now = time.time()
+        seconds = now - file_started
+        done = len(result.copied)
+        self._event("file_done", result.source_dir, result.dest_dir, path=rel_path, size=n,
+                    rate=round(n / seconds) if seconds > 0 else 0, seconds=round(seconds, 3),
+                    files_done=done, files_total=total, files_remaining=total - done,
+                    eta=round((now - run_started) / done * (total - done), 1))
+
+    def _start_mirrors(self, mirrors):
+        """ Starts a MirrorSink for each mirror root or (root, matcher) pair (see tee_ingest.py). """
+        sinks = []
+        for mirror in mirrors or ():
+            root, matcher = mirror if isinstance(mirror, tuple) else (mirror, None)
+            sinks.append(MirrorSink(root, fsync=self.fsync, matcher=matcher))
+        for sink in sinks:
+            sink.start()
+        return sinks
+
+    def _close_mirrors(self, sinks, result, log):
+        """ Waits for the mirrors to finish writing and records what they wrote. """
+        for sink in sinks:
+            sink.close()
+            result.mirrored[sink.root] = sink.written
+            if sink.error is not None:
+                result.mirror_errors[sink.root] = sink.error
+                log.write(f"mirror {sink.root} dropped: {sink.error}\n")
+            else:
+                log.write(f"mirrored {len(sink.written)} files to {sink.root}\n")
+
+    @staticmethod
+    def manifest_path(dest_dir):
+        """
+        Returns the manifest file for a destination directory. The manifest is
+        kept beside, not in, the directory so writing it does not change the
+        directory's mtime.
+        """
+        dest_dir = os.path.abspath(dest_dir).rstrip("/")
+        parent, name = os.path.split(dest_dir)
+        return os.path.join(parent, f".{name}.sync_manifest.json")
+
+    def load_manifest(self, dest_dir):
+        """
+        Returns the destination manifest, re-listing only directories whose
+        mtime changed. Builds a new manifest with a full walk if none exists.
+        """
+        try:
+            with open(self.manifest_path(dest_dir), 'r') as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION:
+                raise ValueError("manifest version")
+        except (OSError, ValueError):
+            return self.build_manifest(dest_dir)
+
+        files = manifest["files"]
+        dirs = manifest["dirs"]
+        by_dir = _files_by_dir(files)
+        pending = []
+        for rel_dir, mtime_ns in list(dirs.items()):
+            try:
+                current = os.stat(os.path.join(dest_dir, rel_dir)).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime_ns:
+                pending.extend(self._rescan_dir(dest_dir, rel_dir, files, dirs, by_dir))
+        # walk directories created since the manifest was written
+        while pending:
+            pending.extend(self._rescan_dir(dest_dir, pending.pop(), files, dirs, by_dir))
+        return manifest
+
+    def build_manifest(self, dest_dir):
+        """ Walks the whole destination tree to build a manifest. """
+        manifest = {"version": MANIFEST_VERSION, "files": {}, "dirs": {}}
+        by_dir = {}
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            pending.extend(self._rescan_dir(dest_dir, rel_dir, manifest["files"], manifest["dirs"], by_dir))
+        return manifest
+
+    def _rescan_dir(self, root, rel_dir, files, dirs, by_dir):
+        """
+        Re-lists a single directory into the manifest.
+
+        Args:
+            by_dir (dict): Directory -> set of the manifest's files directly in it, kept up to date.
+
+        Returns:
+            list: Sub directories that are new to the manifest.
+        """
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        # forget what was recorded directly in this directory
+        for rel_path in by_dir.pop(rel_dir, ()):
+            files.pop(rel_path, None)
+
+        new_dirs = []
+        listed = set()
+        path = os.path.join(root, rel_dir)
+        try:
+            dirs[rel_dir] = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                for entry in it:
+                    rel_path = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if rel_path not in dirs:
+                            new_dirs.append(rel_path)
+                    elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(".partial"):
+                        files[rel_path] = entry.stat(follow_symlinks=False).st_size
+                        listed.add(rel_path)
+            by_dir[rel_dir] = listed
+        except FileNotFoundError:
+            for rel_path in listed:
+                files.pop(rel_path, None)
+            dirs.pop(rel_dir, None)
+            for sub in [d for d in dirs if d.startswith(prefix)]:
+                del dirs[sub]
+            for sub in [d for d in by_dir if d.startswith(prefix)]:
+                for rel_path in by_dir.pop(sub):
+                    files.pop(rel_path, None)
+        return new_dirs
+
+    def save_manifest(self, dest_dir, manifest, touched_dirs=()):
+        """ Re-stats directories written to and atomically saves the manifest. """
+        for rel_dir in touched_dirs:
+            try:
+                manifest["dirs"][rel_dir] = os.stat(os.path.join(dest_dir, rel_dir)).st_mtime_ns
+            except OSError:
+                manifest["dirs"].pop(rel_dir, None)
+
+        path = self.manifest_path(dest_dir)
+        tmp = path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _up_to_date(dest_dir, dest_files, rel_path, size):
+        """
+        Whether the destination holds rel_path with the given size. A file the
+        manifest has with that size is stat'ed as well: rewriting a file in place
+        does not change its directory's mtime, so the manifest would not notice.
+        The manifest is corrected when it was wrong.
+        """
+        if dest_files.get(rel_path) != size:
+            return False
+        try:
+            actual = os.stat(os.path.join(dest_dir, rel_path)).st_size
+        except OSError:
+            actual = None
+        if actual is None:
+            del dest_files[rel_path]
+        else:
+            dest_files[rel_path] = actual
+        return actual == size
+
+    @staticmethod
+    def scan_source(source_dir, matcher):
+        """
+        Walks the source tree once, skipping excluded directories.
+
+        Returns:
+            tuple: (dict of relative path -> size, number of excluded entries)
+        """
+        files = {}
+        excluded = 0
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            prefix = f"{rel_dir}/" if rel_dir else ""
+            with os.scandir(os.path.join(source_dir, rel_dir)) as it:
+                for entry in it:
+                    rel_path = prefix + entry.name
+                    is_dir = entry.is_dir()
+                    if matcher.excluded(rel_path, is_dir, parents=False):
+                        excluded += 1
+                    elif is_dir:
+                        pending.append(rel_path)
+                    elif entry.is_file():
+                        files[rel_path] = entry.stat().st_size
+        return files, excluded
+
+    def scan_files(self, source_dir, rel_paths, matcher):
+        """
+        Stats only the given source files instead of walking the tree.
+
+        Returns:
+            tuple: (dict of relative path -> size, number of excluded entries)
+        """
+        files = {}
+        excluded = 0
+        for rel_path in rel_paths:
+            if matcher.excluded(rel_path):
+                excluded += 1
+                continue
+            try:
+                files[rel_path] = os.stat(os.path.join(source_dir, rel_path)).st_size
+            except FileNotFoundError:
+                pass
+        return files, excluded
+
+    def run_sync(self, source_dir: str, dest_dir: str, exclude_file: Optional[str] = None,
+                 files: Optional[list] = None, cancel=None, mirrors=None, throttle=None, recopy=False):
+        """
+        Copies new or changed (by size) files from source_dir to dest_dir.
+
+        Args:
+            source_dir (str): The source directory for the sync.
+            dest_dir (str): The destination directory for the sync. Must exist.
+            exclude_file (Optional[str]): rsync style exclude file.
+            files (Optional[list]): Paths relative to source_dir to copy. If given,
+                only these files are considered instead of walking the source.
+            cancel (threading.Event, optional): Stops the sync before the next file when set.
+            mirrors (Optional[list]): Directories, or (directory, ExcludeMatcher) pairs, that also
+                get each copied file, read from the source only once (see tee_ingest.py).
+            throttle (callable, optional): Called with each chunk's size before it is copied,
+                sleeps to limit the bandwidth (see throttle.py).
+            recopy (bool): Copy the given files even if the destination has them with the
+                same size, for the "hash" comparison (see fs_profile.py).
+
+        Returns:
+            SyncResult: Files and bytes copied.
+
+        Raises:
+            FileNotFoundError: If the source or destination directory or exclude file does not exist.
+            SyncCancelled: If cancel was set.
+        """
+        if not os.path.isdir(source_dir):
+            print(f"Error: Source directory '{source_dir}' does not exist.")
+            raise FileNotFoundError(source_dir)
+        if not os.path.isdir(dest_dir):
+            print(f"Error: Destination directory '{dest_dir}' not found.")
+            raise FileNotFoundError(dest_dir)
+
+        matcher = get_matcher(exclude_file)
+        result = SyncResult(source_dir, dest_dir)
+
+        start_dt = datetime.now()
+        with open_log(self.log_file, source_dir, dest_dir) as log:
+            log.write(f"\n-------- {start_dt:%m-%d-%Y %H:%M} {'-'*40}\n")
+            log.write(f"from {source_dir}\n")
+            log.write(f"  to {dest_dir}\n\n")
+
+            manifest = self.load_manifest(dest_dir)
+            if files is None:
+                source_files, result.excluded = self.scan_source(source_dir, matcher)
+            else:
+                source_files, result.excluded = self.scan_files(source_dir, files, matcher)
+
+            dest_files = manifest["files"]
+            to_copy = [p for p, size in source_files.items()
+                       if (recopy and files is not None) or not self._up_to_date(dest_dir, dest_files, p, size)]
+            if files is None:
+                to_copy.sort()
+            # otherwise keep the caller's order, e.g. fewest replicas first
+            result.skipped = len(source_files) - len(to_copy)
+
+            touched = set()
+            sinks = self._start_mirrors(mirrors)
+            run_started = time.time()
+            self._event("run_start", source_dir, dest_dir, engine="native")
+            try:
+                for rel_path in to_copy:
+                    if cancel is not None and cancel.is_set():
+                        raise SyncCancelled(source_dir)
+                    rel_dir = os.path.dirname(rel_path)
+                    dst = os.path.join(dest_dir, rel_path)
+                    if rel_dir not in manifest["dirs"]:
+                        os.makedirs(os.path.dirname(dst), exist_ok=True)
+                        # record any new parent directories
+                        parent = rel_dir
+                        while parent and parent not in manifest["dirs"]:
+                            touched.add(parent)
+                            manifest["dirs"][parent] = 0
+                            parent = os.path.dirname(parent)
+                        # the existing directory a new one was made in changed too
+                        touched.add(parent)
+                    touched.add(rel_dir)
+
+                    file_started = time.time()
+                    self._event("file_start", source_dir, dest_dir, path=rel_path)
+                    n = copy_file(os.path.join(source_dir, rel_path), dst, fsync=self.fsync, journal=self.journal,
+                                  mirrors=[sink for sink in sinks if sink.wants(rel_path)], rel_path=rel_path,
+                                  throttle=throttle)
+                    dest_files[rel_path] = n
+                    result.copied.append(rel_path)
+                    result.sources[rel_path] = rel_path
+                    result.bytes_copied += n
+                    log.write(f"{rel_path}\n")
+                    self._file_done(result, rel_path, n, file_started, run_started, len(to_copy))
+            except Exception:
+                result.returncode = 1
+                raise
+            finally:
+                self._close_mirrors(sinks, result, log)
+                self.save_manifest(dest_dir, manifest, touched)
+                self._event("run_end", source_dir, dest_dir, returncode=result.returncode,
+                            files=len(result.copied), bytes=result.bytes_copied,
+                            seconds=round(time.time() - run_started, 3))
+
+                end_dt = datetime.now()
+                diff = end_dt - start_dt
+                min = int(diff.total_seconds() // 60)
+                sec = int(diff.total_seconds() % 60)
+                log.write(f"\ncopied {len(result.copied)} files, {result.bytes_copied:,} bytes, "
+                          f"{result.skipped} up to date, {result.excluded} excluded\n")
+                log.write(f"-------- elapsed: {min} min, {sec} sec {'-'*40}\n")
+
+        return result
+
+# --- Example Usage ---
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} <source_directory> <destination_directory> [exclude_file]")
+        sys.exit(1)
+
+    sync_manager = NativeSync(log_file="rsync_log.txt")
+    result = sync_manager.run_sync(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    print(f"Copied {len(result.copied)} files, {result.bytes_copied:,} bytes")
@@ -0,0 +1,241 @@
+import json
+import os
+import re
+import threading
+import time
+
+from exclude_matcher import ExcludeMatcher
+from mount_monitor import fs_type
+
+"""
+Per source state used to enumerate only what is new on a phone or camera card.
+
+Listing a source over gvfs MTP or gphoto2 and stat'ing every file is the slowest
+part of an ingest. For each source volume (the "volume" string in config.json)
+this remembers the files already ingested, their sizes and mtimes, the mtime of
+each directory and the highest file name seen in each directory. Camera file
+names increase (P5190001.JPG, PXL_20251013_171237832.jpg, IMG_1234.HEIC), so the
+highest name works as a high-water mark:
+
+- a directory whose mtime is unchanged (and not 0, which MTP often reports) is
+  not listed at all, unless it holds files (has a high-water mark): camera
+  firmware often adds photos to DCIM/100OMSYS without updating its mtime, so
+  those directories are always listed, and on FAT / exFAT cards no directory
+  mtime is trusted
+- otherwise only names are listed and only names not seen before are stat'ed
+- a new name that sorts at or below the high-water mark means the sequence was
+  reset or the state is wrong, and the caller falls back to a full listing
+- every FULL_SCAN_INTERVAL the caller is told to list the whole source anyway
+"""
+
+# seconds after which a source is fully listed again
+FULL_SCAN_INTERVAL = 7 * 24 * 3600
+# filesystems whose directory mtimes are not updated reliably by cameras
+UNTRUSTED_DIR_MTIME = {"vfat", "msdos", "fat", "exfat"}
+
+_DIGITS = re.compile(r'(\d+)')
+
+
+def sequence_key(name):
+    """
+    Sort key for camera file names that orders embedded numbers numerically
+    (IMG_999.JPG before IMG_1000.JPG).
+    """
+    return [int(part) if part.isdigit() else part.lower() for part in _DIGITS.split(name)]
+
+
+class SourceScan:
+    """
+    Result of SourceState.scan(): new files on a source and what to record once
+    they have been copied.
+    """
+    def __init__(self):
+        self.files = []     # relative paths of new files
+        self.entries = {}   # relative path -> [size, mtime_ns] of new files
+        self.dirs = {}      # relative directory -> mtime_ns of directories listed
+        self.listed = 0     # number of directories listed
+        self.skipped = 0    # number of directories not listed, mtime unchanged
+        self.excluded = None  # entries left out by the exclude rules, counted by list_all() only
+
+    def size(self):
+        return sum(size for size, _ in self.entries.values())
+
+
+class SourceState:
+    """
+    Stores per source volume high-water marks in a JSON file.
+    """
+
+    def __init__(self, state_file):
+        """
+        Initializes the SourceState.
+
+        Args:
+            state_file (str): Path of the JSON file the state is kept in.
+        """
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        try:
+            with open(state_file, 'r') as f:
+                self._state = json.load(f)
+        except FileNotFoundError:
+            self._state = {}
+        except json.JSONDecodeError:
+            print(f"Warning: Invalid JSON in '{state_file}'. Sources will be fully listed.")
+            self._state = {}
+
+    def forget(self, volume):
+        """ Drops the state for a source, forcing a full listing next time. """
+        with self._lock:
+            self._state.pop(volume, None)
+            self._save()
+
+    def scan(self, volume, source_dir, matcher=None):
+        """
+        Finds files on a source that were not ingested before.
+
+        Args:
+            volume (str): The source volume from config.json.
+            source_dir (str): Directory being ingested from.
+            matcher (ExcludeMatcher, optional): Exclude rules, see exclude_matcher.get_matcher().
+
+        Returns:
+            SourceScan: The new files, or None if there is no state for the
+                        source, it is inconsistent or the last full listing is
+                        older than FULL_SCAN_INTERVAL, and a full listing is needed.
+        """
+        with self._lock:
+            state = self._state.get(volume)
+            if not state:
+                return None
+            if time.time() - state.get("full_at", 0) > FULL_SCAN_INTERVAL:
+                print("Source was not fully listed for a while, listing the whole source.")
+                return None
+            known_files = state["files"]
+            known_dirs = state["dirs"]
+            high_water = state["high_water"]
+        trust_mtime = fs_type(source_dir) not in UNTRUSTED_DIR_MTIME
+
+        matcher = matcher or ExcludeMatcher()
+        scan = SourceScan()
+        pending = list(known_dirs)
+        listed = set()
+        while pending:
+            rel_dir = pending.pop()
+            if rel_dir in listed:
+                continue
+            listed.add(rel_dir)
+            path = os.path.join(source_dir, rel_dir)
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if trust_mtime and mtime_ns and known_dirs.get(rel_dir) == mtime_ns and rel_dir not in high_water:
+                scan.skipped += 1
+                continue
+
+            scan.listed += 1
+            scan.dirs[rel_dir] = mtime_ns
+            prefix = f"{rel_dir}/" if rel_dir else ""
+            mark = high_water.get(rel_dir)
+            mark_key = sequence_key(mark) if mark else None
+            with os.scandir(path) as it:
+                for entry in it:
+                    rel_path = prefix + entry.name
+                    # only names not seen before are stat'ed
+                    if rel_path in known_files or rel_path in known_dirs:
+                        continue
+                    if entry.is_dir():
+                        if not matcher.excluded(rel_path, True):
+                            pending.append(rel_path)
+                        continue
+                    if matcher.excluded(rel_path) or not entry.is_file():
+                        continue
+                    if rel_dir in known_dirs and mark_key is not None and sequence_key(entry.name) <= mark_key:
+                        print(f"'{rel_path}' is below the high-water mark '{mark}', listing the whole source.")
+                        return None
+                    st = entry.stat()
+                    scan.files.append(rel_path)
+                    scan.entries[rel_path] = [st.st_size, st.st_mtime_ns]
+
+        scan.files.sort()
+        return scan
+
+    def record_scan(self, volume, scan):
+        """ Records files from a scan once they have been copied. """
+        with self._lock:
+            state = self._state.setdefault(volume, {"files": {}, "dirs": {}, "high_water": {}})
+            state["files"].update(scan.entries)
+            state["dirs"].update(scan.dirs)
+            self._update_high_water(state, scan.entries)
+            state["updated_at"] = time.time()
+            self._save()
+
+    @staticmethod
+    def list_all(source_dir, matcher=None):
+        """
+        Lists a whole source, for a full sync to plan and copy from and for
+        record_full() to record afterwards, so the source is only listed once.
+
+        Returns:
+            SourceScan: Every file on the source, with the excluded entries counted.
+        """
+        matcher = matcher or ExcludeMatcher()
+        scan = SourceScan()
+        scan.excluded = 0
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            path = os.path.join(source_dir, rel_dir)
+            prefix = f"{rel_dir}/" if rel_dir else ""
+            try:
+                scan.dirs[rel_dir] = os.stat(path).st_mtime_ns
+                entries = list(os.scandir(path))
+            except FileNotFoundError:
+                continue
+            scan.listed += 1
+            for entry in entries:
+                rel_path = prefix + entry.name
+                is_dir = entry.is_dir()
+                if matcher.excluded(rel_path, is_dir, parents=False):
+                    scan.excluded += 1
+                elif is_dir:
+                    pending.append(rel_path)
+                elif entry.is_file():
+                    st = entry.stat()
+                    scan.files.append(rel_path)
+                    scan.entries[rel_path] = [st.st_size, st.st_mtime_ns]
+        scan.files.sort()
+        return scan
+
+    def record_full(self, volume, source_dir, matcher=None, scan=None):
+        """
+        Records the state of a source after a full sync.
+
+        Args:
+            scan (SourceScan, optional): The list_all() listing the sync was made from,
+                                         the source is listed again without.
+        """
+        if scan is None:
+            scan = self.list_all(source_dir, matcher)
+        state = {"files": dict(scan.entries), "dirs": dict(scan.dirs), "high_water": {}}
+        self._update_high_water(state, state["files"])
+        state["updated_at"] = state["full_at"] = time.time()
+
+        with self._lock:
+            self._state[volume] = state
+            self._save()
+
+    def _update_high_water(self, state, rel_paths):
+        high_water = state["high_water"]
+        for rel_path in rel_paths:
+            rel_dir, name = os.path.split(rel_path)
+            mark = high_water.get(rel_dir)
+            if mark is None or sequence_key(name) > sequence_key(mark):
+                high_water[rel_dir] = name
+
+    def _save(self):
+        tmp = self.state_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self._state, f, separators=(",", ":"))
+        os.replace(tmp, self.state_file)
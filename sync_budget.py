@@ -0,0 +1,114 @@
+import math
+import time
+
+"""
+Time and byte budgets for backup sessions.
+
+A backup drive that is only plugged in briefly gets "max_seconds" and/or
+"max_bytes" on its backups entry (or "backup_max_seconds" / "backup_max_bytes"
+for every backup). SyncBudget turns a time limit into bytes with the drive's
+run history (MediaIndex.throughput(), bytes per second of its recent backup
+sessions, copying and verifying), takes the files in priority order
+(MediaIndex.by_need) as long as they fit and leaves the rest for the next
+attach. The selected files are copied in chunks of about CHUNK_SECONDS, the
+budget is checked between chunks, and the native engine is also told to stop
+at the deadline, after the file it is copying. rsync is terminated at the
+deadline in the middle of a file, which is copied again next time. The
+adaptive throttle (throttle.py) only slows the native engine; rsync can be
+capped with "--bwlimit" in a filesystem profile's rsync_options.
+
+Only files the session actually wrote count as copied, not those it found on
+the drive already. A session on a drive without a current catalog does not
+walk the drive afterwards, see drive_catalog.py.
+"""
+
+# bytes per second assumed for a drive with no history
+DEFAULT_RATE = 20e6
+# part of the time budget planned for, the rest absorbs a slower than usual drive
+SAFETY = 0.8
+CHUNK_SECONDS = 30
+
+
+class SyncBudget:
+    """
+    Limits of one backup session and the files chosen to fit them.
+    """
+
+    def __init__(self, max_seconds=None, max_bytes=None, rate=None):
+        """
+        Initializes the SyncBudget. The clock starts now.
+
+        Args:
+            max_seconds (float, optional): Time the session may take.
+            max_bytes (int, optional): Bytes the session may copy.
+            rate (float, optional): Expected bytes per second, DEFAULT_RATE if unknown.
+        """
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.rate = rate or DEFAULT_RATE
+        self.started = time.monotonic()
+        self.deadline = self.started + max_seconds if max_seconds is not None else None
+
+    def __str__(self):
+        limits = []
+        if self.max_seconds is not None:
+            limits.append(f"{self.max_seconds:.0f} sec at {self.rate / 1e6:.1f} MB/s")
+        if self.max_bytes is not None:
+            limits.append(f"{self.max_bytes / 1e6:.0f} MB")
+        return ", ".join(limits)
+
+    def seconds_left(self):
+        """ Returns the seconds left, None without a time limit. """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def allowance(self):
+        """ Returns the bytes that still fit the budget. """
+        allowance = math.inf
+        if self.max_bytes is not None:
+            allowance = self.max_bytes
+        if self.deadline is not None:
+            allowance = min(allowance, self.seconds_left() * self.rate * SAFETY)
+        return allowance
+
+    def select(self, files):
+        """
+        Takes files, most valuable first, while they fit. A file too big for what
+        is left is skipped so smaller ones after it can still go.
+
+        Args:
+            files (iterable): (path, size) in priority order.
+
+        Returns:
+            tuple: (selected (path, size) in priority order, deferred paths)
+        """
+        allowance = self.allowance()
+        used = 0
+        selected = []
+        deferred = []
+        for rel_path, size in files:
+            if used + size <= allowance:
+                selected.append((rel_path, size))
+                used += size
+            else:
+                deferred.append(rel_path)
+        return selected, deferred
+
+    def chunks(self, selected):
+        """ Splits (path, size) into lists of paths of about CHUNK_SECONDS of copying each. """
+        limit = self.rate * CHUNK_SECONDS
+        chunk = []
+        size_sum = 0
+        for rel_path, size in selected:
+            if chunk and size_sum + size > limit:
+                yield chunk
+                chunk = []
+                size_sum = 0
+            chunk.append(rel_path)
+            size_sum += size
+        if chunk:
+            yield chunk
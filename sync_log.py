@@ -0,0 +1,402 @@
+import gzip
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+"""
+The sync log (rsync_log.txt), rotated and indexed.
+
+Each sync run is written through SyncLog.run(), which records where the run
+starts and ends in an index next to the log (rsync_log.txt.index, JSON lines),
+so a run can be read back by seeking straight to it instead of scanning the
+file. Before a run starts, when no other run is writing, the log is rotated if
+it is larger than max_bytes or its first run is older than max_age_days: the
+file is renamed to rsync_log.YYYYmmdd-HHMMSS.txt and gzip'ed, and only the
+newest keep segments are kept. Runs that overlap (parallel backups) share the
+segment, so their byte ranges overlap too.
+
+Everything written is also passed to subscribers (subscribe()), which is how
+the menu or a web view can follow the log in process. From a shell:
+
+    python sync_log.py tail [-n 30] [-f]
+    python sync_log.py runs
+    python sync_log.py show <run>
+"""
+
+MAX_BYTES = 10 * 1024 * 1024
+MAX_AGE_DAYS = 7
+KEEP_SEGMENTS = 10
+SUBSCRIBER_QUEUE = 10000
+
+
+def rotate_file(path):
+    """
+    Renames a log to a dated segment next to it (rsync_log.YYYYmmdd-HHMMSS.txt)
+    and gzips it.
+
+    Returns:
+        str: Name of the gzip'ed segment.
+    """
+    stem, ext = os.path.splitext(path)
+    stamp = f"{datetime.now():%Y%m%d-%H%M%S}"
+    rotated = f"{stem}.{stamp}{ext}"
+    n = 1
+    while os.path.exists(rotated + ".gz"):
+        rotated = f"{stem}.{stamp}-{n}{ext}"
+        n += 1
+    os.rename(path, rotated)
+    with open(rotated, 'rb') as src, gzip.open(rotated + ".gz", 'wb') as dst:
+        while True:
+            chunk = src.read(1024 * 1024)
+            if not chunk:
+                break
+            dst.write(chunk)
+    os.remove(rotated)
+    return os.path.basename(rotated) + ".gz"
+
+
+def segment_files(path):
+    """ Names of the rotated segments of a log on disk. """
+    directory = os.path.dirname(path) or "."
+    stem, ext = os.path.splitext(os.path.basename(path))
+    return [name for name in os.listdir(directory)
+            if name.startswith(stem + ".") and name.endswith(ext + ".gz")]
+
+
+def prune_segments(path, keep):
+    """
+    Removes all but the newest keep rotated segments of a log.
+
+    Returns:
+        set: Names of the segments kept.
+    """
+    directory = os.path.dirname(path) or "."
+    segments = sorted(segment_files(path), key=lambda name: os.stat(os.path.join(directory, name)).st_mtime_ns)
+    for old in segments[:-keep] if keep else segments:
+        os.remove(os.path.join(directory, old))
+    return set(segments[-keep:]) if keep else set()
+
+
+def screen_lines(text):
+    """ Splits log text into lines as a terminal shows them: rsync progress
+        updates end in \\r, so only the last update on a line is kept. """
+    return [line.rsplit("\r", 1)[-1] if "\r" in line.rstrip("\r") else line.rstrip("\r")
+            for line in text.split("\n")]
+
+
+class _RunWriter:
+    """
+    File-like object a sync engine writes one run's log to.
+    """
+
+    def __init__(self, log, f):
+        self._log = log
+        self._f = f
+
+    def write(self, text):
+        self._f.write(text.encode(errors="replace"))
+        self._log._publish(text)
+        return len(text)
+
+    def flush(self):
+        self._f.flush()
+
+
+class SyncLog:
+    """
+    Rotating, gzip'ing, indexed sync log with an in-process tail.
+    """
+
+    def __init__(self, path, max_bytes=MAX_BYTES, max_age_days=MAX_AGE_DAYS, keep=KEEP_SEGMENTS):
+        """
+        Initializes the SyncLog.
+
+        Args:
+            path (str): The log file, e.g. rsync_log.txt.
+            max_bytes (int): Rotate once the log is larger than this.
+            max_age_days (float): Rotate once the first run in the log is older than this.
+            keep (int): Number of rotated (gzip'ed) segments to keep.
+        """
+        self.path = path
+        self.index_path = path + ".index"
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._active = 0
+        self._subscribers = []
+        self._next_run = max((entry["run"] for entry in self.runs()), default=0) + 1
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path
+
+    # --- writing ---
+
+    @contextmanager
+    def run(self, source_dir="", dest_dir=""):
+        """
+        Opens the log for one sync run, yielding a file-like object with write() and flush().
+        """
+        with self._lock:
+            if self._active == 0:
+                self._maybe_rotate()
+            self._active += 1
+            run_id = self._next_run
+            self._next_run += 1
+
+        f = open(self.path, 'ab')
+        try:
+            self._append_index({"run": run_id, "segment": os.path.basename(self.path), "start": f.tell(),
+                                "started": time.time(), "source": source_dir, "dest": dest_dir})
+            yield _RunWriter(self, f)
+        finally:
+            f.flush()
+            end = f.tell()
+            f.close()
+            self._append_index({"run": run_id, "end": end, "ended": time.time()})
+            with self._lock:
+                self._active -= 1
+
+    def _append_index(self, entry):
+        with open(self.index_path, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                pass
+        return entries
+
+    def runs(self):
+        """
+        Returns:
+            list: One dict per run, oldest first: run, segment, start, end (None while
+                  running), started, ended, source, dest.
+        """
+        runs = {}
+        for entry in self._read_index():
+            if "segment" in entry:
+                runs[entry["run"]] = {"end": None, "ended": None, **entry}
+            elif entry.get("run") in runs:
+                runs[entry["run"]].update(entry)
+        return sorted(runs.values(), key=lambda r: r["run"])
+
+    # --- rotation ---
+
+    def _maybe_rotate(self):
+        """ Rotates when the log is too big or too old, called with the lock held and no run active. """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if st.st_size == 0:
+            return
+        segment = os.path.basename(self.path)
+        first = next((r["started"] for r in self.runs() if r["segment"] == segment), st.st_mtime)
+        if st.st_size >= self.max_bytes or time.time() - first >= self.max_age_days * 86400:
+            self.rotate()
+
+    def rotate(self):
+        """ Renames the log to a dated segment, gzips it and drops the oldest segments. """
+        rotated = rotate_file(self.path)
+
+        current = os.path.basename(self.path)
+        runs = self.runs()
+        for r in runs:
+            if r["segment"] == current:
+                r["segment"] = rotated
+
+        kept = prune_segments(self.path, self.keep)
+
+        tmp = self.index_path + ".tmp"
+        with open(tmp, 'w') as f:
+            for r in runs:
+                if r["segment"] in kept:
+                    f.write(json.dumps(r) + "\n")
+        os.replace(tmp, self.index_path)
+
+    # --- reading ---
+
+    def read_run(self, run_id):
+        """
+        Returns:
+            str: The log text of one run, None if the run is unknown or its segment was removed.
+        """
+        r = next((r for r in self.runs() if r["run"] == run_id), None)
+        if r is None:
+            return None
+        path = os.path.join(os.path.dirname(self.path), r["segment"])
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, 'rb') as f:
+                f.seek(r["start"])
+                data = f.read() if r["end"] is None else f.read(r["end"] - r["start"])
+        except FileNotFoundError:
+            return None
+        return data.decode(errors="replace")
+
+    def tail(self, lines=30):
+        """
+        Returns the last lines of the log as a terminal would show them,
+        reading backwards from the end only as far as needed. Right after a
+        rotation the lines missing from the current log come from the newest
+        rotated segment.
+        """
+        result = self._tail_current(lines)
+        if len(result) < lines:
+            result = self._tail_segment(lines - len(result)) + result
+        return result
+
+    def _tail_segment(self, lines):
+        """ The last lines of the newest rotated segment, streamed through gzip. """
+        directory = os.path.dirname(self.path) or "."
+        segments = sorted(segment_files(self.path), key=lambda name: os.stat(os.path.join(directory, name)).st_mtime_ns)
+        if not segments:
+            return []
+        try:
+            with gzip.open(os.path.join(directory, segments[-1]), 'rb') as f:
+                last = deque(f, maxlen=lines)
+        except (OSError, EOFError):
+            return []
+        result = screen_lines(b"".join(last).decode(errors="replace"))
+        if result and result[-1] == "":
+            result.pop()
+        return result[-lines:]
+
+    def _tail_current(self, lines):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return []
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            data = b""
+            while pos > 0 and data.count(b"\n") <= lines:
+                step = min(65536, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+        text = data.decode(errors="replace")
+        result = screen_lines(text)
+        if result and result[-1] == "":
+            result.pop()
+        if pos > 0:
+            # the first line is probably partial
+            result = result[1:]
+        return result[-lines:]
+
+    def subscribe(self):
+        """
+        Returns:
+            queue.Queue: Receives each piece of text written to the log from now on.
+                         Text is dropped, not waited for, if the queue is full.
+        """
+        q = queue.Queue(SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+
+    def _publish(self, text):
+        for q in list(self._subscribers):
+            try:
+                q.put_nowait(text)
+            except queue.Full:
+                pass
+
+
+@contextmanager
+def open_log(log_file, source_dir="", dest_dir=""):
+    """
+    Opens a sync log for one run: a SyncLog run, or a plain file appended to.
+    """
+    if isinstance(log_file, SyncLog):
+        with log_file.run(source_dir, dest_dir) as log:
+            yield log
+    else:
+        with open(log_file, 'a') as log:
+            yield log
+
+
+def follow(path, lines=30, interval=0.5):
+    """ Prints the end of the log, then what is added to it, across rotations. """
+    for line in SyncLog(path).tail(lines):
+        print(line)
+    f = None
+    inode = None
+    while True:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            time.sleep(interval)
+            continue
+        if f is None or st.st_ino != inode or st.st_size < f.tell():
+            # rotated, start over on the new file
+            if f is not None:
+                sys.stdout.write(f.read().decode(errors="replace"))
+                f.close()
+                f = open(path, 'rb')
+            else:
+                f = open(path, 'rb')
+                f.seek(0, os.SEEK_END)
+            inode = st.st_ino
+        data = f.read()
+        if data:
+            sys.stdout.write(data.decode(errors="replace"))
+            sys.stdout.flush()
+        else:
+            time.sleep(interval)
+
+# Command line:
+#   python sync_log.py tail [-n 30] [-f]
+#   python sync_log.py runs
+#   python sync_log.py show <run>
+if __name__ == "__main__":
+    from backup_config import load_config
+
+    path = load_config("config.json").rsync_log_file
+    command = sys.argv[1] if len(sys.argv) > 1 else "tail"
+    log = SyncLog(path)
+
+    if command == "tail":
+        n = int(sys.argv[sys.argv.index("-n") + 1]) if "-n" in sys.argv else 30
+        if "-f" in sys.argv:
+            try:
+                follow(path, n)
+            except KeyboardInterrupt:
+                pass
+        else:
+            print("\n".join(log.tail(n)))
+    elif command == "runs":
+        for r in log.runs():
+            ended = f"{datetime.fromtimestamp(r['ended']):%H:%M:%S}" if r["ended"] else "running"
+            print(f"{r['run']:>5}  {datetime.fromtimestamp(r['started']):%m-%d-%Y %H:%M:%S} - {ended}  "
+                  f"{r['source']} -> {r['dest']}  [{r['segment']}]")
+    elif command == "show" and len(sys.argv) > 2:
+        text = log.read_run(int(sys.argv[2]))
+        print("\n".join(screen_lines(text)) if text is not None else f"Run {sys.argv[2]} not found.")
+    else:
+        print(f"Usage: {sys.argv[0]} tail [-n 30] [-f] | runs | show <run>")
+        sys.exit(1)
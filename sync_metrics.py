@@ -0,0 +1,422 @@
+import json
+import os
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sync_log import MAX_AGE_DAYS, MAX_BYTES, KEEP_SEGMENTS, prune_segments, rotate_file
+
+"""
+Live sync metrics.
+
+The sync engines report what they are doing as events (plain dicts):
+
+    run_start   engine, source, dest
+    file_start  path
+    progress    path, bytes, percent, rate (bytes/s), eta (s, current file)
+    file_done   path, size, rate, seconds (per file latency), files_done,
+                files_total, files_remaining, eta (s, whole run)
+    run_end     returncode, files, bytes, seconds
+    throttle    seconds, bytes (a backup job held back by the ReplicationThrottle,
+                see throttle.py, reported when the job ends)
+
+DirSync gets them by parsing rsync's --progress output as it streams
+(RsyncProgressParser), NativeSync emits them directly. SyncMetrics appends the
+events to a JSON lines journal (progress events at most once a second per
+destination), rotated like the sync log (see sync_log.py), and keeps per destination metrics in a MetricsRegistry, which
+MetricsServer serves in Prometheus text format:
+
+    "metrics_listen": "127.0.0.1:9184"            curl http://127.0.0.1:9184/metrics
+    "metrics_listen": "unix:/tmp/backup_pics.sock" curl --unix-socket /tmp/backup_pics.sock http://x/metrics
+
+A destination whose backup_sync_last_progress_timestamp_seconds stops moving
+while backup_sync_running is 1 has stalled.
+"""
+
+PROGRESS_JOURNAL_INTERVAL = 1.0
+# upper bounds of the per file copy time histogram, seconds
+FILE_SECONDS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_UNITS = {"": 1, "K": 1e3, "M": 1e6, "G": 1e9, "T": 1e12, "P": 1e15}
+
+# "      1,773,168 100%   12.97MB/s    0:00:00 (xfr#1, to-chk=75/77)", sizes may be 1.77M with -h
+_PROGRESS = re.compile(
+    r"^\s*([\d,.]+)([KMGTP]?)\s+(\d+)%\s+([\d.]+)([kKMGTP]?)B/s\s+(\d+):(\d\d):(\d\d)"
+    r"(?:\s+\((?:xfr|xfer)#(\d+),\s*(?:to|ir)-chk=(\d+)/(\d+)\))?")
+# "sent 1.23M bytes  received 4.56K bytes  789.01K bytes/sec"
+_SUMMARY = re.compile(r"^sent ([\d,.]+)([KMGTP]?) bytes\s+received ([\d,.]+)([KMGTP]?) bytes\s+([\d,.]+)([KMGTP]?) bytes/sec")
+
+_NOT_FILES = ("sending incremental file list", "receiving incremental file list", "building file list",
+              "created directory", "total size is", "deleting ", "rsync:", "rsync error:", "skipping ",
+              "cannot delete", "Error:", "Usage:")
+
+
+def _number(text, unit=""):
+    return float(text.replace(",", "")) * _UNITS.get(unit.upper(), 1)
+
+
+class RsyncProgressParser:
+    """
+    Turns rsync -v --progress output, one line at a time, into sync events.
+    """
+
+    def __init__(self, source_dir, dest_dir, emit):
+        """
+        Initializes the parser.
+
+        Args:
+            source_dir (str): Source of the sync, added to each event.
+            dest_dir (str): Destination of the sync, added to each event.
+            emit (callable): Called with each event dict.
+        """
+        self.source_dir = source_dir
+        self.dest_dir = dest_dir
+        self.emit = emit
+        self.current = None
+        self.file_started = None
+        self.started = time.time()
+        self.files = 0
+        self.bytes = 0
+        self.summary = None
+
+    def _event(self, name, **fields):
+        event = {"ts": round(time.time(), 3), "event": name, "source": self.source_dir, "dest": self.dest_dir}
+        event.update(fields)
+        self.emit(event)
+
+    def start(self):
+        self._event("run_start", engine="rsync")
+
+    def feed(self, line):
+        """ Parses one line of output (split on both \\r and \\n). """
+        line = line.rstrip()
+        if not line:
+            return
+
+        m = _PROGRESS.match(line)
+        if m:
+            self._progress(m)
+            return
+
+        m = _SUMMARY.match(line)
+        if m:
+            self.summary = {"sent": _number(m[1], m[2]), "received": _number(m[3], m[4]),
+                            "rate": _number(m[5], m[6])}
+            return
+
+        if line.endswith("/") or line.startswith(_NOT_FILES) or line.startswith(" "):
+            return
+
+        # anything else with -v is the name of the file about to be transferred
+        self.current = line
+        self.file_started = time.time()
+        self._event("file_start", path=line)
+
+    def _progress(self, m):
+        size = _number(m[1], m[2])
+        percent = int(m[3])
+        rate = _number(m[4], m[5])
+        file_eta = int(m[6]) * 3600 + int(m[7]) * 60 + int(m[8])
+
+        if m[9] is None:
+            self._event("progress", path=self.current, bytes=int(size), percent=percent,
+                        rate=rate, eta=file_eta)
+            return
+
+        # the final line of a file carries the transfer and to-check counts
+        now = time.time()
+        self.files += 1
+        self.bytes += int(size)
+        remaining, total = int(m[10]), int(m[11])
+        seconds = now - self.file_started if self.file_started else 0.0
+        per_file = (now - self.started) / self.files
+        self._event("file_done", path=self.current, size=int(size), rate=rate, seconds=round(seconds, 3),
+                    files_done=int(m[9]), files_total=total, files_remaining=remaining,
+                    eta=round(per_file * remaining, 1))
+        self.current = None
+        self.file_started = None
+
+    def finish(self, returncode):
+        fields = {"returncode": returncode, "files": self.files, "bytes": self.bytes,
+                  "seconds": round(time.time() - self.started, 3)}
+        if self.summary:
+            fields.update(self.summary)
+        self._event("run_end", **fields)
+
+
+class MetricsRegistry:
+    """
+    Thread safe counters, gauges and histograms with labels, rendered in
+    Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}      # name -> (type, help, {label tuple: value})
+        self._buckets = {}      # histogram name -> bucket upper bounds
+
+    def describe(self, name, kind, help_text, buckets=()):
+        with self._lock:
+            self._metrics.setdefault(name, (kind, help_text, {}))
+            if kind == "histogram":
+                self._buckets.setdefault(name, tuple(sorted(buckets)))
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._metrics[name][2][tuple(sorted(labels.items()))] = value
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            values = self._metrics[name][2]
+            key = tuple(sorted(labels.items()))
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """ Adds a value to a histogram. """
+        with self._lock:
+            values = self._metrics[name][2]
+            key = tuple(sorted(labels.items()))
+            # [cumulative count per bucket, sum, count]
+            state = values.setdefault(key, [[0] * len(self._buckets[name]), 0, 0])
+            for i, bound in enumerate(self._buckets[name]):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def get(self, name, **labels):
+        with self._lock:
+            return self._metrics[name][2].get(tuple(sorted(labels.items())))
+
+    def render(self):
+        """ Returns all metrics in the Prometheus text exposition format. """
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, values) in sorted(self._metrics.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(values.items()):
+                    if kind != "histogram":
+                        lines.append(_sample(name, labels, value))
+                        continue
+                    counts, total, count = value
+                    for bound, n in zip(self._buckets[name], counts):
+                        lines.append(_sample(name + "_bucket", labels + (("le", bound),), n))
+                    lines.append(_sample(name + "_bucket", labels + (("le", "+Inf"),), count))
+                    lines.append(_sample(name + "_sum", labels, total))
+                    lines.append(_sample(name + "_count", labels, count))
+        return "\n".join(lines) + "\n"
+
+
+def _sample(name, labels, value):
+    if labels:
+        text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+        return f"{name}{{{text}}} {value}"
+    return f"{name} {value}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+METRICS = [
+    ("backup_sync_running", "gauge", "1 while a sync to the destination is running."),
+    ("backup_sync_runs_total", "counter", "Syncs finished, by result."),
+    ("backup_sync_files_total", "counter", "Files copied."),
+    ("backup_sync_bytes_total", "counter", "Bytes copied."),
+    ("backup_sync_file_seconds", "histogram", "Time spent copying each file."),
+    ("backup_sync_rate_bytes_per_second", "gauge", "Transfer rate last reported."),
+    ("backup_sync_eta_seconds", "gauge", "Estimated time left for the current sync."),
+    ("backup_sync_files_remaining", "gauge", "Files left to check in the current sync."),
+    ("backup_sync_last_progress_timestamp_seconds", "gauge", "Unix time of the last progress seen."),
+    ("backup_sync_last_run_seconds", "gauge", "Duration of the last finished sync."),
+    ("backup_sync_throttled_seconds_total", "counter", "Time backup jobs were held back for ingests."),
+]
+
+
+class SyncMetrics:
+    """
+    Receives sync events, journals them and updates the metrics registry.
+    Pass an instance as the events callback of DirSync or NativeSync.
+    """
+
+    def __init__(self, journal_file=None, registry=None, max_bytes=MAX_BYTES, max_age_days=MAX_AGE_DAYS,
+                 keep=KEEP_SEGMENTS):
+        """
+        Initializes SyncMetrics.
+
+        Args:
+            journal_file (str, optional): JSON lines file events are appended to.
+            registry (MetricsRegistry, optional): Registry to update, a new one if not given.
+            max_bytes (int): Rotate the journal once it is larger than this.
+            max_age_days (float): Rotate the journal once its first event is older than this.
+            keep (int): Number of rotated (gzip'ed) journals to keep.
+        """
+        self.journal_file = journal_file
+        self.registry = registry or MetricsRegistry()
+        for name, kind, help_text in METRICS:
+            self.registry.describe(name, kind, help_text, FILE_SECONDS_BUCKETS)
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._last_progress = {}
+        self._journal_size = None    # bytes in the journal, None until read
+        self._journal_first = None   # ts of its first event
+
+    def __call__(self, event):
+        self.handle(event)
+
+    def handle(self, event):
+        dest = event.get("dest")
+        name = event.get("event")
+        r = self.registry
+        r.set("backup_sync_last_progress_timestamp_seconds", event["ts"], dest=dest)
+
+        if name == "run_start":
+            r.set("backup_sync_running", 1, dest=dest)
+        elif name == "progress":
+            r.set("backup_sync_rate_bytes_per_second", event["rate"], dest=dest)
+        elif name == "file_done":
+            r.inc("backup_sync_files_total", dest=dest)
+            r.inc("backup_sync_bytes_total", event["size"], dest=dest)
+            r.observe("backup_sync_file_seconds", event["seconds"], dest=dest)
+            r.set("backup_sync_rate_bytes_per_second", event["rate"], dest=dest)
+            if event.get("files_remaining") is not None:
+                r.set("backup_sync_files_remaining", event["files_remaining"], dest=dest)
+            if event.get("eta") is not None:
+                r.set("backup_sync_eta_seconds", event["eta"], dest=dest)
+        elif name == "run_end":
+            r.set("backup_sync_running", 0, dest=dest)
+            r.set("backup_sync_eta_seconds", 0, dest=dest)
+            r.set("backup_sync_files_remaining", 0, dest=dest)
+            r.set("backup_sync_last_run_seconds", event["seconds"], dest=dest)
+            r.inc("backup_sync_runs_total", result="ok" if event["returncode"] == 0 else "failed", dest=dest)
+        elif name == "throttle":
+            r.inc("backup_sync_throttled_seconds_total", event["seconds"], dest=dest)
+
+        self._journal(event)
+
+    def _journal(self, event):
+        if not self.journal_file:
+            return
+        with self._lock:
+            if event["event"] == "progress":
+                # rsync reports several times a second, keep the journal small
+                last = self._last_progress.get(event["dest"], 0)
+                if event["ts"] - last < PROGRESS_JOURNAL_INTERVAL:
+                    return
+                self._last_progress[event["dest"]] = event["ts"]
+            line = json.dumps(event) + "\n"
+            try:
+                self._maybe_rotate(event["ts"])
+                with open(self.journal_file, 'a') as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"Error writing sync event to '{self.journal_file}': {e}")
+                self._journal_size = None
+                return
+            self._journal_size += len(line.encode())
+            if self._journal_first is None:
+                self._journal_first = event["ts"]
+
+    def _maybe_rotate(self, now):
+        """ Rotates the journal when it is too big or too old, called with the lock held. """
+        if self._journal_size is None:
+            try:
+                self._journal_size = os.path.getsize(self.journal_file)
+                with open(self.journal_file, 'r') as f:
+                    self._journal_first = json.loads(f.readline()).get("ts")
+            except FileNotFoundError:
+                self._journal_size = 0
+                self._journal_first = None
+            except (ValueError, AttributeError):
+                self._journal_first = None
+        if self._journal_size == 0:
+            return
+        too_old = self._journal_first is not None and now - self._journal_first >= self.max_age_days * 86400
+        if self._journal_size >= self.max_bytes or too_old:
+            rotate_file(self.journal_file)
+            prune_segments(self.journal_file, self.keep)
+            self._journal_size = 0
+            self._journal_first = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep scrapes out of the terminal
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """
+    Serves a MetricsRegistry over HTTP on a localhost port or a Unix socket.
+    """
+
+    def __init__(self, registry, listen):
+        """
+        Initializes the MetricsServer.
+
+        Args:
+            registry (MetricsRegistry): Metrics to serve.
+            listen (str): "host:port" (e.g. "127.0.0.1:9184") or "unix:/path/to/socket".
+        """
+        self.registry = registry
+        self.listen = listen
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        handler = type("MetricsHandler", (_MetricsHandler,), {"registry": self.registry})
+        if self.listen.startswith("unix:"):
+            path = self.listen[len("unix:"):]
+            if os.path.exists(path):
+                os.remove(path)
+            self._server = _UnixHTTPServer(path, handler)
+        else:
+            host, _, port = self.listen.rpartition(":")
+            self._server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"Serving sync metrics on {self.listen}")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        if self.listen.startswith("unix:"):
+            try:
+                os.remove(self.listen[len("unix:"):])
+            except OSError:
+                pass
+        self._server = None
+
+# Example Usage:
+#   python sync_metrics.py < "example rsync output.txt"
+if __name__ == "__main__":
+    import sys
+
+    metrics = SyncMetrics()
+    parser = RsyncProgressParser("source", "dest", lambda e: (print(json.dumps(e)), metrics.handle(e)))
+    parser.start()
+    for line in re.split(r"[\r\n]", sys.stdin.read()):
+        parser.feed(line)
+    parser.finish(0)
+    print(metrics.registry.render())
@@ -0,0 +1,237 @@
+import errno
+import os
+import shutil
+import sys
+
+from native_sync import NativeSync
+
+"""
+Dry-run plans of syncs: what a sync would copy, how long it should take and
+whether it fits on the destination, worked out without starting rsync.
+
+A backup's plan comes from the local index and the drive's catalog (the exact
+delta when the catalog is current, otherwise the files ingested since the drive
+was last synced). A source's plan comes from SourceState's scan, or the full
+listing (SourceState.list_all()) the ingest then copies from, compared with the
+index the way the ingest compares it.
+
+The estimate uses the device's history of sync runs (MediaIndex.run_rates(),
+from the run_end events of past ingests and the whole of past backup sessions,
+verification included; SyncBudget uses the same history): the run takes as long as the slower of
+its bytes at the history's MB/s and its files at the history's files/s, so a
+card of small JPEGs and a drive of videos are both estimated sensibly.
+
+AutoBackup logs the plan when a session starts and does not copy anything if
+the destination does not have room for it. From a shell:
+
+    python sync_plan.py <source or backup volume or description> [--files]
+"""
+
+# bytes kept free on a destination on top of what a sync copies
+FREE_SPACE_MARGIN = 64 * 1024 * 1024
+
+
+class InsufficientSpace(OSError):
+    """
+    The destination of a sync does not have room for what it would copy.
+    """
+
+
+class SyncPlan:
+    """
+    Files a sync would copy, with counts of what it would leave and an estimate of its duration.
+    """
+
+    def __init__(self, source_dir, dest_dir, files=(), excluded=None, up_to_date=None, exact=True):
+        """
+        Initializes the SyncPlan.
+
+        Args:
+            source_dir (str): Source of the sync.
+            dest_dir (str): Destination of the sync.
+            files (iterable): (path, size) of the files to copy.
+            excluded (int, optional): Files and directories left out by the exclude rules, None if not counted.
+            up_to_date (int, optional): Files already on the destination, None if not counted.
+            exact (bool): False when the files are only an estimate of what the sync will find.
+        """
+        self.source_dir = source_dir
+        self.dest_dir = dest_dir
+        self.files = list(files)
+        self.bytes = sum(size for _, size in self.files)
+        self.excluded = excluded
+        self.up_to_date = up_to_date
+        self.exact = exact
+        self.bytes_per_second = None
+        self.files_per_second = None
+        self.runs = 0
+
+    def estimate(self, rates):
+        """
+        Args:
+            rates (tuple): (bytes per second, files per second, runs) from MediaIndex.run_rates(), or None.
+        """
+        if rates is not None:
+            self.bytes_per_second, self.files_per_second, self.runs = rates
+
+    def seconds(self):
+        """ Returns the estimated duration, None without a history. """
+        if not self.files:
+            return 0.0
+        if not self.bytes_per_second or not self.files_per_second:
+            return None
+        return max(self.bytes / self.bytes_per_second, len(self.files) / self.files_per_second)
+
+    def check_space(self, limit=None):
+        """
+        Checks the destination has room for the files, or for limit bytes of them.
+
+        Raises:
+            InsufficientSpace: With the bytes needed and free in the message.
+        """
+        needed = self.bytes if limit is None else min(self.bytes, limit)
+        if not needed:
+            return
+        free = shutil.disk_usage(self.dest_dir).free
+        if needed + FREE_SPACE_MARGIN > free:
+            raise InsufficientSpace(errno.ENOSPC, f"{needed / 1e6:.1f} MB to copy, "
+                                                  f"{free / 1e6:.1f} MB free", self.dest_dir)
+
+    def __str__(self):
+        text = f"{'' if self.exact else 'about '}{len(self.files)} files, {self.bytes / 1e6:.1f} MB to copy"
+        if self.excluded is not None:
+            text += f", {self.excluded} excluded"
+        if self.up_to_date is not None:
+            text += f", {self.up_to_date} up to date"
+        seconds = self.seconds()
+        if seconds is None:
+            return text + ", no history for an estimate"
+        if self.files:
+            seconds = int(seconds)
+            text += (f", about {seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02} at "
+                     f"{self.bytes_per_second / 1e6:.1f} MB/s or {self.files_per_second:.1f} files/s "
+                     f"({self.runs} runs)")
+        return text
+
+    def report(self, out):
+        """ Writes the plan and its files to a file-like object. """
+        out.write(f"{self.source_dir} -> {self.dest_dir}\n{self}\n")
+        for rel_path, size in self.files:
+            out.write(f"  {size:>14,}  {rel_path}\n")
+
+
+def plan_backup(index, dest_dir, matcher, catalog=None, volume=None, compare="size"):
+    """
+    Plans a backup of the local archive to a drive.
+
+    Args:
+        index (MediaIndex): Index of the local archive.
+        dest_dir (str): Backup directory on the drive.
+        matcher (ExcludeMatcher): The backup's exclude rules.
+        catalog (DriveCatalog, optional): The drive's catalog if it is current.
+        volume (str, optional): The backup volume, for files ingested since its last sync.
+        compare (str): The comparison of the drive's filesystem profile (see fs_profile.py).
+
+    Returns:
+        SyncPlan: Exact with a current catalog.
+    """
+    indexed = index.files()
+    excluded = sum(1 for rel_path, _ in indexed if matcher.excluded(rel_path))
+    if catalog is None:
+        files = [(rel_path, size) for rel_path, size in index.new_since_sync(volume)
+                 if not matcher.excluded(rel_path)]
+        return SyncPlan(index.root, dest_dir, files, excluded, exact=False)
+
+    recorded = {v for v, _, _ in index.replica_volumes()}
+    if compare == "hash" and volume in recorded:
+        # what the index does not know to be on the drive, changed files included
+        files = [(rel_path, size) for rel_path, size in index.unreplicated(volume)
+                 if not matcher.excluded(rel_path)]
+    else:
+        files = catalog.delta(indexed, matcher)
+    return SyncPlan(index.root, dest_dir, files, excluded, len(indexed) - excluded - len(files))
+
+
+def plan_source(index, source_dir, matcher, scan=None, dated=False):
+    """
+    Plans an ingest from a source into the local archive.
+
+    Args:
+        index (MediaIndex): Index of the local archive.
+        source_dir (str): Directory on the source that is ingested.
+        matcher (ExcludeMatcher): The source's exclude rules.
+        scan (SourceScan, optional): New files found by SourceState.scan(), or every file from
+                                     SourceState.list_all(); the source is listed without.
+        dated (bool): The archive is in the dated layout, where a file is there if its name and size are.
+
+    Returns:
+        SyncPlan
+    """
+    if scan is not None:
+        source_files = {rel_path: scan.entries[rel_path][0] for rel_path in scan.files}
+        excluded = scan.excluded
+    else:
+        source_files, excluded = NativeSync.scan_source(source_dir, matcher)
+
+    archived = dict(index.files())
+    if dated:
+        names = {(os.path.basename(rel_path), size) for rel_path, size in archived.items()}
+        done = lambda rel_path, size: (os.path.basename(rel_path), size) in names
+    else:
+        done = lambda rel_path, size: archived.get(rel_path) == size
+    files = [(rel_path, size) for rel_path, size in sorted(source_files.items()) if not done(rel_path, size)]
+    return SyncPlan(source_dir, index.root, files, excluded, len(source_files) - len(files))
+
+
+# Example Usage:
+#   python sync_plan.py <source or backup volume or description> [--files]
+if __name__ == "__main__":
+    from backup_config import load_config
+    from drive_catalog import DriveCatalog
+    from exclude_matcher import entry_rules, get_matcher, rules_file
+    from fs_profile import FsProfiles
+    from media_index import MediaIndex
+    from source_state import SourceState
+
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <source or backup volume or description> [--files]")
+        sys.exit(1)
+
+    config = load_config("config.json")
+    local_root = os.path.join(config.local_backup_dir, config.backup_subdir)
+    index = MediaIndex(config.index_db or os.path.join(config.local_backup_dir, "media_index.db"), local_root)
+    entries = [("source", s) for s in config.sources] + [("backup", b) for b in config.backups]
+    kind, entry = next(((k, e) for k, e in entries if sys.argv[1] in (e.volume, e.descr)), (None, None))
+    if entry is None:
+        print(f"No source or backup '{sys.argv[1]}' in config.json.")
+        sys.exit(1)
+
+    matcher = get_matcher(rules_file(config.exclude, entry_rules(entry, config.exclude_rules),
+                                     os.path.join(config.local_backup_dir, ".exclude_rules")))
+    root = os.path.join(entry.volume, entry.directory)
+    try:
+        if kind == "source":
+            if not os.path.isdir(root):
+                print(f"'{root}' is not mounted.")
+                sys.exit(1)
+            state = SourceState(config.source_state_file or os.path.join(config.local_backup_dir, "source_state.json"))
+            plan = plan_source(index, root, matcher, state.scan(entry.volume, root, matcher),
+                               config.archive_layout == "dated")
+        else:
+            dest = os.path.join(root, config.backup_subdir)
+            catalog = DriveCatalog(entry.volume, dest)
+            current = os.path.isdir(dest) and catalog.load()
+            compare = FsProfiles(config.fs_profiles).for_sync(local_root, dest, entry, indexed=True).compare \
+                if os.path.isdir(dest) else "size"
+            plan = plan_backup(index, dest, matcher, catalog if current else None, entry.volume, compare)
+        plan.estimate(index.run_rates(entry.volume))
+        if "--files" in sys.argv:
+            plan.report(sys.stdout)
+        else:
+            print(plan)
+        if os.path.isdir(plan.dest_dir):
+            try:
+                plan.check_space()
+            except InsufficientSpace as e:
+                print(f"Not enough space on '{e.filename}': {e.strerror}.")
+    finally:
+        index.close()
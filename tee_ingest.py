@@ -0,0 +1,160 @@
+import os
+import queue
+import threading
+
+from copy_journal import COMMIT_BYTES
+
+"""
+Tee ingest: one read of a source file, written to the local archive and to
+every attached backup drive.
+
+The native engines (NativeSync, DatedIngest) take a list of mirror roots. The
+file is read once in TEE_CHUNK buffers. Each buffer is written to the local
+copy by the reading thread and handed to a MirrorSink per backup drive. A sink
+writes from its own bounded queue, so a slow HDD can fall at most MAX_LAG
+buffers behind (MAX_LAG * TEE_CHUNK bytes, across file boundaries) before
+reads wait for it. Faster drives and the local copy run ahead up to that limit.
+
+A sink that fails, for example a drive unplugged mid-ingest, is dropped and
+the ingest carries on to the local archive and the other drives.
+"""
+
+TEE_CHUNK = 1024 * 1024
+MAX_LAG = 32
+
+
+class MirrorSink(threading.Thread):
+    """
+    Writes the files of one ingest to a backup drive from a bounded queue of buffers.
+    """
+
+    def __init__(self, root, fsync=True, matcher=None, max_lag=MAX_LAG):
+        """
+        Initializes the MirrorSink.
+
+        Args:
+            root (str): Directory on the backup drive that mirrors the local archive.
+            fsync (bool): fsync each file before it is renamed into place.
+            matcher (ExcludeMatcher, optional): The backup's exclude rules, excluded files are not mirrored.
+            max_lag (int): Buffers queued before the reader has to wait.
+        """
+        super().__init__(name=f"mirror-{root}", daemon=True)
+        self.root = root
+        self.fsync = fsync
+        self.matcher = matcher
+        self.error = None
+        self.written = []    # relative paths completed
+        self.bytes_written = 0
+        self._queue = queue.Queue(max_lag)
+        self._file = None
+        self._tmp = None
+        self._rel_path = self._dst = self._st = None
+
+    def wants(self, rel_path):
+        """ True if rel_path should be written to this mirror. """
+        return self.error is None and not (self.matcher and self.matcher.excluded(rel_path))
+
+    def put(self, item):
+        """ Queues ("open", rel_path, stat) / ("data", bytes) / ("close",) / ("abort",),
+            waiting while the queue is full. Dropped once the sink failed. """
+        if self.error is None:
+            self._queue.put(item)
+
+    def close(self):
+        """ Finishes the queued writes and stops the thread. """
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # keep draining so the reader never blocks on a dead sink
+                continue
+            try:
+                self._handle(item)
+            except OSError as e:
+                self.error = e
+                self._discard()
+        self._discard()
+
+    def _handle(self, item):
+        op = item[0]
+        if op == "open":
+            _, rel_path, st = item
+            dst = os.path.join(self.root, rel_path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            self._tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.partial")
+            self._file = open(self._tmp, 'wb', buffering=0)
+            self._rel_path, self._dst, self._st = rel_path, dst, st
+        elif op == "data":
+            view = memoryview(item[1])
+            while view:
+                view = view[self._file.write(view):]
+            self.bytes_written += len(item[1])
+        elif op == "close":
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            os.utime(self._tmp, ns=(self._st.st_atime_ns, self._st.st_mtime_ns))
+            os.replace(self._tmp, self._dst)
+            self._tmp = None
+            self.written.append(self._rel_path)
+        elif op == "abort":
+            self._discard()
+
+    def _discard(self):
+        """ Drops a partly written file. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._tmp is not None:
+            try:
+                os.remove(self._tmp)
+            except OSError:
+                pass
+            self._tmp = None
+
+
+def tee_data(fsrc, fdst, size, start, checkpoint, sinks, rel_path, st, throttle=None):
+    """
+    Reads fsrc once, writing it to fdst from offset start (the part before
+    start is already there when a copy resumes) and to every sink from 0.
+    throttle(nbytes), if given, is called before each read.
+
+    Returns:
+        int: Bytes in the local copy.
+    """
+    for sink in sinks:
+        sink.put(("open", rel_path, st))
+    try:
+        os.lseek(fdst.fileno(), start, os.SEEK_SET)
+        pos = 0
+        next_commit = start + COMMIT_BYTES if checkpoint is not None else None
+        while True:
+            if throttle is not None:
+                throttle(TEE_CHUNK)
+            data = fsrc.read(TEE_CHUNK)
+            if not data:
+                break
+            for sink in sinks:
+                sink.put(("data", data))
+            end = pos + len(data)
+            if end > start:
+                view = memoryview(data)[max(0, start - pos):]
+                while view:
+                    view = view[fdst.write(view):]
+            pos = end
+            if next_commit is not None and pos >= next_commit and pos < size:
+                checkpoint(fdst, pos)
+                next_commit = pos + COMMIT_BYTES
+    except BaseException:
+        for sink in sinks:
+            sink.put(("abort",))
+        raise
+    for sink in sinks:
+        sink.put(("close",))
+    return max(pos, start)
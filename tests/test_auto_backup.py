@@ -0,0 +1,44 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from auto_backup import AutoBackup
+from backup_config import parse_config
+
+
+@pytest.fixture
+def auto_backup(tmp_path):
+    config = parse_config({
+        "local_backup_dir": str(tmp_path / "local"), "backup_subdir": "bk", "thumbnail_workers": 0,
+        "exclude": os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sync_exclude.txt"),
+        "sources": [], "backups": []})
+    (tmp_path / "local" / "bk").mkdir(parents=True)
+    ab = AutoBackup.from_config(config)
+    yield ab
+    ab.index.close()
+    ab.journal.close()
+
+
+def test_job_status_reads_the_scheduler_on_its_loop(auto_backup):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    readers = []
+    auto_backup.scheduler.active = lambda: readers.append(threading.current_thread()) or ["drive: backup"]
+    auto_backup.scheduler.queued = lambda: ["cam: ingest"]
+    auto_backup._loop = loop
+    try:
+        assert auto_backup.job_status() == (["drive: backup"], ["cam: ingest"])
+        assert readers == [thread]
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    # closed loop
+    assert auto_backup.job_status() is None
+
+
+def test_job_status_without_a_loop(auto_backup):
+    assert auto_backup.job_status() is None
@@ -0,0 +1,69 @@
+import dataclasses
+import typing
+
+import pytest
+
+from backup_config import Backup, BackupConfig, ConfigError, FsProfileSettings, Source, parse_config
+
+REQUIRED = {"local_backup_dir": "/srv/backup", "backup_subdir": "pics"}
+
+
+def config_with(cls, key, value):
+    """ A config.json with key set to value on the config or on its one source, backup or profile. """
+    if cls is BackupConfig:
+        return dict(REQUIRED, **{key: value})
+    entry = {Source: {"volume": "/media/card"}, Backup: {"volume": "/media/drive"},
+             FsProfileSettings: {"name": "usb"}}[cls]
+    section = {Source: "sources", Backup: "backups", FsProfileSettings: "fs_profiles"}[cls]
+    return dict(REQUIRED, **{section: [dict(entry, **{key: value})]})
+
+
+def read_back(config, cls, key):
+    if cls is BackupConfig:
+        return getattr(config, key)
+    section = {Source: "sources", Backup: "backups", FsProfileSettings: "fs_profiles"}[cls]
+    return getattr(getattr(config, section)[0], key)
+
+
+def fields_with(meta):
+    return [pytest.param(cls, f, id=f"{cls.__name__}.{f.name}")
+            for cls in (BackupConfig, Source, Backup, FsProfileSettings)
+            for f in dataclasses.fields(cls) if meta in f.metadata]
+
+
+def is_optional(cls, f):
+    return type(None) in typing.get_args(typing.get_type_hints(cls)[f.name])
+
+
+@pytest.mark.parametrize("cls, f", fields_with("min") + fields_with("choices"))
+def test_null(cls, f):
+    data = config_with(cls, f.name, None)
+    if is_optional(cls, f):
+        assert read_back(parse_config(data), cls, f.name) is None
+    else:
+        with pytest.raises(ConfigError, match=f"{f.name}: expected"):
+            parse_config(data)
+
+
+@pytest.mark.parametrize("cls, f", fields_with("min"))
+def test_below_min(cls, f):
+    minimum = f.metadata["min"]
+    integer = int in (typing.get_type_hints(cls)[f.name], *typing.get_args(typing.get_type_hints(cls)[f.name]))
+    with pytest.raises(ConfigError, match=f"{f.name}: must be at least {minimum}"):
+        parse_config(config_with(cls, f.name, minimum - 1 if integer else minimum - 0.05))
+    assert read_back(parse_config(config_with(cls, f.name, minimum)), cls, f.name) == minimum
+
+
+@pytest.mark.parametrize("cls, f", fields_with("choices"))
+def test_bad_choice(cls, f):
+    with pytest.raises(ConfigError, match=f"{f.name}: 'bogus' is not one of"):
+        parse_config(config_with(cls, f.name, "bogus"))
+    choice = f.metadata["choices"][0]
+    assert read_back(parse_config(config_with(cls, f.name, choice)), cls, f.name) == choice
+
+
+def test_problems_are_reported_together():
+    with pytest.raises(ConfigError) as e:
+        parse_config(dict(REQUIRED, backup_subdirectory="x", log_keep=-1, archive_layout="nested"))
+    assert len(e.value.problems) == 3
+    assert "did you mean 'backup_subdir'?" in e.value.problems[0]
@@ -0,0 +1,40 @@
+import os
+
+from backup_scheduler import BackupScheduler
+
+
+def fake_block_sysfs(root, dev, target):
+    """ Links /sys/dev/block/MAJ:MIN of dev to a directory under devices/. """
+    device = os.path.join(root, "devices", "pci0000:00", "usb1", "block", target)
+    os.makedirs(device)
+    links = os.path.join(root, "dev", "block")
+    os.makedirs(links)
+    os.symlink(device, os.path.join(links, f"{os.major(dev)}:{os.minor(dev)}"))
+    return device
+
+
+def test_partition_is_keyed_by_its_disk(tmp_path):
+    volume = tmp_path / "media" / "BACKUP"
+    volume.mkdir(parents=True)
+    device = fake_block_sysfs(str(tmp_path / "sys"), os.stat(volume).st_dev, "sdb/sdb2")
+    with open(os.path.join(device, "partition"), "w") as f:
+        f.write("2\n")
+    assert BackupScheduler.device_key(str(volume), sysfs_root=str(tmp_path / "sys")) == "disk:sdb"
+
+
+def test_whole_disk_is_keyed_by_its_name(tmp_path):
+    fake_block_sysfs(str(tmp_path / "sys"), os.stat(tmp_path).st_dev, "sdc")
+    assert BackupScheduler.device_key(str(tmp_path), sysfs_root=str(tmp_path / "sys")) == "disk:sdc"
+
+
+def test_no_block_device_falls_back_to_st_dev(tmp_path):
+    assert BackupScheduler.device_key(str(tmp_path), sysfs_root=str(tmp_path / "sys")) == os.stat(tmp_path).st_dev
+
+
+def test_gvfs_mounts_are_keyed_by_host():
+    gvfs = "/run/user/1000/gvfs"
+    pixel = BackupScheduler.device_key(f"{gvfs}/mtp:host=Google_Pixel_8_Pro_42230DLJG0014Y/Internal shared storage")
+    pixel_card = BackupScheduler.device_key(f"{gvfs}/mtp:host=Google_Pixel_8_Pro_42230DLJG0014Y/SD card")
+    camera = BackupScheduler.device_key(f"{gvfs}/gphoto2:host=Canon_EOS_R6,port=usb%3A001%2C007/DCIM")
+    assert pixel == pixel_card == "gvfs:mtp:host=Google_Pixel_8_Pro_42230DLJG0014Y"
+    assert camera == "gvfs:gphoto2:host=Canon_EOS_R6"
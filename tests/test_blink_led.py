@@ -0,0 +1,98 @@
+import os
+import time
+
+import pytest
+
+from blink_led import ACT, PATTERNS, PWR, LedDriver, LedStatus, blink, make_fake_sysfs
+
+
+def brightness(root):
+    """ Returns the raw brightness written to each LED. """
+    values = {}
+    for led in (ACT, PWR):
+        with open(os.path.join(root, led, "brightness")) as f:
+            values[led] = f.read().strip()
+    return values
+
+
+def wait_for(root, expected, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while brightness(root) != expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return brightness(root)
+
+
+# raw sysfs values: ACT is active-low, so "1" is dark
+DARK = {ACT: "1", PWR: "0"}
+GREEN = {ACT: "0", PWR: "0"}
+RED = {ACT: "1", PWR: "1"}
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    return make_fake_sysfs(str(tmp_path / "leds"))
+
+
+@pytest.fixture
+def driver(sysfs):
+    driver = LedDriver(sysfs)
+    driver.start()
+    yield driver
+    driver.stop()
+
+
+def test_every_step_sets_both_leds():
+    for name, pattern in PATTERNS.items():
+        for values, seconds in pattern:
+            assert set(values) == {ACT, PWR}, name
+            assert seconds > 0
+
+
+def test_starts_dark(sysfs):
+    driver = LedDriver(sysfs)
+    assert brightness(sysfs) == DARK
+    driver.stop()
+
+
+def test_off_turns_both_leds_off(sysfs, driver):
+    driver.set_pattern("idle")
+    driver.set_pattern("off")
+    assert wait_for(sysfs, DARK) == DARK
+
+
+@pytest.mark.parametrize("led, lit", [(ACT, GREEN), (PWR, RED)])
+def test_blink_lights_one_led_and_darkens_the_other(sysfs, driver, led, lit):
+    # a long period so the first half is still showing when checked
+    driver.set_pattern(blink(led, 10))
+    assert wait_for(sysfs, lit) == lit
+
+
+def test_switching_from_idle_to_copying_darkens_green(sysfs, driver):
+    driver.set_pattern(blink(ACT, 10))
+    assert wait_for(sysfs, GREEN) == GREEN
+    driver.set_pattern([({PWR: 1}, 10)])
+    assert wait_for(sysfs, RED) == RED
+
+
+def test_stop_leaves_green_lit(sysfs):
+    driver = LedDriver(sysfs)
+    driver.start()
+    driver.set_pattern(blink(PWR, 10))
+    wait_for(sysfs, RED)
+    driver.stop()
+    assert brightness(sysfs) == GREEN
+
+
+def test_status_shows_jobs(sysfs):
+    status = LedStatus(10, 10, sysfs_root=sysfs)
+    status.start()
+    try:
+        assert wait_for(sysfs, GREEN) == GREEN
+        status.job_started()
+        assert wait_for(sysfs, RED) == RED
+        status.job_finished(ok=False)
+        assert status.jobs() == 0
+        # the error pattern starts with a red blink
+        assert wait_for(sysfs, RED) == RED
+    finally:
+        status.stop()
@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+
+import native_sync
+from copy_journal import CopyJournal
+from native_sync import copy_file
+
+
+class Unplugged(Exception):
+    pass
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = CopyJournal(str(tmp_path / "journal.db"))
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "card" / "MVI_0001.MOV"
+    path.parent.mkdir()
+    path.write_bytes(os.urandom(40000))
+    os.utime(path, ns=(1_600_000_000_000_000_000, 1_600_000_000_000_000_000))
+    (tmp_path / "local").mkdir()
+    return str(path)
+
+
+def test_crash_before_rename_is_completed_by_recover(tmp_path, journal, source, monkeypatch):
+    dst = str(tmp_path / "local" / "MVI_0001.MOV")
+
+    def crash(src, dst):
+        raise Unplugged()
+
+    monkeypatch.setattr(native_sync.os, "replace", crash)
+    with pytest.raises(Unplugged):
+        copy_file(source, dst, journal=journal)
+    monkeypatch.undo()
+
+    assert not os.path.exists(dst)
+    [(tmp, _, _, size, committed, _)] = journal.pending()
+    assert committed == size == 40000
+
+    assert journal.recover() == (1, 0, 0)
+    with open(dst, 'rb') as f, open(source, 'rb') as g:
+        assert f.read() == g.read()
+    assert os.stat(dst).st_mtime_ns == os.stat(source).st_mtime_ns
+    assert not os.path.exists(tmp)
+    assert journal.pending() == []
+
+
+def test_unplugged_copy_resumes_from_last_commit(tmp_path, journal, source, monkeypatch):
+    dst = str(tmp_path / "local" / "MVI_0001.MOV")
+    monkeypatch.setattr(native_sync, "COMMIT_BYTES", 10000)
+    monkeypatch.setattr(native_sync, "THROTTLE_CHUNK", 5000)
+    calls = []
+
+    def unplug_midway(nbytes):
+        calls.append(nbytes)
+        if len(calls) > 5:
+            raise Unplugged()
+
+    with pytest.raises(Unplugged):
+        copy_file(source, dst, journal=journal, throttle=unplug_midway)
+    [(_, _, _, _, committed, _)] = journal.pending()
+    assert committed == 20000
+    # not finished and not old, left for the next copy
+    assert journal.recover() == (0, 0, 1)
+
+    resumed = []
+    assert copy_file(source, dst, journal=journal, throttle=resumed.append) == 40000
+    assert sum(resumed) == 20000
+    with open(dst, 'rb') as f, open(source, 'rb') as g:
+        assert f.read() == g.read()
+    assert journal.pending() == []
+
+
+def test_changed_source_starts_over(tmp_path, journal, source):
+    tmp = str(tmp_path / "local" / ".MVI_0001.MOV.partial")
+    dst = str(tmp_path / "local" / "MVI_0001.MOV")
+    with open(tmp, 'wb') as f:
+        f.write(b"x" * 20000)
+    journal.begin(tmp, source, dst, os.stat(source))
+    journal.commit(tmp, 20000)
+
+    os.utime(source)
+    assert journal.begin(tmp, source, dst, os.stat(source)) == 0
+
+
+def test_recover_drops_missing_and_old_temp_files(tmp_path, journal, source):
+    st = os.stat(source)
+    gone = str(tmp_path / "local" / ".gone.partial")
+    journal.begin(gone, source, str(tmp_path / "local" / "gone"), st)
+
+    old = str(tmp_path / "local" / ".old.partial")
+    with open(old, 'wb') as f:
+        f.write(b"x" * 100)
+    journal.begin(old, source, str(tmp_path / "local" / "old"), st)
+    journal._conn.execute("UPDATE inflight SET updated_at = ? WHERE tmp_path = ?", (time.time() - 40 * 86400, old))
+    journal._conn.commit()
+
+    # on a drive that is not attached
+    journal.begin(str(tmp_path / "Seagate" / ".x.partial"), source, str(tmp_path / "Seagate" / "x"), st)
+
+    assert journal.recover() == (0, 2, 1)
+    assert not os.path.exists(old)
+    assert [row[0] for row in journal.pending()] == [str(tmp_path / "Seagate" / ".x.partial")]
@@ -0,0 +1,66 @@
+import queue
+
+from dashboard import SyncProgress
+
+
+def file_done(n, dest="/backup", **extra):
+    return {"event": "file_done", "dest": dest, "path": f"f{n}", "size": 10, "ts": float(n), **extra}
+
+
+def events(items):
+    q = queue.Queue()
+    for item in items:
+        q.put(item)
+    return q
+
+
+def test_drain_trims_the_oldest_tenth_over_max_history():
+    progress = SyncProgress(max_history=100)
+    assert progress.drain(events(file_done(n) for n in range(100))) == 100
+    assert len(progress.history) == 100 and progress.dropped == 0
+
+    progress.drain(events([file_done(100)]))
+
+    assert len(progress.history) == 90
+    assert progress.dropped == 11
+    assert progress.history[0][2] == "f11" and progress.history[-1][2] == "f100"
+    assert progress.dropped + len(progress.history) == 101
+
+
+def test_drain_stops_at_the_limit_and_trims_each_tick():
+    progress = SyncProgress(max_history=10)
+    q = events(file_done(n) for n in range(25))
+
+    assert progress.drain(q, limit=20) == 20
+    assert q.qsize() == 5
+    assert len(progress.history) == 9 and progress.dropped == 11
+    assert progress.drain(q, limit=20) == 5
+    assert progress.drain(q, limit=20) == 0
+    assert [row[2] for row in progress.history] == [f"f{n}" for n in range(16, 25)]
+    assert progress.dropped == 16
+
+
+def test_handle_tracks_a_run_per_destination():
+    progress = SyncProgress()
+    progress.drain(events([
+        {"event": "run_start", "dest": "/a", "source": "/src", "engine": "rsync", "ts": 0.0},
+        {"event": "file_start", "dest": "/a", "path": "x", "ts": 0.5},
+        {"event": "progress", "dest": "/a", "path": "x", "bytes": 50, "ts": 1.0},
+        file_done(2, dest="/a", size=100, files_done=1, files_total=3, eta=8.0),
+        {"event": "run_start", "dest": "/b", "ts": 2.0},
+    ]))
+
+    a, b = progress.dests["/a"], progress.dests["/b"]
+    assert a.running and a.source == "/src" and a.engine == "rsync"
+    assert (a.files_done, a.files_total, a.bytes_done, a.current) == (1, 3, 100, None)
+    assert a.throughput(now=2.0) == 50.0
+    assert a.remaining(now=4.0) == 6.0
+    assert b.running and b.files_done == 0
+
+    progress.handle({"event": "run_end", "dest": "/a", "returncode": 0, "ts": 3.0})
+    assert not a.running and a.returncode == 0
+    assert a.throughput() == 0.0 and a.remaining() is None
+    assert len(progress.history) == 1
+
+    progress.handle({"event": "run_start", "dest": "/a", "ts": 4.0})
+    assert a.files_done == 0 and a.bytes_done == 0 and a.returncode is None
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from delete_copied import SourceCleaner, delete_files
+from media_index import MediaIndex
+from verify import Verifier
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """ A source with three files, two of them ingested into an indexed local archive. """
+    source = tmp_path / "card"
+    local = tmp_path / "local"
+    for name, data in (("a.jpg", b"aaaa"), ("b.jpg", b"bbbbbb"), ("c.jpg", b"cc")):
+        write(str(source / "DCIM" / name), data)
+    for name in ("a.jpg", "b.jpg"):
+        write(str(local / "DCIM" / name), (source / "DCIM" / name).read_bytes())
+    index = MediaIndex(str(tmp_path / "index.db"), str(local))
+    index.add_files(["DCIM/a.jpg", "DCIM/b.jpg"])
+    yield index, str(source), str(local)
+    index.close()
+
+
+def test_only_copies_that_hash_the_same_are_deleted(archive):
+    index, source, local = archive
+    write(os.path.join(local, "DCIM", "b.jpg"), b"BBBBBB")
+
+    plan = SourceCleaner(index, Verifier(index)).plan(source)
+
+    assert plan.delete == [("DCIM/a.jpg", "DCIM/a.jpg")]
+    assert plan.missing == ["DCIM/c.jpg"]
+    assert [rel_path for rel_path, _ in plan.mismatched] == ["DCIM/b.jpg"]
+    assert plan.bytes == 4
+
+
+def test_copies_need_replicas_on_enough_backup_drives(archive):
+    index, source, _ = archive
+    index.add_replicas("/media/pi/One", ["DCIM/a.jpg", "DCIM/b.jpg"])
+    index.add_replicas("/media/pi/Two", ["DCIM/a.jpg"])
+    # a drive that is no longer configured does not count
+    index.add_replicas("/media/pi/Old", ["DCIM/b.jpg"])
+    # a later sync of a drive says nothing about files it does not hold
+    index.mark_synced("/media/pi/Two", 4102444800)
+
+    plan = SourceCleaner(index, Verifier(index), 2, ["/media/pi/One", "/media/pi/Two"]).plan(source)
+
+    assert plan.delete == [("DCIM/a.jpg", "DCIM/a.jpg")]
+    assert plan.unbacked == [("DCIM/b.jpg", 1)]
+
+
+def test_rewritten_file_loses_its_replicas(archive):
+    index, source, local = archive
+    index.add_replicas("/media/pi/One", ["DCIM/a.jpg"])
+    path = os.path.join(local, "DCIM", "a.jpg")
+    st = os.stat(path)
+    # same size, so the source file still finds it as its copy
+    write(path, b"aaaa")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    index.add_files(["DCIM/a.jpg"])
+    assert index.replicas("DCIM/a.jpg") == set()
+
+    plan = SourceCleaner(index, Verifier(index), 1, ["/media/pi/One"]).plan(source)
+
+    assert plan.delete == []
+    assert plan.unbacked == [("DCIM/a.jpg", 0), ("DCIM/b.jpg", 0)]
+
+
+def test_dry_run_deletes_nothing(archive):
+    index, source, _ = archive
+    cleaner = SourceCleaner(index, Verifier(index))
+    plan = cleaner.plan(source)
+
+    assert cleaner.run(plan, dry_run=True) == ([], [])
+    assert os.path.exists(os.path.join(source, "DCIM", "a.jpg"))
+
+    deleted, errors = cleaner.run(plan)
+    assert deleted == ["DCIM/a.jpg", "DCIM/b.jpg"]
+    assert errors == []
+    assert sorted(os.listdir(os.path.join(source, "DCIM"))) == ["c.jpg"]
+
+
+def test_delete_files_reports_errors(tmp_path):
+    write(str(tmp_path / "a" / "x.jpg"), b"x")
+    deleted, errors = delete_files(str(tmp_path), ["a/x.jpg", "a/gone.jpg"], use_gio=False)
+    assert deleted == ["a/x.jpg"]
+    assert [rel_path for rel_path, _ in errors] == ["a/gone.jpg"]
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from drive_catalog import CATALOG_NAME, DriveCatalog
+from exclude_matcher import ExcludeMatcher
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b"x" * size)
+
+
+def bump_mtime(path):
+    """ Moves a directory's mtime on, as a change made in the same clock tick might not. """
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def drive(tmp_path):
+    backup_dir = tmp_path / "bk"
+    write(str(backup_dir / "2024" / "P1.JPG"), 100)
+    write(str(backup_dir / "2024" / "P2.JPG"), 200)
+    write(str(backup_dir / "2024" / ".P3.JPG.partial"), 50)
+    catalog = DriveCatalog(str(tmp_path), str(backup_dir))
+    catalog.rebuild()
+    catalog.save()
+    return str(tmp_path), str(backup_dir)
+
+
+def test_saved_catalog_is_current(drive):
+    catalog = DriveCatalog(*drive)
+    assert catalog.load()
+    assert catalog.files == {"2024/P1.JPG": 100, "2024/P2.JPG": 200}
+    assert catalog.generation == 1
+
+
+def test_change_outside_a_sync_makes_it_stale(drive):
+    volume, backup_dir = drive
+    os.remove(os.path.join(backup_dir, "2024", "P2.JPG"))
+    bump_mtime(os.path.join(backup_dir, "2024"))
+    assert not DriveCatalog(volume, backup_dir).load()
+
+
+def test_removed_directory_makes_it_stale(drive):
+    volume, backup_dir = drive
+    for name in os.listdir(os.path.join(backup_dir, "2024")):
+        os.remove(os.path.join(backup_dir, "2024", name))
+    os.rmdir(os.path.join(backup_dir, "2024"))
+    assert not DriveCatalog(volume, backup_dir).load()
+
+
+def test_stale_flag_is_kept_until_rebuilt(drive):
+    catalog = DriveCatalog(*drive)
+    catalog.load()
+    catalog.stale = True
+    catalog.save()
+    catalog = DriveCatalog(*drive)
+    assert not catalog.load() and catalog.stale
+    catalog.rebuild()
+    catalog.save()
+    assert DriveCatalog(*drive).load()
+
+
+def test_catalog_of_another_directory_or_corrupt_is_not_trusted(drive, tmp_path):
+    volume, backup_dir = drive
+    os.makedirs(os.path.join(volume, "other"))
+    assert not DriveCatalog(volume, os.path.join(volume, "other")).load()
+    with open(os.path.join(volume, CATALOG_NAME), 'wb') as f:
+        f.write(b"not gzip")
+    assert not DriveCatalog(volume, backup_dir).load()
+
+
+def test_update_after_copying_keeps_it_current(drive):
+    volume, backup_dir = drive
+    catalog = DriveCatalog(volume, backup_dir)
+    catalog.load()
+    write(os.path.join(backup_dir, "2025", "01", "P4.JPG"), 400)
+    bump_mtime(backup_dir)
+    catalog.update(["2025/01/P4.JPG"])
+    catalog.save()
+
+    catalog = DriveCatalog(volume, backup_dir)
+    assert catalog.load()
+    assert catalog.files["2025/01/P4.JPG"] == 400
+    assert {"", "2025", "2025/01"} <= set(catalog.dirs)
+
+
+def test_delta_lists_missing_and_resized_files(drive):
+    catalog = DriveCatalog(*drive)
+    catalog.load()
+    local = [("2024/P1.JPG", 100), ("2024/P2.JPG", 250), ("2024/P5.JPG", 10), ("2024/P6.AAE", 10)]
+    assert catalog.delta(local) == [("2024/P2.JPG", 250), ("2024/P5.JPG", 10), ("2024/P6.AAE", 10)]
+    assert catalog.delta(local, ExcludeMatcher(["*.AAE"])) == [("2024/P2.JPG", 250), ("2024/P5.JPG", 10)]
@@ -0,0 +1,46 @@
+from exclude_matcher import ExcludeMatcher, get_matcher
+
+
+def test_plain_names_and_globs():
+    matcher = ExcludeMatcher(["P5190001.JPG", "*.AAE", "._*"])
+    assert matcher.excluded("DCIM/100OMSYS/P5190001.JPG")
+    assert matcher.excluded("DCIM/IMG_0001.AAE")
+    assert matcher.excluded("._IMG_0001.HEIC")
+    assert not matcher.excluded("DCIM/IMG_0001.HEIC")
+
+
+def test_files_below_an_excluded_directory_are_excluded():
+    matcher = ExcludeMatcher([".thumbnails/", "/DCIM/tmp/", "cache"])
+    assert matcher.excluded("DCIM/.thumbnails/1234.jpg")
+    assert matcher.excluded("DCIM/.thumbnails/large/1234.jpg")
+    assert matcher.excluded("DCIM/tmp/IMG_0001.JPG")
+    assert matcher.excluded("Pictures/cache/a/b.jpg")
+    # anchored at the root only
+    assert not matcher.excluded("Backup/DCIM/tmp/IMG_0001.JPG")
+    # a trailing "/" only matches directories
+    assert not matcher.excluded("DCIM/.thumbnails")
+    assert matcher.excluded("DCIM/.thumbnails", True)
+
+
+def test_walkers_can_skip_the_parent_check():
+    matcher = ExcludeMatcher([".thumbnails/"])
+    assert not matcher.excluded("DCIM/.thumbnails/1234.jpg", parents=False)
+    assert matcher.filter(["DCIM/.thumbnails/1234.jpg", "DCIM/IMG_0001.JPG"]) == ["DCIM/IMG_0001.JPG"]
+
+
+def test_first_matching_rule_decides():
+    matcher = ExcludeMatcher(["+ keep.AAE", "- *.AAE", "+ DCIM/keep/", "- DCIM/*/"])
+    assert not matcher.excluded("DCIM/keep.AAE")
+    assert matcher.excluded("DCIM/other.AAE")
+    assert not matcher.excluded("DCIM/keep/IMG_0001.JPG")
+    assert matcher.excluded("DCIM/100OMSYS/P1.JPG")
+
+
+def test_get_matcher_recompiles_when_the_file_changes(tmp_path):
+    rules = tmp_path / "exclude.txt"
+    rules.write_text("# comment\n*.AAE\n")
+    first = get_matcher(str(rules))
+    assert get_matcher(str(rules)) is first
+    rules.write_text("# comment\n*.AAE\n*.THM\n")
+    second = get_matcher(str(rules))
+    assert second is not first and second.excluded("A/IMG.THM")
@@ -0,0 +1,102 @@
+import os
+import stat
+
+import pytest
+
+from backup_config import Backup, FsProfileSettings
+from dir_sync import DirSync
+from fs_profile import FsProfiles
+
+MOUNTS = {"/": "ext4", "/media/pi/FAT": "vfat", "/media/pi/EXFAT": "exfat", "/media/pi/NAS": "cifs",
+          "/run/user/1000/gvfs": "fuse.gvfsd-fuse"}
+LOCAL = "/srv/backup/pics"
+PHONE = "/run/user/1000/gvfs/mtp:host=Pixel/Internal shared storage/DCIM"
+
+
+def test_destination_profile_by_filesystem():
+    profiles = FsProfiles(mounts=MOUNTS)
+    assert profiles.for_sync(LOCAL, "/media/pi/FAT/pics").name == "fat"
+    assert profiles.for_sync(LOCAL, "/srv/other").name == "posix"
+    assert profiles.for_sync(LOCAL, "/media/pi/NAS/pics").name == "default"
+
+
+def test_config_profile_takes_a_filesystem_over():
+    overrides = [FsProfileSettings(name="nas", fs_types=("cifs", "vfat"), compare="mtime", modify_window=3,
+                                   rsync_options=("--inplace",)),
+                 FsProfileSettings(name="exfat", compare="mtime")]
+    profiles = FsProfiles(overrides, mounts=MOUNTS)
+    nas = profiles.for_sync(LOCAL, "/media/pi/NAS/pics")
+    assert (nas.name, nas.compare, nas.modify_window, nas.rsync_options) == ("nas", "mtime", 3, ("--inplace",))
+    assert profiles.for_sync(LOCAL, "/media/pi/FAT/pics").name == "nas"
+    # a changed built-in profile keeps what was not changed
+    exfat = profiles.for_sync(LOCAL, "/media/pi/EXFAT/pics", indexed=True)
+    assert (exfat.name, exfat.compare, exfat.rsync_options) == ("exfat", "mtime", ("--whole-file", "--no-owner",
+                                                                                    "--no-group"))
+
+
+def test_entry_pins_a_profile():
+    profiles = FsProfiles(mounts=MOUNTS)
+    pinned = Backup(volume="/media/pi/NAS", fs_profile="ntfs")
+    assert profiles.for_sync(LOCAL, "/media/pi/NAS/pics", pinned).name == "ntfs"
+    # unknown names fall back to detection
+    unknown = Backup(volume="/media/pi/FAT", fs_profile="zfs")
+    assert profiles.for_sync(LOCAL, "/media/pi/FAT/pics", unknown).name == "fat"
+
+
+def test_hash_falls_back_to_size_when_not_indexed_or_from_mtp():
+    profiles = FsProfiles(mounts=MOUNTS)
+    assert profiles.for_sync(LOCAL, "/media/pi/EXFAT/pics", indexed=True).compare == "hash"
+    assert profiles.for_sync(LOCAL, "/media/pi/EXFAT/pics").compare == "size"
+    assert profiles.for_sync(PHONE, "/media/pi/EXFAT/pics", indexed=True).compare == "size"
+    # the phone's times can not be trusted, even for a posix destination
+    assert profiles.for_sync(PHONE, LOCAL).compare == "size"
+
+
+def test_modify_window_is_the_wider_of_source_and_destination():
+    profiles = FsProfiles([FsProfileSettings(name="posix", modify_window=1)], mounts=MOUNTS)
+    assert profiles.for_sync("/media/pi/FAT/DCIM", LOCAL).modify_window == 2
+    assert profiles.for_sync(LOCAL, "/media/pi/FAT/pics").modify_window == 2
+    assert profiles.for_sync(LOCAL, "/srv/other").modify_window == 1
+
+
+def test_rsync_args_and_recopy():
+    profiles = FsProfiles(mounts=MOUNTS)
+    fat = profiles.for_sync(LOCAL, "/media/pi/FAT/pics")
+    assert fat.rsync_args() == ["--modify-window=2", "--whole-file", "--no-owner", "--no-group"]
+    exfat = profiles.for_sync(LOCAL, "/media/pi/EXFAT/pics", indexed=True)
+    assert exfat.rsync_args()[0] == "--size-only"
+    assert exfat.rsync_args(listed=True)[0] == "--ignore-times"
+    assert exfat.recopy(listed=True) and not exfat.recopy()
+    assert not fat.recopy(listed=True)
+    assert profiles.for_sync(LOCAL, "/media/pi/NAS/pics").rsync_args() == ["--size-only"]
+
+
+@pytest.fixture
+def fake_rsync(tmp_path, monkeypatch):
+    """ An rsync on PATH that records its arguments, one per line. """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    args = tmp_path / "rsync_args.txt"
+    script = bin_dir / "rsync"
+    script.write_text(f'#!/bin/bash\nprintf "%s\\n" "$@" > "{args}"\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return args
+
+
+def test_profile_options_reach_rsync(tmp_path, fake_rsync):
+    for d in ("src", "dst"):
+        (tmp_path / d).mkdir()
+    exclude = tmp_path / "exclude.txt"
+    exclude.write_text("*.AAE\n")
+    fat = FsProfiles(mounts=MOUNTS).for_sync(LOCAL, "/media/pi/FAT/pics")
+    sync = DirSync(log_file=str(tmp_path / "rsync_log.txt"))
+
+    sync.run_sync(str(tmp_path / "src"), str(tmp_path / "dst"), str(exclude), options=fat.rsync_args())
+    args = fake_rsync.read_text().splitlines()
+    assert args[:6] == ["-ahv", "--modify-window=2", "--whole-file", "--no-owner", "--no-group", "--no-perms"]
+    assert f"--exclude-from={exclude}" in args
+
+    # without options the script keeps its old --size-only
+    sync.run_sync(str(tmp_path / "src"), str(tmp_path / "dst"), str(exclude))
+    assert fake_rsync.read_text().splitlines()[:3] == ["-ahv", "--size-only", "--no-perms"]
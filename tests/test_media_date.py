@@ -0,0 +1,97 @@
+import os
+import struct
+from datetime import datetime
+
+import pytest
+
+from media_date import capture_date, exif_thumbnail, _QT_EPOCH_OFFSET
+
+DATE = datetime(2023, 5, 19, 10, 11, 12)
+MTIME = datetime(2001, 2, 3, 4, 5, 6)
+
+
+def tiff(date=b"2023:05:19 10:11:12\x00"):
+    """ Little-endian TIFF with an IFD0 holding only DateTime. """
+    ifd = struct.pack("<H", 1) + struct.pack("<HHII", 0x0132, 2, len(date), 26) + struct.pack("<I", 0)
+    return b"II*\x00" + struct.pack("<I", 8) + ifd + date
+
+
+def jpeg():
+    exif = b"Exif\x00\x00" + tiff()
+    return b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif + b"\xff\xda\x00\x02"
+
+
+def box(typ, payload):
+    return struct.pack(">I", len(payload) + 8) + typ + payload
+
+
+def movie(created):
+    mvhd = box(b"mvhd", b"\x00\x00\x00\x00" + struct.pack(">II", created, created) + bytes(88))
+    return box(b"ftyp", b"qt  \x00\x00\x00\x00") + box(b"moov", mvhd)
+
+
+def heic(sizes=0x44):
+    """ HEIC whose Exif item is located by an iloc with the given offset/length size byte. """
+    infe = box(b"infe", b"\x02\x00\x00\x00" + struct.pack(">HH", 1, 0) + b"Exif")
+    iinf = box(b"iinf", b"\x00\x00\x00\x00" + struct.pack(">H", 1) + infe)
+    exif = struct.pack(">I", 6) + b"Exif\x00\x00" + tiff()
+    ftyp = box(b"ftyp", b"heic\x00\x00\x00\x00")
+
+    def with_offset(offset):
+        iloc = box(b"iloc", b"\x00\x00\x00\x00" + bytes([sizes, 0x00]) + struct.pack(">H", 1) +
+                   struct.pack(">HHH", 1, 0, 1) + struct.pack(">II", offset, len(exif)))
+        return ftyp + box(b"meta", b"\x00\x00\x00\x00" + iinf + iloc)
+
+    head = with_offset(0)
+    return with_offset(len(head) + 8) + box(b"mdat", exif)
+
+
+def write(tmp_path, name, data):
+    path = str(tmp_path / name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(path, (MTIME.timestamp(), MTIME.timestamp()))
+    return path
+
+
+@pytest.mark.parametrize("name, data", [
+    ("P5190001.JPG", jpeg()),
+    ("P5190001.ORF", tiff()),
+    ("IMG_0001.HEIC", heic()),
+    ("no_extension", jpeg()),
+], ids=lambda value: value if isinstance(value, str) else "")
+def test_reads_date_from_header(tmp_path, name, data):
+    assert capture_date(write(tmp_path, name, data)) == DATE
+
+
+def test_reads_movie_creation_time(tmp_path):
+    created = int(DATE.timestamp()) + _QT_EPOCH_OFFSET
+    assert capture_date(write(tmp_path, "MVI_0001.MOV", movie(created))) == DATE
+
+
+@pytest.mark.parametrize("name, data", [
+    # mvhd cut off right after its box header
+    ("MVI_0001.MOV", movie(int(DATE.timestamp()) + _QT_EPOCH_OFFSET)[:40]),
+    # moov claims more than the file holds
+    ("MVI_0002.MP4", box(b"ftyp", b"isom\x00\x00\x00\x00") + struct.pack(">I", 1000) + b"moov" + b"\x00\x00"),
+    # iloc offset_size 1 is not a valid field size
+    ("IMG_0001.HEIC", heic(sizes=0x14)),
+    # iloc cut off in the middle of an item
+    ("IMG_0002.HEIC", heic()[:90]),
+    # EXIF segment shorter than its IFD
+    ("P5190001.JPG", jpeg()[:30]),
+    ("P5190002.JPG", b""),
+    ("P5190001.ORF", tiff(b"not a date at all\x00\x00\x00")),
+], ids=lambda value: value if isinstance(value, str) else "")
+def test_malformed_header_falls_back_to_mtime(tmp_path, name, data):
+    path = write(tmp_path, name, data)
+    assert capture_date(path) == MTIME
+    assert capture_date(path, fallback=False) is None
+
+
+def test_missing_file(tmp_path):
+    assert capture_date(str(tmp_path / "gone.jpg")) is None
+
+
+def test_thumbnail_of_malformed_jpeg_is_none(tmp_path):
+    assert exif_thumbnail(write(tmp_path, "P5190001.JPG", jpeg()[:30])) is None
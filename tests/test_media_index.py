@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from media_index import MediaIndex
+
+
+def write(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@pytest.fixture
+def index(tmp_path):
+    root = tmp_path / "local"
+    write(str(root / "2023" / "a.jpg"), b"aaaa")
+    write(str(root / "2023" / "b.jpg"), b"bb")
+    write(str(root / "top.jpg"), b"t")
+    index = MediaIndex(str(tmp_path / "index.db"), str(root))
+    assert index.reconcile() == (3, 0, 0)
+    yield index
+    index.close()
+
+
+def test_reconcile_finds_added_removed_and_changed_files(index):
+    root = index.root
+    write(os.path.join(root, "2023", "a.jpg"), b"aaaaaaaa")
+    os.remove(os.path.join(root, "2023", "b.jpg"))
+    write(os.path.join(root, "2024", "05", "c.jpg"), b"c")
+
+    assert index.reconcile() == (1, 1, 1)
+    assert sorted(index.files()) == [("2023/a.jpg", 8), ("2024/05/c.jpg", 1), ("top.jpg", 1)]
+    assert index.reconcile() == (0, 0, 0)
+
+
+def test_reconcile_drops_removed_directory(index):
+    for name in ("a.jpg", "b.jpg"):
+        os.remove(os.path.join(index.root, "2023", name))
+    os.rmdir(os.path.join(index.root, "2023"))
+
+    assert index.reconcile() == (0, 2, 0)
+    assert index.files() == [("top.jpg", 1)]
+
+
+def test_reconcile_lists_directories_without_the_lock(index, monkeypatch):
+    write(os.path.join(index.root, "2023", "d.jpg"))
+    list_dir = index._list_dir
+    held = []
+
+    def check_lock(rel_dir):
+        held.append(index._lock.locked())
+        return list_dir(rel_dir)
+
+    monkeypatch.setattr(index, "_list_dir", check_lock)
+    assert index.reconcile() == (1, 0, 0)
+    assert held == [False]
+
+
+def test_files_ingested_during_the_walk_are_kept(index):
+    listing = index._list_dir("2023")
+    # an ingest lands a file after the directory was listed
+    write(os.path.join(index.root, "2023", "new.jpg"), b"nn")
+    index.add_files(["2023/new.jpg"])
+
+    with index._lock, index._conn:
+        assert index._apply_listing("2023", listing) == (0, 0, 0)
+    assert index.get("2023/new.jpg")[0] == 2
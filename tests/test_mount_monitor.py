@@ -0,0 +1,77 @@
+import os
+import queue
+import time
+
+import pytest
+
+import mount_monitor
+from file_watcher import FileWatcher
+from mount_monitor import MountMonitor
+
+
+@pytest.fixture
+def monitor(tmp_path, monkeypatch):
+    """ A MountMonitor for tmp/media/CARD/DCIM that records ready volumes and listings of the volume. """
+    (tmp_path / "media").mkdir()
+    watcher = FileWatcher(str(tmp_path / "media" / "CARD"), "DCIM")
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(mount_monitor.os, "scandir", lambda path=".": listed.append(path) or scandir(path))
+    ready = queue.Queue()
+    monitor = MountMonitor([watcher], on_ready=ready.put, settle_seconds=0.3, settle_timeout=5)
+    monitor.start()
+    yield monitor, watcher, ready, listed
+    monitor.stop()
+    monitor.join()
+
+
+def test_volume_is_ready_after_a_quiet_period(monitor):
+    monitor, watcher, ready, listed = monitor
+    started = time.monotonic()
+    os.makedirs(watcher.file_path)
+    assert ready.get(timeout=3) is watcher
+    assert time.monotonic() - started >= 0.3
+    assert listed == []
+    with pytest.raises(queue.Empty):
+        ready.get(timeout=0.5)
+
+
+def test_mount_events_postpone_settling(monitor):
+    monitor, watcher, ready, listed = monitor
+    os.makedirs(watcher.file_path)
+    started = time.monotonic()
+    for i in range(4):
+        time.sleep(0.15)
+        os.mkdir(os.path.join(os.path.dirname(watcher.volume), f"OTHER{i}"))
+    assert ready.get(timeout=3) is watcher
+    assert time.monotonic() - started >= 0.6 + 0.3
+
+
+def test_directory_appearing_later_is_picked_up(monitor):
+    monitor, watcher, ready, listed = monitor
+    # a phone that has not allowed file transfer yet
+    os.makedirs(watcher.volume)
+    time.sleep(0.5)
+    assert ready.empty()
+    os.mkdir(watcher.file_path)
+    assert ready.get(timeout=3) is watcher
+    assert listed == []
+
+
+def test_stop_and_set_watchers_after_the_thread_exited(tmp_path):
+    watcher = FileWatcher(str(tmp_path / "CARD"), "DCIM")
+    monitor = MountMonitor([watcher], on_ready=lambda w: None)
+    monitor.start()
+    monitor.stop()
+    monitor.join()
+    # the closed pipe's descriptors are likely reused by the next pipe
+    r, w = os.pipe()
+    os.set_blocking(r, False)
+    try:
+        monitor.stop()
+        monitor.set_watchers([watcher])
+        with pytest.raises(BlockingIOError):
+            os.read(r, 10)
+    finally:
+        os.close(r)
+        os.close(w)
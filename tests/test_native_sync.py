@@ -0,0 +1,83 @@
+import os
+import shutil
+
+import pytest
+
+from native_sync import NativeSync
+
+
+def write(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    source = tmp_path / "card"
+    dest = tmp_path / "local"
+    write(str(source / "100OMSYS" / "P1.JPG"), b"one")
+    write(str(source / "100OMSYS" / "P2.JPG"), b"two!")
+    write(str(source / "101OMSYS" / "P3.JPG"), b"three")
+    dest.mkdir()
+    return str(source), str(dest)
+
+
+@pytest.fixture
+def sync(tmp_path):
+    return NativeSync(log_file=str(tmp_path / "sync_log.txt"), fsync=False)
+
+
+def test_second_run_copies_nothing(dirs, sync):
+    source, dest = dirs
+    assert sorted(sync.run_sync(source, dest).copied) == ["100OMSYS/P1.JPG", "100OMSYS/P2.JPG", "101OMSYS/P3.JPG"]
+    result = sync.run_sync(source, dest)
+    assert result.copied == []
+    assert result.skipped == 3
+
+
+def test_manifest_follows_changes_made_outside(dirs, sync):
+    source, dest = dirs
+    sync.run_sync(source, dest)
+
+    os.remove(os.path.join(dest, "100OMSYS", "P1.JPG"))
+    shutil.rmtree(os.path.join(dest, "101OMSYS"))
+    write(os.path.join(dest, "200OMSYS", "X.JPG"))
+
+    manifest = sync.load_manifest(dest)
+    assert manifest == sync.build_manifest(dest)
+    assert manifest["files"] == {"100OMSYS/P2.JPG": 4, "200OMSYS/X.JPG": 1}
+    assert sorted(sync.run_sync(source, dest).copied) == ["100OMSYS/P1.JPG", "101OMSYS/P3.JPG"]
+
+
+def test_file_rewritten_in_place_is_copied_again(dirs, sync):
+    source, dest = dirs
+    sync.run_sync(source, dest)
+
+    rel_dir = os.path.join(dest, "100OMSYS")
+    st = os.stat(rel_dir)
+    # truncated in place: the directory's mtime does not change
+    with open(os.path.join(rel_dir, "P2.JPG"), 'r+b') as f:
+        f.truncate(1)
+    os.utime(rel_dir, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert sync.load_manifest(dest)["files"]["100OMSYS/P2.JPG"] == 4
+
+    assert sync.run_sync(source, dest).copied == ["100OMSYS/P2.JPG"]
+    with open(os.path.join(rel_dir, "P2.JPG"), 'rb') as f:
+        assert f.read() == b"two!"
+    assert sync.run_sync(source, dest).copied == []
+
+
+def test_changed_source_size_is_copied(dirs, sync):
+    source, dest = dirs
+    sync.run_sync(source, dest)
+    write(os.path.join(source, "101OMSYS", "P3.JPG"), b"three, longer")
+    assert sync.run_sync(source, dest).copied == ["101OMSYS/P3.JPG"]
+
+
+def test_listed_files_keep_their_order(dirs, sync):
+    source, dest = dirs
+    files = ["101OMSYS/P3.JPG", "100OMSYS/P1.JPG"]
+    assert sync.run_sync(source, dest, files=files).copied == files
+    assert sync.run_sync(source, dest, files=files).copied == []
+    assert sync.run_sync(source, dest, files=files, recopy=True).copied == files
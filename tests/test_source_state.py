@@ -0,0 +1,113 @@
+import os
+
+import source_state
+from exclude_matcher import ExcludeMatcher
+from source_state import SourceState
+
+
+def write(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def keep_mtime(path):
+    """ Returns a function restoring path's mtime, like camera firmware that does not update it. """
+    st = os.stat(path)
+    return lambda: os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def test_new_file_in_directory_with_unchanged_mtime_is_found(tmp_path):
+    card = tmp_path / "card"
+    write(str(card / "100OMSYS" / "P5190001.JPG"))
+    state = SourceState(str(tmp_path / "state.json"))
+    state.record_full("card", str(card))
+
+    restore = keep_mtime(str(card / "100OMSYS"))
+    write(str(card / "100OMSYS" / "P5190002.JPG"))
+    restore()
+
+    scan = state.scan("card", str(card))
+    assert scan is not None
+    assert scan.files == ["100OMSYS/P5190002.JPG"]
+
+
+def test_unchanged_parent_directory_is_not_listed(tmp_path):
+    card = tmp_path / "card"
+    write(str(card / "DCIM" / "100OMSYS" / "P5190001.JPG"))
+    state = SourceState(str(tmp_path / "state.json"))
+    state.record_full("card", str(card))
+
+    scan = state.scan("card", str(card))
+    assert scan.files == []
+    # "" and DCIM hold no files and are skipped, 100OMSYS is always listed
+    assert scan.listed == 1
+    assert scan.skipped == 2
+
+
+def test_name_below_high_water_mark_asks_for_full_listing(tmp_path):
+    card = tmp_path / "card"
+    write(str(card / "100OMSYS" / "P5190005.JPG"))
+    state = SourceState(str(tmp_path / "state.json"))
+    state.record_full("card", str(card))
+
+    write(str(card / "100OMSYS" / "P5190001.JPG"))
+    assert state.scan("card", str(card)) is None
+
+
+def test_untrusted_directory_mtimes_are_not_used(tmp_path, monkeypatch):
+    card = tmp_path / "card"
+    write(str(card / "DCIM" / "100OMSYS" / "P5190001.JPG"))
+    state = SourceState(str(tmp_path / "state.json"))
+    state.record_full("card", str(card))
+
+    # a new folder in a directory whose mtime the firmware left alone
+    restore = keep_mtime(str(card / "DCIM"))
+    write(str(card / "DCIM" / "101OMSYS" / "P5200001.JPG"))
+    restore()
+
+    monkeypatch.setattr(source_state, "fs_type", lambda path: "ext4")
+    assert state.scan("card", str(card)).files == []
+    monkeypatch.setattr(source_state, "fs_type", lambda path: "vfat")
+    assert state.scan("card", str(card)).files == ["DCIM/101OMSYS/P5200001.JPG"]
+
+
+def test_full_listing_is_forced_periodically(tmp_path, monkeypatch):
+    card = tmp_path / "card"
+    write(str(card / "P5190001.JPG"))
+    state = SourceState(str(tmp_path / "state.json"))
+    state.record_full("card", str(card))
+    assert state.scan("card", str(card)) is not None
+
+    now = source_state.time.time()
+    monkeypatch.setattr(source_state.time, "time", lambda: now + source_state.FULL_SCAN_INTERVAL + 1)
+    assert state.scan("card", str(card)) is None
+
+
+def test_state_survives_reload(tmp_path):
+    card = tmp_path / "card"
+    write(str(card / "P5190001.JPG"))
+    SourceState(str(tmp_path / "state.json")).record_full("card", str(card))
+    write(str(card / "P5190002.JPG"))
+    assert SourceState(str(tmp_path / "state.json")).scan("card", str(card)).files == ["P5190002.JPG"]
+
+
+def test_full_listing_is_recorded_without_listing_again(tmp_path, monkeypatch):
+    card = tmp_path / "card"
+    write(str(card / "DCIM" / "100OMSYS" / "P5190001.JPG"), b"12345")
+    write(str(card / "DCIM" / "100OMSYS" / "P5190002.JPG"))
+    write(str(card / ".trashed" / "P5180001.JPG"))
+    matcher = ExcludeMatcher([".trashed"])
+
+    listing = SourceState.list_all(str(card), matcher)
+    assert listing.files == ["DCIM/100OMSYS/P5190001.JPG", "DCIM/100OMSYS/P5190002.JPG"]
+    assert listing.entries["DCIM/100OMSYS/P5190001.JPG"][0] == 5
+    assert listing.excluded == 1
+
+    state = SourceState(str(tmp_path / "state.json"))
+    monkeypatch.setattr(source_state.os, "scandir", None)
+    state.record_full("card", str(card), matcher, listing)
+    monkeypatch.undo()
+
+    write(str(card / "DCIM" / "100OMSYS" / "P5190003.JPG"))
+    assert state.scan("card", str(card), matcher).files == ["DCIM/100OMSYS/P5190003.JPG"]
@@ -0,0 +1,125 @@
+import asyncio
+import dataclasses
+import os
+import time
+
+import pytest
+
+import sync_budget
+from auto_backup import AutoBackup
+from backup_config import parse_config
+from blink_led import LedStatus, make_fake_sysfs
+from drive_catalog import DriveCatalog
+from file_watcher import FileWatcher
+from sync_budget import SyncBudget
+
+MB = 1_000_000
+
+
+def test_select_skips_files_too_big_for_what_is_left():
+    budget = SyncBudget(max_bytes=10 * MB)
+    files = [("a", 4 * MB), ("big", 8 * MB), ("b", 5 * MB), ("c", 2 * MB)]
+    assert budget.select(files) == ([("a", 4 * MB), ("b", 5 * MB)], ["big", "c"])
+
+
+def test_time_limit_uses_the_drive_rate():
+    budget = SyncBudget(max_seconds=10, rate=2 * MB)
+    assert budget.allowance() == pytest.approx(10 * 2 * MB * sync_budget.SAFETY, rel=0.01)
+    assert not budget.expired()
+    assert SyncBudget(max_bytes=MB).allowance() == MB
+
+
+def test_expired_budget_has_no_allowance(monkeypatch):
+    budget = SyncBudget(max_seconds=5, max_bytes=100 * MB)
+    monkeypatch.setattr(sync_budget.time, "monotonic", lambda: budget.started + 6)
+    assert budget.expired()
+    assert budget.allowance() == 0
+
+
+def test_chunks_hold_about_chunk_seconds_of_copying():
+    budget = SyncBudget(max_bytes=100 * MB, rate=MB / sync_budget.CHUNK_SECONDS)
+    files = [("a", MB // 2), ("b", MB // 2), ("c", MB // 2), ("big", 3 * MB)]
+    assert list(budget.chunks(files)) == [["a", "b"], ["c"], ["big"]]
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+
+
+@pytest.fixture
+def backup(tmp_path, monkeypatch):
+    """ An AutoBackup with six indexed files, two of them on a drive that has no catalog. """
+    monkeypatch.setattr(FileWatcher, "dismount", lambda self: None)
+    local = tmp_path / "local" / "bk"
+    drive = tmp_path / "drive" / "bk"
+    for i in range(6):
+        write(str(local / "2024" / f"P{i}.JPG"), MB)
+    (drive / "2024").mkdir(parents=True)
+    for i in (0, 1):
+        (drive / "2024" / f"P{i}.JPG").write_bytes((local / "2024" / f"P{i}.JPG").read_bytes())
+
+    config = parse_config({
+        "local_backup_dir": str(tmp_path / "local"), "backup_subdir": "bk", "thumbnail_workers": 0,
+        "tee_ingest": False, "verify_after_sync": True,
+        "exclude": os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sync_exclude.txt"),
+        "sources": [],
+        "backups": [{"volume": str(tmp_path / "drive"), "engine": "native", "max_bytes": 3 * MB + 1000}]})
+    ab = AutoBackup.from_config(config)
+    ab.led_status = LedStatus(10, 10, sysfs_root=make_fake_sysfs(str(tmp_path / "leds")))
+    ab.led_status.start()
+    ab.index.add_files([f"2024/P{i}.JPG" for i in range(6)], ingested_at=time.time() - 60)
+    yield ab, config.backups[0], str(tmp_path / "drive"), str(drive)
+    ab.led_status.stop()
+    ab.index.close()
+    ab.journal.close()
+
+
+def test_budgeted_session_counts_transfers_and_keeps_catalog_stale(backup):
+    ab, entry, volume, drive = backup
+    asyncio.run(ab.backup_to_volume(entry, FileWatcher(volume, "")))
+
+    # three files fit the budget, a file found on the drive is not a transfer
+    transferred = {f"2024/{name}" for name in os.listdir(os.path.join(drive, "2024"))} - \
+        {"2024/P0.JPG", "2024/P1.JPG"}
+    assert 1 <= len(transferred) <= 3
+
+    # only what the session wrote is recorded, the drive was not walked
+    catalog = DriveCatalog(volume, drive)
+    assert not catalog.load()
+    assert catalog.stale
+    assert set(catalog.files) == transferred
+    assert {p for p, _ in ab.index.files() if ab.index.replicas(p)} == transferred
+    # files were left for next time, the drive is not synced
+    assert ab.index.last_synced(volume) is None
+
+
+def test_full_session_rebuilds_stale_catalog(backup):
+    ab, entry, volume, drive = backup
+    asyncio.run(ab.backup_to_volume(entry, FileWatcher(volume, "")))
+    asyncio.run(ab.backup_to_volume(dataclasses.replace(entry, max_bytes=None), FileWatcher(volume, "")))
+
+    catalog = DriveCatalog(volume, drive)
+    assert catalog.load()
+    assert len(catalog.files) == 6
+    assert ab.index.last_synced(volume) is not None
+
+
+def test_failed_session_marks_catalog_stale_and_dismounts(backup, monkeypatch, capsys):
+    ab, entry, volume, drive = backup
+    dismounted = []
+    monkeypatch.setattr(FileWatcher, "dismount", lambda self: dismounted.append(self.volume))
+    # a current catalog from an earlier sync
+    catalog = DriveCatalog(volume, drive)
+    catalog.rebuild()
+    catalog.save()
+
+    async def broken(*args, **kwargs):
+        raise OSError("drive unplugged")
+
+    monkeypatch.setattr(ab, "sync_within", broken)
+    asyncio.run(ab.backup_to_volume(entry, FileWatcher(volume, "")))
+    assert "Error occurred while syncing: drive unplugged" in capsys.readouterr().out
+    assert dismounted == [volume]
+    assert not DriveCatalog(volume, drive).load()
@@ -0,0 +1,97 @@
+import gzip
+import os
+
+from sync_log import SyncLog, segment_files
+
+
+def write_run(log, text, source="/src", dest="/dst"):
+    with log.run(source, dest) as f:
+        f.write(text)
+
+
+def test_read_run_from_rotated_segment_and_current_log(tmp_path):
+    log = SyncLog(str(tmp_path / "rsync_log.txt"))
+    write_run(log, "first run\n")
+    write_run(log, "second run\n")
+    log.rotate()
+    write_run(log, "third run\n")
+
+    segments = segment_files(log.path)
+    assert len(segments) == 1
+    runs = log.runs()
+    assert [r["segment"] for r in runs] == [segments[0], segments[0], "rsync_log.txt"]
+    assert log.read_run(1) == "first run\n"
+    assert log.read_run(2) == "second run\n"
+    assert log.read_run(3) == "third run\n"
+    with gzip.open(tmp_path / segments[0], "rb") as f:
+        assert f.read() == b"first run\nsecond run\n"
+
+
+def test_run_ids_continue_after_reopen(tmp_path):
+    path = str(tmp_path / "rsync_log.txt")
+    write_run(SyncLog(path), "one\n")
+    log = SyncLog(path)
+    write_run(log, "two\n")
+    assert [r["run"] for r in log.runs()] == [1, 2]
+    assert log.read_run(2) == "two\n"
+
+
+def test_rotation_prunes_old_segments_and_their_runs(tmp_path):
+    log = SyncLog(str(tmp_path / "rsync_log.txt"), keep=1)
+    write_run(log, "old\n")
+    log.rotate()
+    old_segment = segment_files(log.path)[0]
+    os.utime(tmp_path / old_segment, (1, 1))
+    write_run(log, "new\n")
+    log.rotate()
+
+    segments = segment_files(log.path)
+    assert len(segments) == 1 and segments[0] != old_segment
+    assert [r["run"] for r in log.runs()] == [2]
+    assert log.read_run(1) is None
+    assert log.read_run(2) == "new\n"
+
+
+def test_oversized_log_rotates_before_the_next_run(tmp_path):
+    log = SyncLog(str(tmp_path / "rsync_log.txt"), max_bytes=10)
+    write_run(log, "more than ten bytes\n")
+    write_run(log, "next\n")
+    assert len(segment_files(log.path)) == 1
+    assert log.read_run(1) == "more than ten bytes\n"
+    assert open(log.path).read() == "next\n"
+
+
+def test_tail_keeps_last_progress_update_per_line(tmp_path):
+    log = SyncLog(str(tmp_path / "rsync_log.txt"))
+    write_run(log, "a\nfile 10%\rfile 50%\rfile 100%\nb\n")
+    assert log.tail(2) == ["file 100%", "b"]
+    assert log.tail(10) == ["a", "file 100%", "b"]
+
+
+def test_tail_continues_into_the_newest_rotated_segment(tmp_path):
+    log = SyncLog(str(tmp_path / "rsync_log.txt"))
+    write_run(log, "".join(f"old {n}\n" for n in range(5)))
+    log.rotate()
+    os.utime(tmp_path / segment_files(log.path)[0], (1, 1))
+    write_run(log, "".join(f"newer {n}\n" for n in range(5)))
+    log.rotate()
+
+    assert log.tail(3) == ["newer 2", "newer 3", "newer 4"]
+
+    write_run(log, "current\n")
+    assert log.tail(3) == ["newer 3", "newer 4", "current"]
+    assert log.tail(1) == ["current"]
+
+
+def test_tail_without_a_log(tmp_path):
+    assert SyncLog(str(tmp_path / "rsync_log.txt")).tail() == []
+
+
+def test_subscribers_receive_written_text_until_unsubscribed(tmp_path):
+    log = SyncLog(str(tmp_path / "rsync_log.txt"))
+    q = log.subscribe()
+    write_run(log, "hello\n")
+    log.unsubscribe(q)
+    write_run(log, "unheard\n")
+    assert q.get_nowait() == "hello\n"
+    assert q.empty()
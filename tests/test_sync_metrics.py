@@ -0,0 +1,68 @@
+import gzip
+import json
+import os
+import time
+
+from sync_log import SyncLog
+from sync_metrics import SyncMetrics
+
+
+def event(name="file_done", ts=None, **fields):
+    event = {"ts": ts if ts is not None else time.time(), "event": name, "source": "cam", "dest": "drive"}
+    event.update(fields)
+    return event
+
+
+def done(seconds, ts=None):
+    return event(size=1000, rate=1e6, seconds=seconds, ts=ts)
+
+
+def segments(tmp_path, stem):
+    return sorted(name for name in os.listdir(tmp_path) if name.startswith(stem + ".") and name.endswith(".gz"))
+
+
+def test_journal_is_rotated_by_size_and_old_segments_dropped(tmp_path):
+    journal = str(tmp_path / "sync_events.jsonl")
+    metrics = SyncMetrics(journal, max_bytes=1000, keep=2)
+    for i in range(60):
+        metrics.handle(done(0.2))
+    assert os.path.getsize(journal) < 1000 + 200
+    rotated = segments(tmp_path, "sync_events")
+    assert len(rotated) == 2
+    with gzip.open(tmp_path / rotated[-1], 'rt') as f:
+        assert json.loads(f.readline())["event"] == "file_done"
+
+
+def test_journal_is_rotated_by_age_across_restarts(tmp_path):
+    journal = str(tmp_path / "sync_events.jsonl")
+    SyncMetrics(journal).handle(done(0.2, ts=time.time() - 8 * 86400))
+    metrics = SyncMetrics(journal, max_age_days=7)
+    metrics.handle(done(0.2))
+    assert len(segments(tmp_path, "sync_events")) == 1
+    with open(journal) as f:
+        assert len(f.readlines()) == 1
+
+
+def test_file_seconds_is_a_histogram():
+    metrics = SyncMetrics()
+    for seconds in (0.05, 0.3, 4, 400):
+        metrics.handle(done(seconds))
+    text = metrics.registry.render()
+    assert "# TYPE backup_sync_file_seconds histogram" in text
+    assert 'backup_sync_file_seconds_bucket{dest="drive",le="0.5"} 2' in text
+    assert 'backup_sync_file_seconds_bucket{dest="drive",le="300"} 3' in text
+    assert 'backup_sync_file_seconds_bucket{dest="drive",le="+Inf"} 4' in text
+    assert 'backup_sync_file_seconds_count{dest="drive"} 4' in text
+    assert 'backup_sync_file_seconds_sum{dest="drive"} 404.35' in text
+    assert "counter" not in next(line for line in text.splitlines() if "file_seconds" in line and "TYPE" in line)
+
+
+def test_sync_log_rotation_keeps_runs_readable(tmp_path):
+    log = SyncLog(str(tmp_path / "rsync_log.txt"), max_bytes=10, keep=5)
+    with log.run("cam", "drive") as f:
+        f.write("first run\n")
+    with log.run("cam", "drive") as f:
+        f.write("second run\n")
+    assert len(segments(tmp_path, "rsync_log")) == 1
+    assert log.read_run(1) == "first run\n"
+    assert log.read_run(2) == "second run\n"
@@ -0,0 +1,93 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import sync_plan
+from drive_catalog import DriveCatalog
+from exclude_matcher import ExcludeMatcher
+from media_index import MediaIndex
+from source_state import SourceState
+from sync_plan import InsufficientSpace, SyncPlan, plan_backup, plan_source
+
+MB = 1_000_000
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b"x" * size)
+
+
+@pytest.fixture
+def index(tmp_path):
+    root = tmp_path / "local"
+    write(str(root / "2024" / "P1.JPG"), 100)
+    write(str(root / "2024" / "P2.JPG"), 200)
+    write(str(root / "2024" / "skip.tmp"), 50)
+    index = MediaIndex(str(tmp_path / "index.db"), str(root))
+    index.reconcile()
+    yield index
+    index.close()
+
+
+def test_source_plan_from_full_listing(tmp_path, index):
+    card = tmp_path / "card"
+    write(str(card / "2024" / "P1.JPG"), 100)      # in the archive
+    write(str(card / "2024" / "P2.JPG"), 250)      # changed size
+    write(str(card / "2024" / "P3.JPG"), 300)      # new
+    write(str(card / ".trashed" / "P0.JPG"), 10)
+    matcher = ExcludeMatcher([".trashed"])
+
+    plan = plan_source(index, str(card), matcher, SourceState.list_all(str(card), matcher))
+    assert plan.files == [("2024/P2.JPG", 250), ("2024/P3.JPG", 300)]
+    assert (plan.excluded, plan.up_to_date, plan.bytes) == (1, 1, 550)
+    # the same without a listing
+    assert plan_source(index, str(card), matcher).files == plan.files
+
+
+def test_dated_source_plan_matches_by_name_and_size(tmp_path, index):
+    card = tmp_path / "card"
+    write(str(card / "P1.JPG"), 100)
+    write(str(card / "P2.JPG"), 100)
+    plan = plan_source(index, str(card), ExcludeMatcher(), dated=True)
+    assert plan.files == [("P2.JPG", 100)]
+
+
+def test_backup_plan_from_current_catalog(tmp_path, index):
+    drive = tmp_path / "drive" / "bk"
+    write(str(drive / "2024" / "P1.JPG"), 100)
+    catalog = DriveCatalog(str(tmp_path / "drive"), str(drive))
+    catalog.rebuild()
+
+    plan = plan_backup(index, str(drive), ExcludeMatcher(["*.tmp"]), catalog, str(tmp_path / "drive"))
+    assert plan.exact
+    assert plan.files == [("2024/P2.JPG", 200)]
+    assert (plan.excluded, plan.up_to_date) == (1, 1)
+
+
+def test_estimate_uses_the_slower_of_bytes_and_files():
+    plan = SyncPlan("src", "dst", [("a", 10 * MB), ("b", 10 * MB)])
+    assert plan.seconds() is None
+    plan.estimate((10 * MB, 10.0, 3))
+    assert plan.seconds() == 2.0
+    plan.estimate((100 * MB, 0.5, 3))
+    assert plan.seconds() == 4.0
+    assert "about 0:00:04" in str(plan)
+
+
+def test_run_history_is_the_throughput(index):
+    assert index.throughput("/media/pi/T7") is None
+    index.record_run("/media/pi/T7", 10, 100 * MB, 10)
+    index.record_run("/media/pi/T7", 30, 200 * MB, 10)
+    assert index.run_rates("/media/pi/T7") == (15 * MB, 2.0, 2)
+    assert index.throughput("/media/pi/T7") == 15 * MB
+
+
+def test_check_space(tmp_path, monkeypatch):
+    plan = SyncPlan("src", str(tmp_path), [("a", 10 * MB)])
+    monkeypatch.setattr(sync_plan.shutil, "disk_usage",
+                        lambda path: SimpleNamespace(free=10 * MB + sync_plan.FREE_SPACE_MARGIN - 1))
+    with pytest.raises(InsufficientSpace):
+        plan.check_space()
+    plan.check_space(limit=5 * MB)
@@ -0,0 +1,164 @@
+import asyncio
+import io
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import auto_backup
+from auto_backup import AutoBackup
+from backup_config import parse_config
+from blink_led import LedStatus, make_fake_sysfs
+from file_watcher import FileWatcher
+from tee_ingest import MirrorSink, tee_data
+
+EXCLUDE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sync_exclude.txt")
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_tee_data_writes_local_copy_and_mirrors(tmp_path):
+    src = tmp_path / "src.jpg"
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    src.write_bytes(data)
+    sinks = [MirrorSink(str(tmp_path / "m1"), fsync=False), MirrorSink(str(tmp_path / "m2"), fsync=False, max_lag=1)]
+    for sink in sinks:
+        sink.start()
+    with open(src, 'rb') as fsrc, open(tmp_path / "local.jpg", 'wb') as fdst:
+        assert tee_data(fsrc, fdst, len(data), 0, None, sinks, "2024/P1.JPG", os.stat(src)) == len(data)
+    for sink in sinks:
+        sink.close()
+        assert sink.written == ["2024/P1.JPG"] and sink.error is None
+        assert (tmp_path / sink.root / "2024" / "P1.JPG").read_bytes() == data
+        assert os.stat(tmp_path / sink.root / "2024" / "P1.JPG").st_mtime_ns == os.stat(src).st_mtime_ns
+    assert (tmp_path / "local.jpg").read_bytes() == data
+
+
+def test_failed_read_leaves_no_partial_mirror(tmp_path):
+    class Broken(io.BytesIO):
+        def read(self, n=-1):
+            raise OSError("device unplugged")
+
+    sink = MirrorSink(str(tmp_path / "m"), fsync=False)
+    sink.start()
+    with open(tmp_path / "local.jpg", 'wb') as fdst, pytest.raises(OSError):
+        tee_data(Broken(), fdst, 10, 0, None, [sink], "P1.JPG", os.stat(tmp_path / "local.jpg"))
+    sink.close()
+    assert sink.written == [] and os.listdir(tmp_path / "m") == []
+
+
+@pytest.fixture
+def setup(tmp_path, monkeypatch):
+    """ A camera card with three photos, an empty backup drive and an AutoBackup for them. """
+    monkeypatch.setattr(FileWatcher, "dismount", lambda self: None)
+    monkeypatch.setattr(auto_backup, "TEE_GRACE", 0.2)
+    for i in range(3):
+        write(str(tmp_path / "cam" / "DCIM" / f"P{i}.JPG"), os.urandom(200_000))
+    (tmp_path / "local" / "bk").mkdir(parents=True)
+    (tmp_path / "drive" / "bk").mkdir(parents=True)
+
+    def make(engine):
+        config = parse_config({
+            "local_backup_dir": str(tmp_path / "local"), "backup_subdir": "bk", "exclude": EXCLUDE,
+            "thumbnail_workers": 0,
+            "sources": [{"volume": str(tmp_path / "cam"), "directory": "DCIM", "engine": engine}],
+            "backups": [{"volume": str(tmp_path / "drive"), "engine": "native"}]})
+        ab = AutoBackup.from_config(config)
+        ab.led_status = LedStatus(10, 10, sysfs_root=make_fake_sysfs(str(tmp_path / "leds")))
+        ab.led_status.start()
+        made.append(ab)
+        return ab, config, FileWatcher(str(tmp_path / "cam"), "DCIM"), FileWatcher(str(tmp_path / "drive"), "")
+
+    made = []
+    yield make
+    for ab in made:
+        ab.led_status.stop()
+        ab.index.close()
+        ab.journal.close()
+
+
+def test_drive_does_not_wait_when_no_source_can_tee(setup, monkeypatch):
+    ab, config, _, drive = setup("rsync")
+    monkeypatch.setattr(auto_backup, "TEE_GRACE", 30)
+    started = time.monotonic()
+    asyncio.run(ab.wait_for_ingests(config.backups[0], drive))
+    assert time.monotonic() - started < 1
+    assert ab._tee_ready == {}
+
+
+def test_wait_is_bounded(setup, monkeypatch, capsys):
+    ab, config, _, drive = setup("native")
+    monkeypatch.setattr(auto_backup, "TEE_MAX_WAIT", 0.5)
+    # an ingest that never takes its mirrors
+    ab._tee_pending = 1
+    started = time.monotonic()
+    asyncio.run(ab.wait_for_ingests(config.backups[0], drive))
+    assert 0.4 < time.monotonic() - started < 2
+    assert "Waited" in capsys.readouterr().out
+
+
+def test_ingest_tees_to_a_waiting_drive(setup, tmp_path, capsys):
+    ab, config, cam, drive = setup("native")
+
+    async def main():
+        backup = asyncio.create_task(ab.backup_to_volume(config.backups[0], drive))
+        await asyncio.sleep(0.05)
+        await ab.backup_source(config.sources[0], cam)
+        await backup
+
+    asyncio.run(main())
+    out = capsys.readouterr().out
+    assert "Also copied 3 files" in out
+    for i in range(3):
+        local = (tmp_path / "local" / "bk" / f"P{i}.JPG").read_bytes()
+        assert (tmp_path / "drive" / "bk" / f"P{i}.JPG").read_bytes() == local
+    assert ab._tee_pending == 0 and ab._teeing == set() and ab._mirrored == {}
+    assert ab.index.replicas("P0.JPG") == {str(tmp_path / "drive")}
+
+
+def test_finish_mirrors_keeps_only_verified_copies(setup, tmp_path):
+    ab, config, _, drive = setup("native")
+    local = tmp_path / "local" / "bk"
+    root = str(tmp_path / "drive" / "bk")
+    for i in range(2):
+        write(str(local / f"P{i}.JPG"), os.urandom(1000))
+        write(os.path.join(root, f"P{i}.JPG"), (local / f"P{i}.JPG").read_bytes())
+    # the tee wrote a bad copy of P1
+    write(os.path.join(root, "P1.JPG"), os.urandom(1000))
+    ab.index.add_files(["P0.JPG", "P1.JPG"], ingested_at=time.time())
+    ab._tee_ready[drive] = config.backups[0]
+
+    claimed = ab.claim_mirrors(ab.ingest_manager_for(config.sources[0]))
+    assert [c[2] for c in claimed] == [root] and drive in ab._teeing
+    # a second ingest can not take the same drive
+    assert ab.claim_mirrors(ab.ingest_manager_for(config.sources[0])) == []
+
+    result = SimpleNamespace(mirrored={root: ["P0.JPG", "P1.JPG"]}, mirror_errors={})
+    asyncio.run(ab.finish_mirrors(claimed, result, str(local)))
+    assert ab._mirrored[drive] == {"P0.JPG"}
+    assert not os.path.exists(os.path.join(root, "P1.JPG"))
+    assert ab.index.replicas("P0.JPG") == {str(tmp_path / "drive")}
+    assert ab.index.replicas("P1.JPG") == set()
+
+
+def test_no_space_still_dismounts_source_and_drive(setup, tmp_path, monkeypatch, capsys):
+    import sync_plan
+    ab, config, cam, drive = setup("native")
+    dismounted = []
+    monkeypatch.setattr(FileWatcher, "dismount", lambda self: dismounted.append(self.volume))
+    monkeypatch.setattr(sync_plan.shutil, "disk_usage", lambda path: SimpleNamespace(free=0))
+    write(str(tmp_path / "local" / "bk" / "old.JPG"), b"x" * 1000)
+    ab.index.add_files(["old.JPG"], ingested_at=time.time())
+
+    asyncio.run(ab.backup_source(config.sources[0], cam))
+    asyncio.run(ab.backup_to_volume(config.backups[0], drive))
+    out = capsys.readouterr().out
+    assert out.count("Not enough space") == 2
+    assert dismounted == [str(tmp_path / "cam"), str(tmp_path / "drive")]
+    assert os.listdir(tmp_path / "local" / "bk") == ["old.JPG"]
+    assert ab._tee_pending == 0 and ab._teeing == set()
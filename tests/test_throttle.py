@@ -0,0 +1,145 @@
+from types import SimpleNamespace
+
+import pytest
+
+import throttle
+from throttle import MIN_RATE, RECOVER_SECONDS, RECOVER_STEP, ReplicationThrottle, TokenBucket
+
+MB = 1_000_000
+
+
+class Clock:
+    """ time.monotonic() and time.sleep() that only move when slept. """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle, "time", SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    return clock
+
+
+def file_done(seconds, size=MB, source="cam"):
+    return {"event": "file_done", "source": source, "size": size, "seconds": seconds}
+
+
+def test_bucket_lets_the_burst_through_then_holds_to_the_rate(clock):
+    bucket = TokenBucket(rate=MB, burst=MB)
+    assert bucket.consume(MB) == 0.0
+    # empty but not in debt: waits until a token came in
+    assert bucket.consume(MB) == pytest.approx(0.001)
+    # one second of debt
+    waited = bucket.consume(MB)
+    assert waited == pytest.approx(1.0, abs=0.01)
+    assert clock.slept == pytest.approx(waited + 0.001)
+
+
+def test_unlimited_bucket_never_waits_and_measures_throughput(clock):
+    bucket = TokenBucket()
+    for _ in range(4):
+        assert bucket.consume(5 * MB) == 0.0
+        clock.now += 0.5
+    # 15 MB taken in the first second
+    assert bucket.observed == pytest.approx(15 * MB)
+    assert clock.slept == 0
+
+
+def test_cancel_stops_waiting(clock):
+    bucket = TokenBucket(rate=MB, burst=MB)
+    bucket.consume(10 * MB)
+    cancel = SimpleNamespace(is_set=lambda: True)
+    assert bucket.consume(MB, cancel) == 0.0
+
+
+def test_latency_rise_halves_the_rate_down_to_the_floor(clock):
+    replication = ReplicationThrottle(max_rate=40 * MB)
+    replication.ingest_started()
+    replication.ingest_file(file_done(0.1))          # baseline 0.1 s per MB
+    replication.ingest_file(file_done(0.12))         # below LATENCY_RISE
+    assert replication.bucket.rate == 40 * MB and replication.backoffs == 0
+
+    clock.now += 2
+    replication.ingest_file(file_done(0.3))
+    assert replication.bucket.rate == 20 * MB and replication.backoffs == 1
+    # at most one backoff a second
+    replication.ingest_file(file_done(0.3))
+    assert replication.bucket.rate == 20 * MB
+
+    for _ in range(10):
+        clock.now += 2
+        replication.ingest_file(file_done(0.5))
+    assert replication.bucket.rate == MIN_RATE
+
+
+def test_backoff_without_a_cap_starts_from_the_observed_rate(clock):
+    replication = ReplicationThrottle()
+    replication.ingest_started()
+    replication.bucket.observed = 30 * MB
+    replication.ingest_file(file_done(0.1))
+    clock.now += 2
+    replication.ingest_file(file_done(0.3))
+    assert replication.bucket.rate == 15 * MB
+
+
+def test_small_files_and_a_fixed_throttle_do_not_back_off(clock):
+    replication = ReplicationThrottle(max_rate=40 * MB)
+    replication.ingest_file(file_done(0.01, size=100_000))
+    clock.now += 2
+    replication.ingest_file(file_done(5, size=100_000))
+    fixed = ReplicationThrottle(max_rate=40 * MB, adaptive=False)
+    fixed.ingest_file(file_done(0.1))
+    clock.now += 2
+    fixed.ingest_file(file_done(1))
+    assert replication.backoffs == fixed.backoffs == 0
+
+
+def test_rate_recovers_in_steps_and_fully_after_the_last_ingest(clock):
+    replication = ReplicationThrottle(max_rate=40 * MB)
+    replication.ingest_started()
+    replication.ingest_file(file_done(0.1))
+    clock.now += 2
+    replication.ingest_file(file_done(0.3))
+    assert replication.bucket.rate == 20 * MB
+
+    replication.recover()
+    assert replication.bucket.rate == 20 * MB
+    clock.now += RECOVER_SECONDS
+    replication.recover()
+    assert replication.bucket.rate == pytest.approx(20 * MB * (1 + RECOVER_STEP))
+
+    replication.ingest_finished()
+    assert replication.bucket.rate == 40 * MB
+
+
+def test_configure_drops_a_backoff(clock):
+    replication = ReplicationThrottle(max_rate=40 * MB)
+    replication.ingest_started()
+    replication.ingest_file(file_done(0.1))
+    clock.now += 2
+    replication.ingest_file(file_done(0.3))
+    replication.configure(max_rate=None, adaptive=False)
+    assert replication.bucket.rate is None and replication.max_rate is None
+
+
+def test_job_counts_bytes_and_time_held_back(clock):
+    replication = ReplicationThrottle(max_rate=MB)
+    replication.bucket.burst = replication.bucket._tokens = MB
+    job = replication.job()
+    for _ in range(3):
+        job(MB)
+    assert job.bytes == 3 * MB
+    assert job.waited == pytest.approx(1.001, abs=0.01)
+    assert job.share() == pytest.approx(1.0)
+    # another job's statistics start from zero
+    assert replication.job().waited == 0
@@ -0,0 +1,117 @@
+import os
+from concurrent.futures import Future
+
+from thumbnail_cache import FINGERPRINT_BYTES, ThumbnailCache, Thumbnailer, content_key, load_last_ingest
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def key(n):
+    return f"{n:02x}" + "0" * 30
+
+
+def test_put_evicts_least_recently_used_first(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_bytes=300)
+    for n in range(3):
+        cache.put(key(n), b"x" * 100)
+    assert cache.bytes == 300
+
+    assert cache.get(key(0)) == cache.path(key(0))
+    cache.put(key(3), b"x" * 100)
+
+    assert key(1) not in cache
+    assert not os.path.exists(cache.path(key(1)))
+    assert [k in cache for k in (key(0), key(2), key(3))] == [True, True, True]
+    assert cache.bytes == 300 and len(cache) == 3
+
+
+def test_large_put_evicts_several_entries(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_bytes=300)
+    for n in range(3):
+        cache.put(key(n), b"x" * 100)
+    cache.put(key(3), b"x" * 250)
+    assert list(cache._entries) == [key(3)]
+    assert cache.bytes == 250
+
+
+def test_replacing_a_thumbnail_counts_its_bytes_once(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_bytes=1000)
+    cache.put(key(0), b"x" * 100)
+    cache.put(key(1), b"x" * 100)
+    cache.put(key(0), b"x" * 40)
+    assert cache.bytes == 140
+    assert list(cache._entries) == [key(1), key(0)]
+    assert os.path.getsize(cache.path(key(0))) == 40
+
+
+def test_get_of_a_removed_file_drops_the_entry(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_bytes=1000)
+    cache.put(key(0), b"x" * 100)
+    os.remove(cache.path(key(0)))
+    assert cache.get(key(0)) is None
+    assert key(0) not in cache and cache.bytes == 0
+    assert cache.get(key(1)) is None
+
+
+def test_order_and_size_survive_a_restart(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_bytes=1000)
+    for n in range(3):
+        cache.put(key(n), b"x" * 100)
+    for n, mtime in ((0, 300), (1, 100), (2, 200)):
+        os.utime(cache.path(key(n)), (mtime, mtime))
+    write(str(tmp_path / "00" / "stray.jpg.tmp"), b"partial")
+
+    reopened = ThumbnailCache(str(tmp_path), max_bytes=250)
+
+    assert list(reopened._entries) == [key(2), key(0)]
+    assert reopened.bytes == 200
+    assert not os.path.exists(reopened.path(key(1)))
+
+
+def test_content_key_depends_on_size_head_and_tail(tmp_path):
+    size = 3 * FINGERPRINT_BYTES
+    base = bytearray(size)
+    paths = {}
+    for name, change in (("a", None), ("b", None), ("head", 0), ("middle", size // 2), ("tail", size - 1)):
+        data = bytearray(base)
+        if change is not None:
+            data[change] = 1
+        paths[name] = str(tmp_path / name)
+        write(paths[name], bytes(data))
+    write(str(tmp_path / "longer"), bytes(base) + b"\0")
+
+    keys = {name: content_key(path) for name, path in paths.items()}
+    assert keys["a"] == keys["b"] == keys["middle"]
+    assert keys["head"] != keys["a"] and keys["tail"] != keys["a"]
+    assert content_key(str(tmp_path / "longer")) != keys["a"]
+
+
+def done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def test_finished_thumbnails_are_cached_and_saved_as_the_last_ingest(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "cache"), max_bytes=1000)
+    thumbnailer = Thumbnailer(cache, str(tmp_path / "backup"))
+    thumbnailer._last_ingest = ["a.jpg", "b.jpg", "c.jpg"]
+    thumbnailer._pending = 3
+
+    thumbnailer._done("a.jpg", done((key(0), b"thumb")))
+    failed = Future()
+    failed.set_exception(OSError("unreadable"))
+    thumbnailer._done("b.jpg", failed)
+    assert load_last_ingest(cache.cache_dir) == []
+
+    thumbnailer._done("c.jpg", done((key(0), None)))
+
+    assert thumbnailer.pending() == 0
+    assert thumbnailer.last_ingest() == ["a.jpg", "c.jpg"]
+    assert thumbnailer.thumbnail("c.jpg") == cache.path(key(0))
+    assert cache.bytes == len(b"thumb")
+    assert load_last_ingest(cache.cache_dir) == [("a.jpg", key(0)), ("c.jpg", key(0))]
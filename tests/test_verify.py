@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+
+import pytest
+
+from media_index import MediaIndex
+from native_sync import SyncCancelled
+from verify import SCRUB_NAME, Scrubber, Verifier, hash_file
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class RecordingVerifier(Verifier):
+    """ A Verifier that records the files it hashes and can fail on a given call. """
+
+    def __init__(self, index, fail_on=None):
+        super().__init__(index)
+        self.calls = []
+        self.fail_on = fail_on
+
+    def verify(self, local_root, other_root, rel_paths, cancel=None):
+        rel_paths = list(rel_paths)
+        self.calls.append(rel_paths)
+        if len(self.calls) == self.fail_on:
+            raise KeyboardInterrupt
+        return super().verify(local_root, other_root, rel_paths, cancel)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """ Six local files, copied to a drive with one copy damaged and one missing. """
+    local = tmp_path / "local"
+    drive = tmp_path / "drive"
+    for i in range(6):
+        data = os.urandom(1000 + i)
+        write(str(local / f"P{i}.JPG"), data)
+        if i != 4:
+            write(str(drive / "bk" / f"P{i}.JPG"), data)
+    write(str(drive / "bk" / "P2.JPG"), os.urandom(1002))
+    index = MediaIndex(str(tmp_path / "index.db"), str(local))
+    index.reconcile()
+    yield index, str(drive), str(drive / "bk")
+    index.close()
+
+
+def test_hash_file_matches_blake2b(tmp_path):
+    data = os.urandom(9 * 1024 * 1024 + 3)
+    write(str(tmp_path / "big"), data)
+    write(str(tmp_path / "empty"), b"")
+    assert hash_file(str(tmp_path / "big")) == hashlib.blake2b(data, digest_size=16).hexdigest()
+    assert hash_file(str(tmp_path / "empty")) == hashlib.blake2b(b"", digest_size=16).hexdigest()
+
+
+def test_verify_reports_bad_and_unreadable_copies(archive):
+    index, volume, backup_dir = archive
+    checked, bad = Verifier(index).verify(index.root, backup_dir, [f"P{i}.JPG" for i in range(6)])
+    assert checked == 6
+    assert [rel_path for rel_path, _ in bad] == ["P2.JPG", "P4.JPG"]
+    # local hashes are kept in the index
+    assert index.get("P0.JPG")[2] == hash_file(os.path.join(index.root, "P0.JPG"))
+
+
+def test_verify_stops_when_cancelled(archive):
+    index, volume, backup_dir = archive
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(SyncCancelled):
+        Verifier(index).verify(index.root, backup_dir, ["P0.JPG"], cancel)
+
+
+def test_scrub_finds_bad_and_missing_copies(archive):
+    index, volume, backup_dir = archive
+    progress = Scrubber(index, Verifier(index), chunk=4).run(volume, backup_dir)
+    assert progress["done"] and progress["checked"] == 6
+    assert progress["bad"] == ["P2.JPG"] and progress["missing"] == ["P4.JPG"]
+
+
+def test_interrupted_scrub_resumes_after_the_last_saved_chunk(archive):
+    index, volume, backup_dir = archive
+    verifier = RecordingVerifier(index, fail_on=2)
+    with pytest.raises(KeyboardInterrupt):
+        Scrubber(index, verifier, chunk=2).run(volume, backup_dir)
+    with open(os.path.join(volume, SCRUB_NAME)) as f:
+        saved = json.load(f)
+    assert saved["position"] == "P1.JPG" and saved["checked"] == 2 and not saved["done"]
+
+    verifier = RecordingVerifier(index)
+    progress = Scrubber(index, verifier, chunk=2).run(volume, backup_dir)
+    # the first chunk is not hashed again
+    assert verifier.calls == [["P2.JPG", "P3.JPG"], ["P5.JPG"]]
+    assert progress["done"] and progress["checked"] == 6
+    assert progress["bad"] == ["P2.JPG"] and progress["missing"] == ["P4.JPG"]
+
+    # a finished scrub starts over
+    verifier = RecordingVerifier(index)
+    Scrubber(index, verifier, chunk=2).run(volume, backup_dir)
+    assert verifier.calls[0] == ["P0.JPG", "P1.JPG"]
+
+
+def test_unplugged_drive_keeps_the_saved_position(archive, tmp_path):
+    index, volume, backup_dir = archive
+
+    class Unplugging(RecordingVerifier):
+        def verify(self, local_root, other_root, rel_paths, cancel=None):
+            result = super().verify(local_root, other_root, rel_paths, cancel)
+            if len(self.calls) == 2:
+                os.rename(backup_dir, str(tmp_path / "gone"))
+            return result
+
+    progress = Scrubber(index, Unplugging(index), chunk=2).run(volume, backup_dir)
+    assert progress["position"] == "P1.JPG" and not progress["done"]
+    os.rename(str(tmp_path / "gone"), backup_dir)
+
+    verifier = RecordingVerifier(index)
+    Scrubber(index, verifier, chunk=2).run(volume, backup_dir, restart=True)
+    assert verifier.calls[0] == ["P0.JPG", "P1.JPG"]
@@ -0,0 +1,211 @@
+import threading
+import time
+
+from ioprio import IOPRIO_CLASS_BE
+
+"""
+I/O priorities and adaptive bandwidth for ingest vs. backup traffic.
+
+Ingests (a phone or card into the local backup) run at best effort level 0,
+backups to drives at best effort level 7, through ioprio for the native engine
+threads and ionice for rsync. That helps with schedulers that honour
+priorities (BFQ); on others a backup to a slow HDD still competes with an
+ingest for the local SSD. So the native engine's backup copies also go through
+a TokenBucket shared by all backup jobs, which the ReplicationThrottle adapts:
+
+    - while no ingest runs the rate is backup_max_mbps (unlimited by default)
+    - an ingest file whose time per MB rises LATENCY_RISE times above the best
+      seen from that source halves the replication rate (down to MIN_RATE)
+    - every RECOVER_SECONDS without a rise it grows by RECOVER_STEP again
+
+Each backup job has a JobThrottle counting the bytes it sent through the
+bucket and the time it was held back, reported when the job ends and as the
+backup_sync_throttled_seconds_total metric (see sync_metrics.py).
+"""
+
+INGEST_PRIORITY = (IOPRIO_CLASS_BE, 0)
+BACKUP_PRIORITY = (IOPRIO_CLASS_BE, 7)
+
+# bytes copied between checks of the bucket
+THROTTLE_CHUNK = 4 * 1024 * 1024
+MIN_RATE = 2e6
+LATENCY_RISE = 1.5
+BACKOFF = 0.5
+RECOVER_SECONDS = 2.0
+RECOVER_STEP = 0.1
+# smaller files are mostly per file overhead and say little about contention
+MIN_SAMPLE_BYTES = 256 * 1024
+# how fast the best time per MB of a source drifts up to what it does now
+BASELINE_DRIFT = 0.02
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. A consumer goes ahead as soon as the bucket is
+    not empty and may take it into debt, so chunks larger than the burst work.
+    """
+
+    def __init__(self, rate=None, burst=2 * THROTTLE_CHUNK):
+        """
+        Args:
+            rate (float, optional): Bytes per second, None for unlimited.
+            burst (int): Bytes that can be used at once after being idle.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.observed = 0.0    # bytes per second actually going through
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._window_start = self._last
+        self._window_bytes = 0
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, n, cancel=None):
+        """
+        Takes n bytes, sleeping while the bucket is empty.
+
+        Returns:
+            float: Seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.rate is None or self._tokens > 0:
+                    if self.rate is not None:
+                        self._tokens -= n
+                    self._window_bytes += n
+                    if now - self._window_start >= 1.0:
+                        self.observed = self._window_bytes / (now - self._window_start)
+                        self._window_start = now
+                        self._window_bytes = 0
+                    return waited
+                # short sleeps so a new rate takes effect quickly
+                delay = min(0.1, -self._tokens / self.rate + 0.001)
+            if cancel is not None and cancel.is_set():
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+class JobThrottle:
+    """
+    What one backup job passes to the native engine: a callable taking a byte
+    count, and the job's throttle statistics.
+    """
+
+    def __init__(self, throttle):
+        self._throttle = throttle
+        self.bytes = 0
+        self.waited = 0.0
+        self.started = time.monotonic()
+
+    def __call__(self, n):
+        self._throttle.recover()
+        self.waited += self._throttle.bucket.consume(n)
+        self.bytes += n
+
+    def share(self):
+        """ Part of the job's time spent held back, 0..1. """
+        elapsed = time.monotonic() - self.started
+        return self.waited / elapsed if elapsed > 0 else 0.0
+
+
+class ReplicationThrottle:
+    """
+    Adapts the bandwidth of backup jobs to how ingests are doing.
+    """
+
+    def __init__(self, max_rate=None, adaptive=True):
+        """
+        Initializes the ReplicationThrottle.
+
+        Args:
+            max_rate (float, optional): Cap on backup traffic in bytes per second, None for none.
+            adaptive (bool): Back off while ingests slow down.
+        """
+        self.max_rate = max_rate
+        self.adaptive = adaptive
+        self.bucket = TokenBucket(max_rate)
+        self.backoffs = 0
+        self._ingests = 0
+        self._baseline = {}    # source -> best seconds per MB seen
+        self._last_change = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, max_rate=None, adaptive=True):
+        """ Applies new settings from a reloaded config.json, dropping any backoff. """
+        with self._lock:
+            self.max_rate = max_rate
+            self.adaptive = adaptive
+            self._last_change = time.monotonic()
+        self.bucket.set_rate(max_rate)
+
+    def job(self):
+        """ Returns a JobThrottle for a new backup job. """
+        return JobThrottle(self)
+
+    def ingest_started(self):
+        with self._lock:
+            self._ingests += 1
+
+    def ingest_finished(self):
+        with self._lock:
+            self._ingests = max(0, self._ingests - 1)
+            if self._ingests == 0:
+                self._last_change = time.monotonic()
+                self.bucket.set_rate(self.max_rate)
+
+    def ingest_file(self, event):
+        """ A file_done event of an ingest: backs off if the file took much longer per MB than usual. """
+        size = event.get("size") or 0
+        if not self.adaptive or size < MIN_SAMPLE_BYTES or not event.get("seconds"):
+            return
+        per_mb = event["seconds"] / (size / 1e6)
+        source = event.get("source")
+        with self._lock:
+            baseline = self._baseline.get(source)
+            if baseline is None or per_mb < baseline:
+                self._baseline[source] = per_mb
+                return
+            self._baseline[source] = baseline + BASELINE_DRIFT * (per_mb - baseline)
+            if per_mb < baseline * LATENCY_RISE:
+                return
+            now = time.monotonic()
+            if now - self._last_change < 1.0:
+                return
+            current = self.bucket.rate if self.bucket.rate is not None else max(self.bucket.observed, MIN_RATE)
+            self._last_change = now
+            self.backoffs += 1
+        rate = max(MIN_RATE, current * BACKOFF)
+        if self.max_rate is not None:
+            rate = min(rate, self.max_rate)
+        self.bucket.set_rate(rate)
+
+    def recover(self):
+        """ Grows a backed off rate again while ingests keep up. """
+        rate = self.bucket.rate
+        if rate is None or rate == self.max_rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_change < RECOVER_SECONDS:
+                return
+            self._last_change = now
+            rate = rate * (1 + RECOVER_STEP)
+            if self._ingests == 0:
+                rate = self.max_rate
+            elif self.max_rate is not None:
+                rate = min(rate, self.max_rate)
+        self.bucket.set_rate(rate)
@@ -0,0 +1,318 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from ioprio import lower_priority
+from media_date import JPEG_EXT, TIFF_EXT, exif_thumbnail
+
+try:
+    from PIL import Image
+except ImportError:
+    # without Pillow only the thumbnails cameras embed in EXIF are used
+    Image = None
+
+"""
+Thumbnails of newly ingested photos, for browsing what was just backed up.
+
+Thumbnailer takes file_done events from the ingest (the same events that feed
+sync_metrics.py) and makes a thumbnail of each new photo in a small process
+pool running at nice 19 / idle I/O priority, so it never competes with a sync.
+JPEGs are decoded at reduced scale (Pillow's draft mode, which makes libjpeg
+decode at 1/2 .. 1/8 size); raw files use the preview embedded in their EXIF.
+
+ThumbnailCache stores the thumbnails as JPEG files named after a fingerprint
+of the original's contents (size, first and last 64 KB), so a photo that is
+ingested twice shares one thumbnail. The cache is capped in bytes and evicts
+the least recently used thumbnails; an OrderedDict makes lookups and updates
+O(1), and the order survives restarts through the files' mtimes.
+
+The paths of the last ingest and their keys are written to last_ingest.json
+in the cache, which is what the menu pages through.
+"""
+
+THUMB_SIZE = 320
+THUMB_QUALITY = 80
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+FINGERPRINT_BYTES = 64 * 1024
+LAST_INGEST = "last_ingest.json"
+
+THUMB_EXT = JPEG_EXT | TIFF_EXT | {".png"}
+
+
+def content_key(path):
+    """ Returns a key for a file's contents from its size and its first and last FINGERPRINT_BYTES. """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update(size.to_bytes(8, "little"))
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > 2 * FINGERPRINT_BYTES:
+            f.seek(-FINGERPRINT_BYTES, os.SEEK_END)
+            digest.update(f.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def make_thumbnail(path, size=THUMB_SIZE):
+    """
+    Returns a JPEG thumbnail of a photo at most size pixels on its long side, or None.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if Image is None:
+        return exif_thumbnail(path)
+    try:
+        if ext in TIFF_EXT:
+            embedded = exif_thumbnail(path)
+            if embedded is None:
+                return None
+            image = Image.open(io.BytesIO(embedded))
+        else:
+            image = Image.open(path)
+            # let libjpeg decode at the smallest scale that is still >= size
+            image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        out = io.BytesIO()
+        image.convert("RGB").save(out, "JPEG", quality=THUMB_QUALITY)
+        return out.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return exif_thumbnail(path)
+
+
+def _worker_init():
+    lower_priority()
+
+
+def _thumbnail_job(path, size, cached_keys_dir):
+    """ Runs in the pool: returns (key, JPEG bytes), bytes None if the key is already cached. """
+    key = content_key(path)
+    if os.path.exists(ThumbnailCache.path_in(cached_keys_dir, key)):
+        return key, None
+    return key, make_thumbnail(path, size)
+
+
+class ThumbnailCache:
+    """
+    Size capped, content addressed store of thumbnails with LRU eviction.
+    """
+
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_BYTES):
+        """
+        Initializes the ThumbnailCache, picking up thumbnails already on disk.
+
+        Args:
+            cache_dir (str): Directory holding the thumbnails.
+            max_bytes (int): Thumbnails are evicted, least recently used first, above this size.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # key -> size, least recently used first
+        os.makedirs(cache_dir, exist_ok=True)
+
+        found = []
+        for sub in os.scandir(cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".jpg"):
+                    st = entry.stat()
+                    found.append((st.st_mtime_ns, entry.name[:-4], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.bytes += size
+        self._evict()
+
+    @staticmethod
+    def path_in(cache_dir, key):
+        return os.path.join(cache_dir, key[:2], key + ".jpg")
+
+    def path(self, key):
+        return self.path_in(self.cache_dir, key)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns:
+            str: Path of the thumbnail, marked as most recently used, or None if not cached.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self.path(key)
+        try:
+            # keeps the LRU order across restarts
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.bytes -= self._entries.pop(key, 0)
+            return None
+        return path
+
+    def put(self, key, data):
+        """ Stores a thumbnail and evicts old ones if the cache is over its size. """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self.bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.bytes -= size
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+
+class Thumbnailer:
+    """
+    Makes thumbnails of newly ingested photos in a low priority process pool.
+    """
+
+    def __init__(self, cache, root, workers=1, size=THUMB_SIZE):
+        """
+        Initializes the Thumbnailer.
+
+        Args:
+            cache (ThumbnailCache): Where thumbnails are stored.
+            root (str): The local backup directory; ingest events into it are picked up.
+            workers (int): Number of thumbnail processes.
+            size (int): Long side of the thumbnails in pixels.
+        """
+        self.cache = cache
+        self.root = os.path.abspath(root)
+        self.workers = max(1, int(workers))
+        self.size = size
+        self._pool = None
+        self._lock = threading.Lock()
+        self._keys = {}          # relative path -> content key
+        self._last_ingest = []   # relative paths of the last ingest, in ingest order
+        self._pending = 0
+
+    def start(self):
+        # forkserver: forking the threaded backup process directly could copy held locks
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"),
+                                         initializer=_worker_init)
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self.save_last_ingest()
+
+    def handle_event(self, event):
+        """ Sync event callback: an ingest into root starts a new last ingest, each new photo gets a thumbnail. """
+        if os.path.abspath(event.get("dest", "")) != self.root:
+            return
+        if event.get("event") == "run_start":
+            with self._lock:
+                self._last_ingest = []
+        elif event.get("event") == "file_done" and event.get("path"):
+            self.submit(event["path"])
+
+    def submit(self, rel_path):
+        """ Queues a thumbnail for a file under root. """
+        if os.path.splitext(rel_path)[1].lower() not in THUMB_EXT or self._pool is None:
+            return
+        with self._lock:
+            self._last_ingest.append(rel_path)
+            self._pending += 1
+        try:
+            future = self._pool.submit(_thumbnail_job, os.path.join(self.root, rel_path), self.size,
+                                       self.cache.cache_dir)
+        except RuntimeError:
+            # pool shut down
+            with self._lock:
+                self._pending -= 1
+            return
+        future.add_done_callback(lambda f: self._done(rel_path, f))
+
+    def _done(self, rel_path, future):
+        try:
+            key, data = future.result()
+            if data is not None:
+                self.cache.put(key, data)
+            with self._lock:
+                self._keys[rel_path] = key
+        except Exception:
+            # cancelled, unreadable or undecodable: no thumbnail
+            pass
+        with self._lock:
+            self._pending -= 1
+            idle = self._pending == 0
+        if idle:
+            self.save_last_ingest()
+
+    def pending(self):
+        return self._pending
+
+    def last_ingest(self):
+        """ Returns the relative paths of the last ingest that have thumbnails. """
+        with self._lock:
+            return [rel_path for rel_path in self._last_ingest if rel_path in self._keys]
+
+    def thumbnail(self, rel_path):
+        """ Returns the path of a file's thumbnail, or None. """
+        key = self._keys.get(rel_path)
+        return self.cache.get(key) if key else None
+
+    def save_last_ingest(self):
+        """ Writes the last ingest's paths and thumbnail keys for other processes (the menu). """
+        with self._lock:
+            files = [[rel_path, self._keys[rel_path]] for rel_path in self._last_ingest if rel_path in self._keys]
+        if not files:
+            return
+        path = os.path.join(self.cache.cache_dir, LAST_INGEST)
+        try:
+            with open(path + ".tmp", 'w') as f:
+                json.dump({"root": self.root, "files": files}, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Error saving '{path}': {e}")
+
+
+def load_last_ingest(cache_dir):
+    """
+    Returns:
+        list: (relative path, key) of the last ingest saved by a Thumbnailer.
+    """
+    try:
+        with open(os.path.join(cache_dir, LAST_INGEST), 'r') as f:
+            return [tuple(item) for item in json.load(f)["files"]]
+    except (OSError, ValueError, KeyError):
+        return []
+
+# Example Usage:
+#   python thumbnail_cache.py <cache_dir> <photo> [photo...]
+if __name__ == "__main__":
+    import sys
+
+    cache = ThumbnailCache(sys.argv[1])
+    for photo in sys.argv[2:]:
+        key = content_key(photo)
+        if key not in cache:
+            data = make_thumbnail(photo)
+            if data is None:
+                print(f"{photo}: no thumbnail")
+                continue
+            cache.put(key, data)
+        print(f"{photo}: {cache.get(key)}")
+    print(f"{len(cache)} thumbnails, {cache.bytes / 1e6:.1f} MB")